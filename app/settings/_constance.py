@@ -20,6 +20,44 @@ CONSTANCE_CONFIG = {
         "Gmail client secret",
         "gmail_web_client_secret",
     ),
+    "GMAIL_USE_HISTORY_SYNC": (
+        False,
+        "Only fetch the messages that were added since the last sync instead of"
+        " listing every unread thread.",
+        bool,
+    ),
+    "GMAIL_INGESTION_WORKERS": (
+        1,
+        "How many threads are fetched and parsed at the same time when new"
+        " messages are pulled from Gmail. 1 processes threads one after another.",
+        int,
+    ),
+    "GMAIL_PARSE_PROCESSES": (
+        1,
+        "How many processes parse the messages of every batch of threads when"
+        " GMAIL_INGESTION_WORKERS is 1, e.g. to work through a large backlog."
+        " 1 parses them on the ingestion process.",
+        int,
+    ),
+    "GMAIL_TWO_PHASE_FETCH": (
+        False,
+        "Fetch only the sender and subject of new messages first and skip downloading"
+        " messages that are already stored or that are from senders who aren't users.",
+        bool,
+    ),
+    "GMAIL_PROCESSED_LABEL": (
+        "",
+        "A Gmail label that is added to every message once it's stored. Threads with"
+        " the label are skipped so a restarted sync doesn't redo finished work."
+        " Leave it empty to only mark messages as read.",
+        str,
+    ),
+    "GMAIL_PUSH_TOPIC": (
+        "",
+        "The Pub/Sub topic Gmail publishes mailbox changes to. Format:"
+        " projects/<project id>/topics/<topic name>",
+        str,
+    ),
     "SUBJECT_LINE_PARSER_CONFIDENCE": (
         85,
         "The minimum score required for a message type or job name to be pulled from an"
@@ -32,6 +70,14 @@ CONSTANCE_CONFIG = {
 CONSTANCE_CONFIG_FIELDSETS = {
     #'User Settings': ('SEND_ALL_USERS_NOTIFICATIONS', 'ACCEPT_ONLY_MESSAGES_FROM_APPROVED_USERS'),
     "General Settings": ("DEFAULT_TIMEZONE",),
-    "Gmail Settings": ("GMAIL_WEB_CLIENT_SECRET",),
+    "Gmail Settings": (
+        "GMAIL_WEB_CLIENT_SECRET",
+        "GMAIL_USE_HISTORY_SYNC",
+        "GMAIL_INGESTION_WORKERS",
+        "GMAIL_PARSE_PROCESSES",
+        "GMAIL_TWO_PHASE_FETCH",
+        "GMAIL_PROCESSED_LABEL",
+        "GMAIL_PUSH_TOPIC",
+    ),
     "Email Parser Settings": ("SUBJECT_LINE_PARSER_CONFIDENCE",),
 }
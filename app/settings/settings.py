@@ -22,6 +22,11 @@ DOMAIN_URL = os.environ["DOMAIN_URL"]
 # the cron user should be a normal user not a superuser
 CRON_USER_NAME = os.environ["CRON_USER_NAME"]
 CRON_USER_PASSWORD = os.environ["CRON_USER_PASSWORD"]
+# added as ?token= to the Pub/Sub push subscription url so only Google can trigger a sync
+GMAIL_PUSH_VERIFICATION_TOKEN = os.getenv("GMAIL_PUSH_VERIFICATION_TOKEN", "")
+# how html email bodies are turned into text, see rfis.email_parser.html_backends,
+# "selectolax" needs the selectolax package which isn't in requirements.txt
+HTML_TO_TEXT_BACKEND = os.getenv("HTML_TO_TEXT_BACKEND", "beautifulsoup")
 
 
 LOGIN_URL = "/user/login/"
@@ -93,6 +98,14 @@ else:
         }
     }
 
+# shared by every web and worker process, created with python manage.py createcachetable
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "rfis_cache",
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": (
@@ -13,6 +13,65 @@ class GmailCredentialsAdmin(admin.ModelAdmin):
     pass
 
 
+class GmailSyncStateAdmin(admin.ModelAdmin):
+    list_display = ("history_id", "last_synced")
+
+
+class IngestionHeartbeatAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "status",
+        "last_heartbeat",
+        "last_run_finished",
+        "last_run_message_count",
+    )
+
+
+class DeadLetterMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        "message_id",
+        "thread_id",
+        "stage",
+        "status",
+        "attempts",
+        "last_failed",
+        "next_attempt_at",
+    )
+    list_filter = ("status", "stage")
+    search_fields = ("message_id", "thread_id")
+    readonly_fields = (
+        "message_id",
+        "thread_id",
+        "stage",
+        "payload",
+        "error",
+        "attempts",
+        "first_failed",
+        "last_failed",
+    )
+    actions = ["retry_now"]
+
+    @admin.action(description="Retry the selected messages on the next ingestion run")
+    def retry_now(self, request, queryset):
+        for dead_letter in queryset:
+            dead_letter.retry_now()
+
+
+class IngestionRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "worker_name",
+        "mode",
+        "status",
+        "started",
+        "duration",
+        "threads_seen",
+        "messages_created",
+        "threads_failed",
+    )
+    list_filter = ("status", "mode", "worker_name")
+    readonly_fields = [field.name for field in m.IngestionRun._meta.fields]
+
+
 class MyUserDashboardFilter(AutocompleteFilter):
     title = "User"  # display title
     field_name = "owner"  # name of the foreign key field
@@ -95,5 +154,9 @@ admin.site.register(m.Thread)
 admin.site.register(m.Message, MessageAdmin)
 admin.site.register(m.Attachment, AttachmentAdmin)
 admin.site.register(m.GmailCredentials, GmailCredentialsAdmin)
+admin.site.register(m.GmailSyncState, GmailSyncStateAdmin)
+admin.site.register(m.IngestionHeartbeat, IngestionHeartbeatAdmin)
+admin.site.register(m.IngestionRun, IngestionRunAdmin)
+admin.site.register(m.DeadLetterMessage, DeadLetterMessageAdmin)
 
 admin.site.register(Permission, PermissionAdmin)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class RfisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rfis'
+
+    def ready(self):
+        # connects the model signal receivers
+        from . import signals  # noqa: F401
+
+        # registers the system checks
+        from . import checks  # noqa: F401
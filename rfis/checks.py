@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from django.core.exceptions import ImproperlyConfigured
+
+from .email_parser import html_backends
+
+
+@register()
+def check_html_to_text_backend(app_configs, **kwargs):
+    """
+    Fails at startup instead of on the first html email when the backend can't load.
+    """
+    try:
+        html_backends.get_backend(settings.HTML_TO_TEXT_BACKEND)
+    except ImproperlyConfigured as error:
+        return [
+            Error(
+                str(error),
+                hint="The lxml and beautifulsoup backends are always installed.",
+                id="rfis.E001",
+            )
+        ]
+    return []
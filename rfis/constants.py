@@ -8,6 +8,56 @@ GMAIL_API_SCOPES = [
     "https://www.googleapis.com/auth/gmail.modify",
 ]
 GMAIL_API_SESSION_STATE_FIELDNAME = "state"
+# the most calls Gmail will accept in a single batch http request
+GMAIL_API_MAX_BATCH_SIZE = 100
+# the most message ids Gmail will accept in a single batchModify call
+GMAIL_API_MAX_BATCH_MODIFY_SIZE = 1000
+# threads that are processed before their messages are marked as read even if
+# there aren't enough of them to fill a batchModify call
+GMAIL_MARK_READ_FLUSH_THREADS = 25
+# a message that keeps failing is retried this many times before it's given up on
+DEAD_LETTER_MAX_ATTEMPTS = 5
+# seconds, the wait before the next retry doubles after every failed attempt
+DEAD_LETTER_BACKOFF_BASE = 300
+DEAD_LETTER_BACKOFF_MAX = 24 * 60 * 60
+# the only headers needed to decide if a message is worth downloading in full
+GMAIL_METADATA_HEADERS = ["From", "Subject"]
+# shared cache key that changes whenever a job or thread type name changes
+PARSER_VOCABULARY_VERSION_KEY = "rfis:parser_vocabulary_version"
+# seconds a process keeps using its vocabulary before checking the version again
+PARSER_VOCABULARY_CHECK_INTERVAL = 5
+# distinct subject lines whose thread type and job name are remembered per process
+SUBJECT_LINE_CACHE_SIZE = 4096
+# seconds before the access token expires that it's refreshed
+GMAIL_TOKEN_REFRESH_MARGIN = 300
+# https://developers.google.com/gmail/api/reference/quota
+GMAIL_API_QUOTA_UNITS_PER_SECOND = 250
+GMAIL_API_DEFAULT_QUOTA_COST = 5
+GMAIL_API_QUOTA_COSTS = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.watch": 100,
+    "gmail.users.stop": 50,
+    "gmail.users.history.list": 2,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.messages.batchModify": 50,
+    "gmail.users.threads.list": 10,
+    "gmail.users.threads.get": 10,
+    "gmail.users.labels.list": 1,
+    "gmail.users.labels.create": 5,
+}
+GMAIL_API_MAX_RETRIES = 5
+# seconds, the backoff doubles on every retry up to the max
+GMAIL_API_BACKOFF_BASE = 1
+GMAIL_API_BACKOFF_MAX = 32
+GMAIL_API_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+INGESTION_WORKER_NAME = "gmail"
+# seconds without a heartbeat before the ingestion worker is considered dead
+INGESTION_HEARTBEAT_TIMEOUT = 120
+# seconds between heartbeats while the ingestion worker is busy or idle
+INGESTION_HEARTBEAT_INTERVAL = 15
 
 FIELD_VALUE_UNKNOWN_JOB = "Unknown"
 FIELD_VALUE_UNKNOWN_THREAD_TYPE = "Unknown"
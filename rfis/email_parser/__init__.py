@@ -1,5 +1,6 @@
 from .base_parsers import *
 from .content_parsers import *
 from .gmail_parser import *
+from .matchers import *
 from .reply_parser import *
 from .subjectline_parser import *
@@ -1,25 +1,62 @@
 import re
 from base64 import urlsafe_b64decode
+from typing import Tuple
 
-from bs4 import BeautifulSoup
-
+from . import html_backends
 from .base_parsers import BaseBodyParser
 from .reply_parser import EmailReplyParser
 
 
+HTML_BODY_PATTERN = re.compile(r"(From|To|RE|FWD|FW|wrote):")
+BRACKET_EMAIL_PATTERN = re.compile(r"<([a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+)>")
+
+
+def decode_body(data) -> str:
+    return urlsafe_b64decode(data).decode()
+
+
+def get_text(markup: str) -> str:
+    """
+    The text of markup with every string stripped and joined by a space.
+    Text without a tag or an entity is a single string to every html parser so
+    it's only stripped, which saves parsing most plain text bodies.
+    """
+    if "<" not in markup and "&" not in markup:
+        return markup.strip()
+    return html_backends.get_backend().get_text(markup)
+
+
+def html_body(decoded_data: str) -> Tuple[str, str]:
+    """
+    Returns (debug_unparsed_body, body) of a text/html part.
+    """
+    text = get_text(decoded_data)
+    if match := re.search(HTML_BODY_PATTERN, text):
+        return text, text[: match.span()[0]]
+    return text, text
+
+
+def plain_text_body(decoded_data: str) -> Tuple[str, str]:
+    """
+    Returns (debug_unparsed_body, body) of a text/plain part.
+    """
+    # removes brackets on email addresses <address> -> address
+    # so beautifulsoup doesnt remove them
+    text = get_text(re.sub(BRACKET_EMAIL_PATTERN, r"\1", decoded_data))
+    # store all of the text before the regex is applied for debugging
+    return text, EmailReplyParser.parse_reply(text)
+
+
 class HtmlParser(BaseBodyParser):
-    HTML_BODY_PATTERN = re.compile(r"(From|To|RE|FWD|FW|wrote):")
+    HTML_BODY_PATTERN = HTML_BODY_PATTERN
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
     def _parse_body(self, data):
-        soup = BeautifulSoup(urlsafe_b64decode(data).decode(), "html.parser")
-        text = soup.get_text(" ", strip=True)
-        self._chosen["debug_unparsed_body"].append(text)  # str(soup.prettify())
-        if match := re.search(self.HTML_BODY_PATTERN, text):
-            return text[: match.span()[0]]
-        return text
+        text, body = html_body(decode_body(data))
+        self._chosen["debug_unparsed_body"].append(text)
+        return body
 
     def _parse_parts(self, parts):
         assert parts, f"Parts cannot be {parts}"
@@ -35,32 +72,15 @@ class HtmlParser(BaseBodyParser):
 
 
 class PlainTextParser(BaseBodyParser):
-    BRACKET_EMAIL_PATTERN = re.compile(
-        r"<([a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+)>"
-    )
+    BRACKET_EMAIL_PATTERN = BRACKET_EMAIL_PATTERN
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
     def _parse_body(self, data):
-        decoded_data = urlsafe_b64decode(data).decode()
-        # removes brackets on email addresses <address> -> address
-        # so beautifulsoup doesnt remove them
-        decoded_data = re.sub(self.BRACKET_EMAIL_PATTERN, r"\1", decoded_data)
-        soup = BeautifulSoup(decoded_data, "html.parser")
-        text = soup.get_text(" ", strip=True)
-
-        # print(
-        #     "\n################## start decoded_data text: ##########################\n",
-        #     text,
-        #     "\n######################### end decoded_data text"
-        #     " ##############################\n",
-        # )
-
-        self._chosen["debug_unparsed_body"].append(
-            text
-        )  # store all of the text before the regex is applied for debugging
-        return EmailReplyParser.parse_reply(text)
+        text, body = plain_text_body(decode_body(data))
+        self._chosen["debug_unparsed_body"].append(text)
+        return body
 
     def _parse_parts(self, parts):
         assert parts, f"Parts cannot be {parts}"
@@ -76,67 +96,93 @@ class PlainTextParser(BaseBodyParser):
 
 
 class MultiPartParser(BaseBodyParser):
+    """
+    Walks the part tree of a payload once, decoding the text/plain and text/html
+    parts and collecting attachments along the way. Turning the decoded parts into
+    text is the expensive part so it's only done for the representation that's
+    asked for, e.g. the html parts are never parsed when the plain text has a body.
+    """
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self._prefer_html = kwargs.get("prefer_html", True)
         self._are_attachments = kwargs.get("are_attachments", False)
-        self._html_parser = HtmlParser()
-        self._text_parser = PlainTextParser()
 
     def parse(self, payload):
         self._clear()
-        self._chosen["body"] = []
-        self._chosen["debug_unparsed_body"] = []
         self._chosen["files_info"] = []
-        self._html_parser.parse(payload)
-        self._text_parser.parse(payload)
+        self._chosen["html_parts"] = []
+        self._chosen["text_parts"] = []
         if message_parts := payload.get("parts"):
-            self._parse_attachments(message_parts)
+            self._walk_parts(message_parts)
+        else:
+            # a single part message is tried as both html and plain text
+            decoded_data = decode_body(payload.get("body", {}).get("data"))
+            self._chosen["html_parts"].append(decoded_data)
+            self._chosen["text_parts"].append(decoded_data)
         self._is_parsed = True
 
-    def _parse_attachments(self, parts):
+    def _walk_parts(self, parts):
         assert parts, f"Parts cannot be {parts}"
+        # attachments can be included multiple times so only add them once
         unique_attachment_ids = set()
         for p in parts:
-            filename = p.get("filename")
-            attachment_id = p.get("body", {}).get("attachmentId")
             mimeType = p.get("mimeType")
             body = p.get("body")
             data = body.get("data")
-            file_size = body.get("size")
-            p_headers = p.get("headers")
             if p.get("parts"):
-                self._parse_attachments(p.get("parts"))
+                self._walk_parts(p.get("parts"))
+
+            if mimeType == "text/html":
+                self._chosen["html_parts"].append(decode_body(data))
+            elif mimeType == "text/plain" and data:
+                self._chosen["text_parts"].append(decode_body(data))
+
+            filename = p.get("filename")
+            attachment_id = body.get("attachmentId")
             if (
                 filename != ""
                 and attachment_id
-                and attachment_id
-                not in unique_attachment_ids  # attachments can be included multiple times so only add them once
+                and attachment_id not in unique_attachment_ids
             ):
                 unique_attachment_ids.add(attachment_id)
                 self._chosen["files_info"].append(
                     {"filename": filename, "gmail_attachment_id": attachment_id}
                 )
 
+    def _texts(self, kind, to_text):
+        """
+        Returns (debug_unparsed_body, body) of every part of a kind, worked out once.
+        """
+        assert self._is_parsed
+        if kind not in self._chosen:
+            texts = [to_text(data) for data in self._chosen[f"{kind}_parts"]]
+            self._chosen[kind] = (
+                "".join(text for text, _ in texts),
+                "".join(body for _, body in texts),
+            )
+        return self._chosen[kind]
+
+    def _html(self):
+        return self._texts("html", html_body)
+
+    def _text(self):
+        return self._texts("text", plain_text_body)
+
+    def _choose(self, index):
+        if self._prefer_html and self._html()[index]:
+            return self._html()[index]
+        elif self._text()[index]:
+            return self._text()[index]
+        return self._text()[index] + self._html()[index]
+
     @property
     def body(self):
-        assert self._is_parsed
-        if self._prefer_html and self._html_parser.body:
-            return self._html_parser.body
-        elif self._text_parser.body:
-            return self._text_parser.body
-        return self._text_parser.body + self._html_parser.body
+        return self._choose(1)
 
     @property
     def debug_unparsed_body(self):
-        assert self._is_parsed
-        if self._prefer_html and self._html_parser.debug_unparsed_body:
-            return self._html_parser.debug_unparsed_body
-        elif self._text_parser.debug_unparsed_body:
-            return self._text_parser.debug_unparsed_body
-        return (
-            self._text_parser.debug_unparsed_body + self._html_parser.debug_unparsed_body
-        )
+        return self._choose(0)
 
     @property
     def files_info(self):
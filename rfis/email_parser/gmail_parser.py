@@ -1,50 +1,246 @@
+import multiprocessing
 import re
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, NamedTuple, Tuple
 
+import django
+from constance import config
+from django import db
+
+from .. import constants as c
 from .base_parsers import BaseParser
 from .content_parsers import MultiPartParser
-from .subjectline_parser import SubjectLineParser
+from .subjectline_parser import SubjectLineParser, match_subject_line
+from .vocabulary import Vocabulary, get_vocabulary
 
+EMAIL_ADDRESS_PATTERN = re.compile(r"([a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+)")
+NO_SUBJECT = "(No Subject)"
 
-class GmailParser(BaseParser):
-    EMAIL_ADDRESS_PATTERN = re.compile(
-        r"([a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+)"
+
+class AttachmentInfo(NamedTuple):
+    filename: str
+    gmail_attachment_id: str
+
+
+class ParsedMessage(NamedTuple):
+    """
+    Everything that's parsed out of a gmail message. It can't be changed once it's
+    made and pickles small, so it can be handed to other threads or sent back from
+    a worker process.
+    """
+
+    message_id: str
+    thread_id: str
+    mime_type: str
+    subject: str
+    body: str
+    debug_unparsed_body: str
+    fromm: str
+    to: str
+    cc: str
+    date: str
+    x_mailer: str
+    thread_type: str
+    job_name: str
+    files_info: Tuple[AttachmentInfo, ...]
+
+    def as_dict(self):
+        """
+        The dict create_db_entry takes, the same as GmailParser.as_dict.
+        """
+        return {
+            "message_id": self.message_id,
+            "thread_id": self.thread_id,
+            "subject": self.subject,
+            "body": self.body,
+            "debug_unparsed_body": self.debug_unparsed_body,
+            "fromm": self.fromm,
+            "to": self.to,
+            "cc": self.cc,
+            "date": self.date,
+            "thread_type": self.thread_type,
+            "job_name": self.job_name,
+            "files_info": [info._asdict() for info in self.files_info],
+        }
+
+
+def parse_email_addresses(email_string: str) -> List[str]:
+    # addresses are kept in the order they're first seen so every process
+    # picks the same one, a set's order changes with the hash seed
+    address_or_addresses = list(dict.fromkeys(EMAIL_ADDRESS_PATTERN.findall(email_string)))
+    return address_or_addresses or [""]
+
+
+def parse_headers(headers, internal_date) -> dict:
+    parsed = {
+        "Subject": "Unknown",
+        "From": "Unknown",
+        "To": "Unknown",
+        # internalDate is more accurate than Date header
+        "Date": internal_date,
+        "x_mailer": "Unknown",
+    }
+    for h in headers or []:
+        head = h.get("name")
+        value = h.get("value")
+        if head == "Subject":
+            parsed["Subject"] = value
+        elif head == "From":
+            parsed["From"] = parse_email_addresses(value)[0]
+        elif head == "To":
+            parsed["To"] = " ".join(parse_email_addresses(value))
+        elif head == "Cc":
+            parsed["Cc"] = " ".join(parse_email_addresses(value))
+        elif head == "X-Mailer":
+            parsed["x_mailer"] = value
+    return parsed
+
+
+def _read_message(gmail_message) -> Tuple[dict, ParsedMessage]:
+    """
+    Returns (headers, message) where the message's subject, thread type and job
+    name are left for the subject line match to fill in.
+    """
+    payload = gmail_message.get("payload")
+    assert payload, "Payload cannot be None"
+    headers = parse_headers(payload.get("headers"), gmail_message["internalDate"])
+    body_parser = MultiPartParser(prefer_html=False)
+    body_parser.parse(payload)
+    message = ParsedMessage(
+        message_id=gmail_message["id"],
+        thread_id=gmail_message["threadId"],
+        mime_type=payload.get("mimeType"),
+        subject=NO_SUBJECT,
+        body=body_parser.body,
+        debug_unparsed_body=body_parser.debug_unparsed_body,
+        fromm=headers["From"],
+        to=headers["To"],
+        cc=headers.get("Cc", ""),
+        date=headers["Date"],
+        x_mailer=headers["x_mailer"],
+        thread_type=c.FIELD_VALUE_UNKNOWN_THREAD_TYPE,
+        job_name=c.FIELD_VALUE_UNKNOWN_JOB,
+        files_info=tuple(AttachmentInfo(**info) for info in body_parser.files_info),
+    )
+    return headers, message
+
+
+def parse_message(gmail_message, vocabulary: Vocabulary, min_score) -> ParsedMessage:
+    """
+    Parses a gmail message without touching the database, the subject line is matched
+    against vocabulary with min_score as the confidence. Matches go through this
+    process's subject line cache, which is keyed by the vocabulary version so the
+    result only depends on the arguments.
+    """
+    headers, message = _read_message(gmail_message)
+    subject, thread_type, job_name = match_subject_line(
+        headers["Subject"], vocabulary, min_score
+    )
+    return message._replace(
+        subject=subject or NO_SUBJECT, thread_type=thread_type, job_name=job_name
     )
 
+
+# set in every worker process by _init_parse_process
+_process_vocabulary = None
+_process_min_score = None
+
+
+def _init_parse_process(vocabulary, min_score):
+    global _process_vocabulary, _process_min_score
+    # a no-op for forked workers, others have to load the apps themselves
+    django.setup()
+    _process_vocabulary = vocabulary
+    _process_min_score = min_score
+
+
+def _parse_in_process(gmail_message):
+    try:
+        return parse_message(gmail_message, _process_vocabulary, _process_min_score), None
+    except Exception as error:
+        return None, error
+
+
+def parse_messages_in_processes(
+    gmail_messages: Iterable[dict],
+    vocabulary: Vocabulary = None,
+    min_score=None,
+    max_workers=None,
+    chunksize=20,
+) -> Tuple[List[ParsedMessage], List[Tuple[dict, Exception]]]:
+    """
+    Parses messages on a pool of processes for backlogs where parsing, not Gmail or
+    the database, is the bottleneck. Returns (ParsedMessage records in the order the
+    messages were given, [(message, error)]). The vocabulary and confidence are read
+    once here and sent to each worker.
+
+    The database connections are closed first so forked workers don't share them.
+    That can't be done inside a transaction so the messages are parsed in this
+    process instead.
+    """
+    gmail_messages = list(gmail_messages)
+    vocabulary = vocabulary or get_vocabulary()
+    if min_score is None:
+        min_score = config.SUBJECT_LINE_PARSER_CONFIDENCE
+    parsed_messages = []
+    failures = []
+    if not gmail_messages:
+        return parsed_messages, failures
+    if any(connection.in_atomic_block for connection in db.connections.all()):
+        for gmail_message in gmail_messages:
+            try:
+                parsed_messages.append(parse_message(gmail_message, vocabulary, min_score))
+            except Exception as error:
+                failures.append((gmail_message, error))
+        return parsed_messages, failures
+    db.connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("fork")
+        if "fork" in multiprocessing.get_all_start_methods()
+        else None,
+        initializer=_init_parse_process,
+        initargs=(vocabulary, min_score),
+    ) as executor:
+        results = executor.map(_parse_in_process, gmail_messages, chunksize=chunksize)
+        for gmail_message, (parsed, error) in zip(gmail_messages, results):
+            if error is None:
+                parsed_messages.append(parsed)
+            else:
+                failures.append((gmail_message, error))
+    return parsed_messages, failures
+
+
+class GmailParser(BaseParser):
+    EMAIL_ADDRESS_PATTERN = EMAIL_ADDRESS_PATTERN
+
     def __init__(self) -> None:
         super().__init__()
         self._subject_parser = SubjectLineParser()
+        self._message = None
 
     def __repr__(self) -> str:
-        return str(self._chosen)
+        return str(self._message)
 
     def parse(self, gmail_message):
         self._clear()
+        self._message = None
         if not gmail_message:
             return
-        self._chosen["message_id"] = gmail_message["id"]
-        self._chosen["thread_id"] = gmail_message["threadId"]
-        self._chosen["headers"] = {
-            "Subject": "Unknown",
-            "From": "Unknown",
-            "To": "Unknown",
-            # internalDate is more accurate than Date header
-            "Date": gmail_message["internalDate"],
-            "x_mailer": "Unknown",
-        }
-        payload = gmail_message.get("payload")
-        # print("\npayload: ", payload, "\n")
-        assert payload, "Payload cannot be None"
-        # set mime type for later use
-        self._chosen["mime_type"] = payload.get("mimeType")
-        # headers have to be parsed for the body parser to be picked
-        self._parse_headers(payload.get("headers"))
-        self._body_parser = MultiPartParser(prefer_html=False)
-        self._body_parser.parse(payload)
-
+        self._chosen["headers"], message = _read_message(gmail_message)
         self._subject_parser.parse(self._chosen["headers"]["Subject"])
+        self._message = message._replace(
+            subject=self._subject_parser.parsed_subject_line or NO_SUBJECT,
+            thread_type=self._subject_parser.thread_type,
+            job_name=self._subject_parser.job_name,
+        )
         self._is_parsed = True
 
+    @property
+    def parsed_message(self) -> ParsedMessage:
+        assert self._is_parsed
+        return self._message
+
     def format_test_data(self, character_to_replace=" "):
         return {
             "message_id": self.message_id,
@@ -62,62 +258,54 @@ class GmailParser(BaseParser):
             "files_info": self.files_info,
         }
 
-    def _parse_headers(self, headers, *args, **kwargs):
-        if not headers:
-            return
-        for h in headers:
-            head = h.get("name")
-            value = h.get("value")
-            if head == "Subject":
-                self._chosen["headers"]["Subject"] = value
-            elif head == "From":
-                self._chosen["headers"]["From"] = self._parse_email_address(value)[0]
-            elif head == "To":
-                self._chosen["headers"]["To"] = " ".join(self._parse_email_address(value))
-            elif head == "Cc":
-                self._chosen["headers"]["Cc"] = " ".join(self._parse_email_address(value))
-            elif head == "X-Mailer":
-                self._chosen["headers"]["x_mailer"] = value
-
-    def _parse_email_address(self, email_string: str):
-        address_or_addresses: List[str] = re.findall(
-            self.EMAIL_ADDRESS_PATTERN, email_string
-        )
-        if not address_or_addresses:
-            return [""]
-        return list(set(address_or_addresses))
+    def parse_metadata(self, gmail_message):
+        """
+        Reads only the ids, sender and subject of a message. Works on messages fetched
+        with format="metadata" so we can decide if it's worth downloading the full message.
+        """
+        headers = {
+            h.get("name"): h.get("value")
+            for h in gmail_message.get("payload", {}).get("headers") or []
+        }
+        return {
+            "message_id": gmail_message["id"],
+            "thread_id": gmail_message["threadId"],
+            "fromm": parse_email_addresses(headers["From"])[0]
+            if "From" in headers
+            else "Unknown",
+            "subject": headers.get("Subject", "Unknown"),
+        }
+
+    def as_dict(self):
+        """
+        A copy of everything that was parsed that can be handed to another
+        thread while this parser moves on to the next message.
+        """
+        return self.parsed_message.as_dict()
 
     @property
     def message_id(self):
-        assert self._is_parsed
-        return self._chosen["message_id"]
+        return self.parsed_message.message_id
 
     @property
     def thread_id(self):
-        assert self._is_parsed
-        return self._chosen["thread_id"]
+        return self.parsed_message.thread_id
 
     @property
     def mime_type(self):
-        assert self._is_parsed
-        return self._chosen["mime_type"]
+        return self.parsed_message.mime_type
 
     @property
     def body(self):
-        assert self._is_parsed
-        return "".join(self._body_parser.body)
+        return self.parsed_message.body
 
     @property
     def debug_unparsed_body(self):
-        assert self._is_parsed
-        return "".join(self._body_parser.debug_unparsed_body)
+        return self.parsed_message.debug_unparsed_body
 
     @property
     def files_info(self):
-        assert self._is_parsed
-        if isinstance(self._body_parser, MultiPartParser):
-            return self._body_parser.files_info
-        return []
+        return [info._asdict() for info in self.parsed_message.files_info]
 
     @property
     def headers(self):
@@ -126,40 +314,32 @@ class GmailParser(BaseParser):
 
     @property
     def subject(self):
-        assert self._is_parsed
-        return self._subject_parser.parsed_subject_line if self._subject_parser.parsed_subject_line else "(No Subject)"
+        return self.parsed_message.subject
 
     @property
     def fromm(self):
-        assert self._is_parsed
-        return self._chosen["headers"]["From"]
+        return self.parsed_message.fromm
 
     @property
     def to(self):
-        assert self._is_parsed
-        return self._chosen["headers"]["To"]
+        return self.parsed_message.to
 
     @property
     def cc(self):
-        assert self._is_parsed
-        return self._chosen["headers"].get("Cc", "")
+        return self.parsed_message.cc
 
     @property
     def date(self):
-        assert self._is_parsed
-        return self._chosen["headers"]["Date"]
+        return self.parsed_message.date
 
     @property
     def x_mailer(self):
-        assert self._is_parsed
-        return self._chosen["headers"]["x_mailer"]
+        return self.parsed_message.x_mailer
 
     @property
     def thread_type(self):
-        assert self._is_parsed
-        return self._subject_parser.thread_type
+        return self.parsed_message.thread_type
 
     @property
     def job_name(self):
-        assert self._is_parsed
-        return self._subject_parser.job_name
+        return self.parsed_message.job_name
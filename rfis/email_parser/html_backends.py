@@ -0,0 +1,158 @@
+"""
+Ways of turning html into the text the body parsers work with. BeautifulSoup with
+html.parser is the reference every other backend is compared against, see the
+compare_html_backends command. The backend is picked with settings.HTML_TO_TEXT_BACKEND.
+
+lxml is in requirements.txt but selectolax is optional, install it before picking its
+backend. The rfis.E001 system check reports a backend that can't be loaded.
+"""
+import difflib
+import time
+from functools import lru_cache
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+REFERENCE_BACKEND = "beautifulsoup"
+# the text of these elements isn't part of get_text in BeautifulSoup either
+SKIPPED_TAGS = frozenset(("script", "style", "template"))
+
+
+class HtmlToTextBackend:
+    """
+    get_text returns every string of markup stripped and joined by a space, like
+    BeautifulSoup's get_text(" ", strip=True).
+    """
+
+    name = ""
+
+    def get_text(self, markup: str) -> str:
+        raise NotImplementedError()
+
+
+class BeautifulSoupBackend(HtmlToTextBackend):
+    name = REFERENCE_BACKEND
+
+    def get_text(self, markup: str) -> str:
+        return BeautifulSoup(markup, "html.parser").get_text(" ", strip=True)
+
+
+class LxmlBackend(HtmlToTextBackend):
+    name = "lxml"
+
+    def __init__(self) -> None:
+        from lxml import etree, html
+
+        self._etree = etree
+        self._html = html
+        # str input can't have an encoding declaration so always parse utf8 bytes
+        self._parser = html.HTMLParser(encoding="utf-8")
+
+    def get_text(self, markup: str) -> str:
+        try:
+            root = self._html.document_fromstring(markup.encode("utf8"), parser=self._parser)
+        except self._etree.ParserError:
+            # nothing but whitespace or comments
+            return ""
+        return " ".join(text for text in map(str.strip, self._strings(root)) if text)
+
+    def _strings(self, root):
+        # elements are walked without recursion since mail can be nested very deeply
+        stack = [(root, False)]
+        while stack:
+            element, tail = stack.pop()
+            if tail:
+                if element.tail:
+                    yield element.tail
+                continue
+            stack.append((element, True))
+            # comments and processing instructions don't have a str tag
+            if isinstance(element.tag, str) and element.tag not in SKIPPED_TAGS:
+                if element.text:
+                    yield element.text
+                stack.extend((child, False) for child in reversed(element))
+
+
+class SelectolaxBackend(HtmlToTextBackend):
+    name = "selectolax"
+
+    def __init__(self) -> None:
+        from selectolax.lexbor import LexborHTMLParser
+
+        self._parser = LexborHTMLParser
+
+    def get_text(self, markup: str) -> str:
+        texts = []
+        for node in self._parser(markup).root.traverse(include_text=True):
+            if node.tag != "-text" or node.parent.tag in SKIPPED_TAGS:
+                continue
+            if text := node.text(deep=False).strip():
+                texts.append(text)
+        return " ".join(texts)
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (BeautifulSoupBackend, LxmlBackend, SelectolaxBackend)
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name=None) -> HtmlToTextBackend:
+    name = name or settings.HTML_TO_TEXT_BACKEND
+    if name not in BACKENDS:
+        raise ImproperlyConfigured(
+            f"Unknown HTML_TO_TEXT_BACKEND {name!r}, choose one of {sorted(BACKENDS)}"
+        )
+    try:
+        return BACKENDS[name]()
+    except ImportError as error:
+        raise ImproperlyConfigured(
+            f"HTML_TO_TEXT_BACKEND {name!r} needs a package that isn't installed, "
+            f"install it or pick another backend: {error}"
+        ) from error
+
+
+def compare_backends(documents, names=None, max_diffs=5):
+    """
+    Runs every backend over documents, a list of html strings, and compares what
+    they return to the reference backend. Returns a result per backend name with
+    how many documents differed, a few example diffs and the speedup over the reference.
+    """
+    names = list(names or BACKENDS)
+    if REFERENCE_BACKEND not in names:
+        names.insert(0, REFERENCE_BACKEND)
+    outputs = {}
+    seconds = {}
+    for name in names:
+        backend = get_backend(name)
+        start = time.perf_counter()
+        outputs[name] = [backend.get_text(document) for document in documents]
+        seconds[name] = time.perf_counter() - start
+    reference = outputs[REFERENCE_BACKEND]
+    results = {}
+    for name in names:
+        different = [
+            i for i, (a, b) in enumerate(zip(reference, outputs[name])) if a != b
+        ]
+        results[name] = {
+            "documents": len(documents),
+            "different": len(different),
+            "seconds": seconds[name],
+            "speedup": seconds[REFERENCE_BACKEND] / seconds[name] if seconds[name] else 0.0,
+            "diffs": [
+                "\n".join(
+                    difflib.unified_diff(
+                        reference[i].split(" "),
+                        outputs[name][i].split(" "),
+                        REFERENCE_BACKEND,
+                        name,
+                        lineterm="",
+                        n=2,
+                    )
+                )
+                for i in different[:max_diffs]
+            ],
+        }
+    return results
@@ -0,0 +1,232 @@
+import collections
+import math
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from thefuzz import fuzz
+from thefuzz import utils as fuzz_utils
+
+from .. import constants as c
+from .. import utils as u
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def ngrams(text: str, n=3):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(TOKEN_PATTERN.findall(text.lower()))
+
+
+def wratio_upper_bound(counts1, length1, counts2, length2) -> int:
+    """
+    The highest score fuzz.WRatio can give two strings that have already been through
+    utils.full_process, from their lengths and Counters of their characters alone.
+    """
+    if not length1 or not length2:
+        return 0
+    # the longest common subsequence of any two pieces of the strings is at most
+    # the number of characters the strings have in common
+    common = sum((counts1 & counts2).values())
+    shorter = min(length1, length2)
+    length_ratio = max(length1, length2) / shorter
+    bound = 200 * common / (length1 + length2)
+    if length_ratio < 1.5:
+        # the token ratios are scaled by 0.95
+        bound = max(bound, 95)
+    else:
+        scale = 0.6 if length_ratio > 8 else 0.9
+        # a partial ratio compares the shorter string to a piece of the longer one
+        # that's at most as long, and the partial token ratios are scaled by 0.95
+        partial = min(1, 2 * common / (shorter + common))
+        bound = max(bound, 100 * scale * partial, 95 * scale)
+    # scores are rounded, leave room for the float error in either calculation
+    return math.ceil(bound - 1e-6)
+
+
+class JobNameMatcher:
+    """
+    Finds the job name u.get_best_match would pick for a subject line without scoring
+    every job.
+
+    Job names are indexed by their character trigrams and the jobs that share the
+    most trigrams with a subject line are scored first. The rest are only scored while
+    wratio_upper_bound says they could still beat, or tie with an earlier job than,
+    the best match so far, so the result is always the same as a full scan.
+    The string processor has to give the same result when it's applied twice.
+    """
+
+    MAX_CANDIDATES = 10
+
+    def __init__(self, job_names: List[str], string_processor=lambda x: x) -> None:
+        self.job_names = list(job_names)
+        self.string_processor = string_processor
+        self._index = collections.defaultdict(list)
+        self._ngram_counts = []
+        # names too short to have a trigram are always candidates
+        self._short_names = []
+        # every name the way fuzz.WRatio sees it when u.get_best_match scores it
+        self._processed = []
+        self._characters = []
+        for i, name in enumerate(self.job_names):
+            grams = ngrams(string_processor(name))
+            self._ngram_counts.append(len(grams))
+            if not grams:
+                self._short_names.append(i)
+            for gram in grams:
+                self._index[gram].append(i)
+            processed = self._full_process(name)
+            self._processed.append(processed)
+            self._characters.append((collections.Counter(processed), len(processed)))
+
+    def __len__(self):
+        return len(self.job_names)
+
+    def _full_process(self, text):
+        return fuzz_utils.full_process(self.string_processor(text), force_ascii=True)
+
+    def _candidate_indexes(self, subject_line: str) -> List[int]:
+        hits = collections.Counter()
+        for gram in ngrams(self.string_processor(subject_line)):
+            hits.update(self._index.get(gram, ()))
+        best = sorted(
+            hits, key=lambda i: (-hits[i] / self._ngram_counts[i], i)
+        )[: self.MAX_CANDIDATES]
+        return sorted(best + self._short_names)
+
+    def candidates(self, subject_line: str) -> List[str]:
+        """
+        The job names sharing the largest fraction of their trigrams with the subject
+        line, in the same order as job_names.
+        """
+        return [self.job_names[i] for i in self._candidate_indexes(subject_line)]
+
+    def best_match(self, subject_line: str) -> Tuple[str, int]:
+        """
+        Returns the same (job name, score) as u.get_best_match over every job name.
+        """
+        if not self.job_names:
+            return "", 0
+        processed = self._full_process(subject_line)
+        counts = collections.Counter(processed)
+        best, best_score = None, -1
+
+        def score(i):
+            nonlocal best, best_score
+            # what process.extractOne in u.get_best_match does for a single choice
+            score = fuzz.WRatio(self._processed[i], processed, full_process=False)
+            # a full scan keeps the first of the jobs with the best score
+            if score > best_score or (score == best_score and i < best):
+                best, best_score = i, score
+
+        candidates = self._candidate_indexes(subject_line)
+        for i in candidates:
+            score(i)
+        scored = set(candidates)
+        bounds = sorted(
+            (-wratio_upper_bound(*self._characters[i], counts, len(processed)), i)
+            for i in range(len(self))
+            if i not in scored
+        )
+        for bound, i in bounds:
+            if -bound < best_score:
+                break
+            if -bound > best_score or i < best:
+                score(i)
+        return self.job_names[best], best_score
+
+
+class TokenAutomaton:
+    """
+    An Aho-Corasick automaton over words instead of characters. Finds every
+    pattern, a sequence of words, in a single pass over a tokenized text.
+    """
+
+    def __init__(self, patterns: Dict[Tuple[str, ...], str]) -> None:
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+        for tokens, value in patterns.items():
+            if tokens:
+                self._add(tokens, value)
+        self._link()
+
+    def _add(self, tokens, value):
+        state = 0
+        for token in tokens:
+            if token not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][token] = len(self._goto) - 1
+            state = self._goto[state][token]
+        self._outputs[state].append((len(tokens), value))
+
+    def _link(self):
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(token, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+    def iter_matches(self, tokens: Iterable[str]):
+        """
+        Yields (start, end, value) for every pattern found in tokens.
+        """
+        state = 0
+        for end, token in enumerate(tokens, 1):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for length, value in self._outputs[state]:
+                yield end - length, end, value
+
+
+class ThreadTypeMatcher:
+    """
+    Picks the thread type of a subject line from thread type names and their alt names.
+    An exact, case insensitive, hit on any of them wins, the earliest and then longest
+    one if there are several. The words of the subject line are only fuzzy scored
+    against every name when nothing was hit.
+    """
+
+    def __init__(self, thread_types: List[str], alt_names: Dict[str, str]) -> None:
+        # alt names can't take over a thread type's own name
+        self.names = {**alt_names, **{name: name for name in thread_types}}
+        self.thread_types = list(thread_types)
+        self.alt_names = [name for name in alt_names if name not in self.names.values()]
+        self._automaton = TokenAutomaton(
+            {
+                tokenize(name): thread_type
+                for name, thread_type in self.names.items()
+                if thread_type != c.FIELD_VALUE_UNKNOWN_THREAD_TYPE
+            }
+        )
+
+    def exact_match(self, subject_line: str):
+        matches = self._automaton.iter_matches(tokenize(subject_line))
+        best = min(matches, key=lambda match: (match[0], -match[1]), default=None)
+        return best[2] if best else None
+
+    def best_match(self, subject_line: str) -> Tuple[str, int]:
+        """
+        Returns (thread type, score) where an exact hit scores 100.
+        """
+        if thread_type := self.exact_match(subject_line):
+            return thread_type, 100
+        # thread types go first so they win ties like they did before alt names
+        best_match, _, score = u.get_best_match(
+            self.thread_types + self.alt_names,
+            subject_line.split(" "),
+            lambda x: x.strip().lower(),
+        )
+        return self.names.get(best_match, best_match), score
@@ -49,15 +49,17 @@ class EmailMessage(object):
     QUOTE_HDR_REGEX = re.compile("On.*wrote:$")
     QUOTED_REGEX = re.compile(r"(>+)")
     HEADER_REGEX = re.compile(r"^\*?(From|Sent|To|Subject):\*? .+")
-    _MULTI_QUOTE_HDR_REGEX = r"(?!On.*On\s.+?wrote:)(On\s(.+?)wrote:)"
-    MULTI_QUOTE_HDR_REGEX = re.compile(_MULTI_QUOTE_HDR_REGEX, re.DOTALL | re.MULTILINE)
-    MULTI_QUOTE_HDR_REGEX_MULTILINE = re.compile(_MULTI_QUOTE_HDR_REGEX, re.DOTALL)
+    # replies are at the top so the multi-line quote header is only looked for in
+    # this many characters, which keeps a huge forwarded chain from being rescanned
+    MAX_QUOTE_HEADER_SEARCH = 100_000
 
     def __init__(self, text):
         self.fragments = []
         self.fragment = None
         self.text = text.replace("\r\n", "\n")
         self.found_visible = False
+        # every fragment before this index is hidden because a headers fragment followed it
+        self._hidden_before = 0
 
     def read(self):
         """Creates new fragment for each line
@@ -68,11 +70,10 @@ class EmailMessage(object):
 
         self.found_visible = False
 
-        is_multi_quote_header = self.MULTI_QUOTE_HDR_REGEX_MULTILINE.search(self.text)
-        if is_multi_quote_header:
-            self.text = self.MULTI_QUOTE_HDR_REGEX.sub(
-                is_multi_quote_header.groups()[0].replace("\n", ""), self.text
-            )
+        limit = self.MAX_QUOTE_HEADER_SEARCH
+        self.text = (
+            self._join_multi_line_quote_header(self.text[:limit]) + self.text[limit:]
+        )
 
         # Fix any outlook style replies, with the reply immediately above the signature boundary line
         #   See email_2_2.txt for an example
@@ -86,10 +87,35 @@ class EmailMessage(object):
 
         self._finish_fragment()
 
+        for f in self.fragments[: self._hidden_before]:
+            f.hidden = True
         self.fragments.reverse()
 
         return self
 
+    @staticmethod
+    def _join_multi_line_quote_header(text):
+        """Puts the last "On ... wrote:" quote header that wraps over several
+        lines back on one line, e.g. Gmail's "On Mon, Jan 1, 2022 at 9:00 AM
+        Name <email>\nwrote:".
+
+        This used to be the regex (?!On.*On\s.+?wrote:)(On\s(.+?)wrote:) which
+        backtracks badly on long bodies. The header it finds starts at the last
+        "On" + whitespace at least 4 characters before the last "wrote:" and
+        ends at the first "wrote:" after it, and that can be found with a few
+        linear scans.
+        """
+        last_wrote = text.rfind("wrote:")
+        if last_wrote < 4:
+            return text
+        start = text.rfind("On", 0, last_wrote - 2)
+        while start != -1 and not text[start + 2].isspace():
+            start = text.rfind("On", 0, start + 1)
+        if start == -1:
+            return text
+        end = text.find("wrote:", start + 4) + len("wrote:")
+        return text[:start] + text[start:end].replace("\n", "") + text[end:]
+
     @property
     def reply(self):
         """Captures reply message within email"""
@@ -162,8 +188,7 @@ class EmailMessage(object):
                 # Regardless of what's been seen to this point, if we encounter a headers fragment,
                 # all the previous fragments should be marked hidden and found_visible set to False.
                 self.found_visible = False
-                for f in self.fragments:
-                    f.hidden = True
+                self._hidden_before = len(self.fragments)
             if not self.found_visible:
                 if (
                     self.fragment.quoted
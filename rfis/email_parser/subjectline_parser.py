@@ -1,65 +1,133 @@
 import re
+import threading
+from typing import Tuple
 
+from cachetools import LRUCache
 from constance import config
 
 from .. import constants as c
-from .. import models as m
 from .. import utils as u
 from .base_parsers import BaseParser
+from .vocabulary import Vocabulary, get_vocabulary, job_name_processor
+
+# (cleaned subject line, vocabulary version, min score) -> (thread type, job name)
+# replies reuse their thread's subject line so most lookups are hits
+_match_cache = LRUCache(maxsize=c.SUBJECT_LINE_CACHE_SIZE)
+_match_cache_lock = threading.Lock()
+_match_cache_hits = 0
+_match_cache_misses = 0
+
+
+def subject_line_cache_info():
+    with _match_cache_lock:
+        return {
+            "hits": _match_cache_hits,
+            "misses": _match_cache_misses,
+            "size": len(_match_cache),
+            "maxsize": _match_cache.maxsize,
+        }
+
+
+def clear_subject_line_cache():
+    global _match_cache_hits, _match_cache_misses
+    with _match_cache_lock:
+        _match_cache.clear()
+        _match_cache_hits = _match_cache_misses = 0
+
+
+RE_FW_PATTERN = re.compile(r"^(RE|Re|FW|FWD|Fw|):?\s")
+
+
+def clean_subject_line(subject_line: str) -> str:
+    return re.sub(RE_FW_PATTERN, "", subject_line).strip()
+
+
+def choose_thread_type(subject_line: str, vocabulary: Vocabulary, min_score) -> str:
+    best_match, score = vocabulary.thread_type_matcher.best_match(subject_line)
+    if score > min_score:
+        return best_match
+    return c.FIELD_VALUE_UNKNOWN_THREAD_TYPE
+
+
+def choose_job_name(subject_line: str, vocabulary: Vocabulary, min_score) -> str:
+    best_match, bscore = vocabulary.job_matcher.best_match(subject_line)
+    unmodified_match, score = u.get_highest_possible_match(
+        best_match, subject_line, job_name_processor
+    )
+    if score > min_score or bscore > min_score:
+        return unmodified_match
+    return c.FIELD_VALUE_UNKNOWN_JOB
+
+
+def match_subject_line(
+    subject_line: str, vocabulary: Vocabulary, min_score
+) -> Tuple[str, str, str]:
+    """
+    Returns (cleaned subject line, thread type, job name). Only uses the vocabulary
+    it's given so it can run anywhere, e.g. in a worker process, and remembers the
+    match in the process-wide _match_cache.
+    """
+    subject_line = clean_subject_line(subject_line)
+    key = (subject_line, vocabulary.version, min_score)
+    if (match := _cached_match(key)) is None:
+        match = (
+            choose_thread_type(subject_line, vocabulary, min_score),
+            choose_job_name(subject_line, vocabulary, min_score),
+        )
+        with _match_cache_lock:
+            _match_cache[key] = match
+    return (subject_line, *match)
+
+
+def _cached_match(key):
+    global _match_cache_hits, _match_cache_misses
+    with _match_cache_lock:
+        match = _match_cache.get(key)
+        if match is None:
+            _match_cache_misses += 1
+        else:
+            _match_cache_hits += 1
+        return match
 
 
 class SubjectLineParser(BaseParser):
-    RE_FW_PATTERN = re.compile(r"^(RE|Re|FW|FWD|Fw|):?\s")
+    RE_FW_PATTERN = RE_FW_PATTERN
 
     def __init__(self) -> None:
         super().__init__()
-        self.THREAD_TYPE_CHOICES = [mt.name for mt in m.ThreadType.objects.all()]
-        self.JOB_NAMES = [j.name for j in m.Job.objects.all()]
+        self._vocabulary = None
         self._min_score_allowed = config.SUBJECT_LINE_PARSER_CONFIDENCE
         self._best_subject_line_match = {}
 
+    @property
+    def vocabulary(self) -> Vocabulary:
+        if self._vocabulary is None:
+            self._vocabulary = get_vocabulary()
+        return self._vocabulary
+
+    @property
+    def THREAD_TYPE_CHOICES(self):
+        return self.vocabulary.thread_types
+
+    @property
+    def JOB_NAMES(self):
+        return self.vocabulary.job_names
+
     def parse(self, subject_line):
         self._clear()
-        # have to clean the subject line first before anything else
-        self._clean_subject_line(subject_line)
-        self._choose_thread_type()
-        self._choose_job_name()
+        # picks up jobs and thread types that were added since the last message
+        self._vocabulary = get_vocabulary()
+        (
+            self._subject_line,
+            self._chosen["threadType"],
+            self._chosen["jobName"],
+        ) = match_subject_line(subject_line, self._vocabulary, self._min_score_allowed)
         self._is_parsed = True
 
     def _clear(self):
         self._best_subject_line_match.clear()
         super()._clear()
 
-    def _clean_subject_line(self, subject_line):
-        self._subject_line = re.sub(self.RE_FW_PATTERN, "", subject_line).strip()
-
-    def _choose_thread_type(self):
-        best_match, best_choice, score = u.get_best_match(
-            self.THREAD_TYPE_CHOICES,
-            self._subject_line.split(" "),
-            lambda x: x.strip().lower(),
-        )
-
-        if score > self._min_score_allowed:
-            self._chosen["threadType"] = best_match
-        else:
-            self._chosen["threadType"] = c.FIELD_VALUE_UNKNOWN_THREAD_TYPE
-
-    def _choose_job_name(self):
-        # TODO could use binary sort to make more efficient
-        best_match, best_choice, bscore = u.get_best_match(
-            self.JOB_NAMES, [self._subject_line], lambda x: x.lower().replace(" ", "")
-        )
-        unmodified_match, score = u.get_highest_possible_match(
-            best_match, self._subject_line, lambda x: x.lower().replace(" ", "")
-        )
-        if score > self._min_score_allowed or bscore > self._min_score_allowed:
-            self._chosen["jobName"] = unmodified_match
-        else:
-            self._chosen["jobName"] = c.FIELD_VALUE_UNKNOWN_JOB
-
-        # print(f"\n\nsubject chosen: {self._chosen}")
-
     @property
     def parsed_subject_line(self):
         assert self._is_parsed
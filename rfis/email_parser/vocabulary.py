@@ -0,0 +1,97 @@
+"""
+The job and thread type names subject lines are matched against. Every parser in a
+process shares one vocabulary and it's only rebuilt when the version stored in the
+shared cache changes, which the model signals in rfis.signals take care of.
+"""
+import threading
+import time
+from typing import Dict, List, NamedTuple
+
+from django.core.cache import cache
+
+from .. import constants as c
+from .. import models as m
+from .matchers import JobNameMatcher, ThreadTypeMatcher
+
+
+def job_name_processor(name):
+    return name.lower().replace(" ", "")
+
+
+class Vocabulary(NamedTuple):
+    version: int
+    thread_types: List[str]
+    # alt name -> thread type name
+    thread_type_alt_names: Dict[str, str]
+    job_names: List[str]
+    job_matcher: JobNameMatcher
+    thread_type_matcher: ThreadTypeMatcher
+
+
+_lock = threading.Lock()
+_vocabulary = None
+_checked_at = 0.0
+_version_lock = threading.Lock()
+_last_version = 0
+
+
+def _new_version():
+    # never reuse a version a process could still have, which an increment could do
+    # when the key is lost or the transaction that bumped it is rolled back
+    global _last_version
+    with _version_lock:
+        _last_version = max(time.time_ns(), _last_version + 1)
+        return _last_version
+
+
+def vocabulary_version() -> int:
+    version = cache.get(c.PARSER_VOCABULARY_VERSION_KEY)
+    if version is None:
+        cache.add(c.PARSER_VOCABULARY_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(c.PARSER_VOCABULARY_VERSION_KEY)
+    return version
+
+
+def bump_vocabulary_version():
+    cache.set(c.PARSER_VOCABULARY_VERSION_KEY, _new_version(), timeout=None)
+    reset_vocabulary()
+
+
+def reset_vocabulary():
+    """
+    Makes this process rebuild its vocabulary the next time it's used.
+    """
+    global _vocabulary
+    with _lock:
+        _vocabulary = None
+
+
+def build_vocabulary(version) -> Vocabulary:
+    job_names = list(m.Job.objects.values_list("name", flat=True))
+    thread_types = list(m.ThreadType.objects.values_list("name", flat=True))
+    alt_names = dict(m.ThreadTypeAltName.objects.values_list("name", "thread_type__name"))
+    return Vocabulary(
+        version=version,
+        thread_types=thread_types,
+        thread_type_alt_names=alt_names,
+        job_names=job_names,
+        job_matcher=JobNameMatcher(job_names, job_name_processor),
+        thread_type_matcher=ThreadTypeMatcher(thread_types, alt_names),
+    )
+
+
+def get_vocabulary(check_interval=c.PARSER_VOCABULARY_CHECK_INTERVAL) -> Vocabulary:
+    """
+    Returns this process's vocabulary. The shared version is checked at most once
+    every check_interval seconds so parsing a message doesn't cost a cache lookup.
+    """
+    global _vocabulary, _checked_at
+    with _lock:
+        now = time.monotonic()
+        if _vocabulary is not None and now - _checked_at < check_interval:
+            return _vocabulary
+        version = vocabulary_version()
+        _checked_at = now
+        if _vocabulary is None or _vocabulary.version != version:
+            _vocabulary = build_vocabulary(version)
+        return _vocabulary
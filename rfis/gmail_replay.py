@@ -0,0 +1,446 @@
+"""
+Records Gmail api responses into a gzip compressed archive and serves them back through
+the same interface as GmailService so ingestion can be run and benchmarked offline.
+
+An archive is a gzip file with one json record per line:
+    {"kind": "profile", "data": {...}}
+    {"kind": "thread", "id": "thread id", "data": {...}}
+    {"kind": "attachment", "id": "message id/attachment id", "data": {...}}
+"""
+import base64
+import copy
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import formataddr, getaddresses
+from typing import List, Tuple
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from . import constants as c
+from . import utils as u
+
+EMAIL_REGEX = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+ADDRESS_HEADERS = frozenset(
+    ("from", "to", "cc", "bcc", "reply-to", "sender", "delivered-to", "return-path")
+)
+# shorter display names, e.g. initials, would be replaced inside ordinary words
+MIN_SCRUBBED_NAME_LENGTH = 3
+
+logger = logging.getLogger()
+
+
+class GmailArchive:
+    """
+    An in memory archive indexed by thread id, message id and attachment id.
+    Messages are indexed from inside their threads so they're only stored once.
+    """
+
+    def __init__(self, threads=None, profile=None, attachments=None) -> None:
+        self.threads = {}
+        self.messages = {}
+        self.attachments = attachments or {}
+        self.profile = profile or {"emailAddress": "replay@example.com", "historyId": "1"}
+        for thread in threads or []:
+            self.add_thread(thread)
+
+    def add_thread(self, thread):
+        self.threads[thread["id"]] = thread
+        for msg in thread.get("messages") or []:
+            self.messages[msg["id"]] = msg
+
+    @classmethod
+    def load(cls, path):
+        archive = cls()
+        with gzip.open(path, "rt", encoding="utf8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["kind"] == "thread":
+                    archive.add_thread(record["data"])
+                elif record["kind"] == "attachment":
+                    archive.attachments[record["id"]] = record["data"]
+                elif record["kind"] == "profile":
+                    archive.profile = record["data"]
+        return archive
+
+    def save(self, path):
+        with GmailArchiveWriter(path, self.profile) as writer:
+            for thread in self.threads.values():
+                writer.add_thread(thread)
+            for attachment_key, attachment in self.attachments.items():
+                writer.add_attachment(*attachment_key.split("/", 1), attachment)
+
+
+class GmailArchiveWriter:
+    """
+    Streams records into an archive so a large mailbox never has to be held in memory.
+    """
+
+    def __init__(self, path, profile) -> None:
+        self.path = path
+        self.profile = profile
+        self._file = None
+
+    def __enter__(self):
+        self._file = gzip.open(self.path, "wt", encoding="utf8")
+        self._write({"kind": "profile", "data": self.profile})
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+
+    def add_thread(self, thread):
+        self._write({"kind": "thread", "id": thread["id"], "data": thread})
+
+    def add_attachment(self, message_id, attachment_id, attachment):
+        self._write(
+            {"kind": "attachment", "id": f"{message_id}/{attachment_id}", "data": attachment}
+        )
+
+
+class GmailScrubber:
+    """
+    Replaces every email address in headers, snippets and text bodies with a
+    pseudonym. The same address always gets the same pseudonym so who
+    started a thread and who replied to it survives scrubbing.
+
+    The display names of the From, To, Cc and other address headers are replaced
+    with a synthetic name, and so is every place those names show up in the thread's
+    snippets, subjects and text bodies, e.g. "Jane Doe wrote:". Names that are never
+    in an address header, like people mentioned in a body, and the rest of a
+    signature such as phone numbers aren't touched, so read an archive before
+    sharing it.
+    """
+
+    def __init__(self, salt="", keep=()) -> None:
+        self.salt = salt
+        self.keep = {email.lower() for email in keep}
+
+    def pseudonym(self, email):
+        if email.lower() in self.keep:
+            return email
+        digest = hashlib.sha1(f"{self.salt}{email.lower()}".encode("utf8")).hexdigest()
+        return f"user-{digest[:10]}@example.com"
+
+    def pseudonym_name(self, email):
+        digest = hashlib.sha1(f"{self.salt}{email.lower()}".encode("utf8")).hexdigest()
+        return f"User {digest[:6]}"
+
+    def scrub_text(self, text, names=None):
+        """
+        names is a pattern of the display names to replace and their
+        {lowercase name: synthetic name}, see _display_names.
+        """
+        text = EMAIL_REGEX.sub(lambda match: self.pseudonym(match.group(0)), text)
+        if names is not None:
+            pattern, synthetic_names = names
+            text = pattern.sub(lambda match: synthetic_names[match.group(0).lower()], text)
+        return text
+
+    def scrub_address_header(self, value):
+        return ", ".join(
+            formataddr(
+                (
+                    name if address.lower() in self.keep else self.pseudonym_name(address),
+                    self.pseudonym(address),
+                )
+                if name
+                else ("", self.pseudonym(address))
+            )
+            for name, address in getaddresses([value])
+            if address
+        )
+
+    def scrub_thread(self, thread):
+        thread = copy.deepcopy(thread)
+        names = self._display_names(thread)
+        for msg in thread.get("messages") or []:
+            if "snippet" in msg:
+                msg["snippet"] = self.scrub_text(msg["snippet"], names)
+            if payload := msg.get("payload"):
+                self._scrub_part(payload, names)
+        return thread
+
+    def _display_names(self, thread):
+        synthetic_names = {}
+        for msg in thread.get("messages") or []:
+            for header in (msg.get("payload") or {}).get("headers") or []:
+                if header["name"].lower() not in ADDRESS_HEADERS:
+                    continue
+                for name, address in getaddresses([header["value"]]):
+                    name = name.strip()
+                    if (
+                        address
+                        and address.lower() not in self.keep
+                        and len(name) >= MIN_SCRUBBED_NAME_LENGTH
+                    ):
+                        synthetic_names[name.lower()] = self.pseudonym_name(address)
+        if not synthetic_names:
+            return None
+        # longest first so "Jane Doe" is replaced before "Jane"
+        alternatives = sorted(synthetic_names, key=len, reverse=True)
+        pattern = re.compile(
+            r"\b(?:" + "|".join(map(re.escape, alternatives)) + r")\b", re.IGNORECASE
+        )
+        return pattern, synthetic_names
+
+    def _scrub_part(self, part, names=None):
+        for header in part.get("headers") or []:
+            if header["name"].lower() in ADDRESS_HEADERS:
+                header["value"] = self.scrub_address_header(header["value"])
+            else:
+                header["value"] = self.scrub_text(header["value"], names)
+        body = part.get("body") or {}
+        if body.get("data") and part.get("mimeType", "").startswith("text/"):
+            text = base64.urlsafe_b64decode(body["data"]).decode("utf8", errors="replace")
+            data = self.scrub_text(text, names).encode("utf8")
+            body["data"] = base64.urlsafe_b64encode(data).decode("ascii")
+            body["size"] = len(data)
+        for sub_part in part.get("parts") or []:
+            self._scrub_part(sub_part, names)
+
+
+def iter_attachment_ids(message):
+    parts = [message.get("payload") or {}]
+    while parts:
+        part = parts.pop()
+        if attachment_id := (part.get("body") or {}).get("attachmentId"):
+            yield attachment_id
+        parts.extend(part.get("parts") or [])
+
+
+def record_gmail_archive(
+    service,
+    path,
+    query_params="label:inbox",
+    limit=None,
+    include_attachments=False,
+    scrubber=None,
+) -> Tuple[int, List[str]]:
+    """
+    Downloads up to limit threads that match query_params from a GmailService and writes
+    them, scrubbed unless scrubber is False, into an archive. Threads that can't be
+    fetched are tried once more with the next chunk.
+    Returns (threads written, ids of the threads that still couldn't be fetched).
+    """
+    scrubber = GmailScrubber() if scrubber is None else scrubber
+    profile = service.get_profile()
+    if scrubber:
+        profile = dict(profile, emailAddress=scrubber.pseudonym(profile["emailAddress"]))
+    thread_ids = (thread["id"] for thread in service.iter_threads(query_params))
+    if limit:
+        thread_ids = (thread_id for _, thread_id in zip(range(limit), thread_ids))
+    written = 0
+    failed = []
+    # thread ids that failed once are tried again at the front of the next chunk
+    retries = []
+    with GmailArchiveWriter(path, profile) as writer:
+        while chunk := [
+            *retries,
+            *itertools.islice(thread_ids, c.GMAIL_API_MAX_BATCH_SIZE - len(retries)),
+        ]:
+            retrying = set(retries)
+            retries.clear()
+            threads, errors = service.get_threads_batch(chunk)
+            for thread_id, error in errors.items():
+                if thread_id in retrying:
+                    logger.error(f"Failed to record thread || function: record_gmail_archive || thread id: {thread_id} || error: {error}")
+                    failed.append(thread_id)
+                else:
+                    retries.append(thread_id)
+            for thread_id in chunk:
+                if (thread := threads.get(thread_id)) is None:
+                    continue
+                writer.add_thread(scrubber.scrub_thread(thread) if scrubber else thread)
+                written += 1
+                if not include_attachments:
+                    continue
+                for msg in thread.get("messages") or []:
+                    for attachment_id in iter_attachment_ids(msg):
+                        writer.add_attachment(
+                            msg["id"],
+                            attachment_id,
+                            service.get_attachment(msg["id"], attachment_id),
+                        )
+    return written, failed
+
+
+def _metadata_view(message, metadata_headers):
+    view = {key: value for key, value in message.items() if key != "payload"}
+    payload = message.get("payload") or {}
+    headers = payload.get("headers") or []
+    if metadata_headers is not None:
+        wanted = {header.lower() for header in metadata_headers}
+        headers = [h for h in headers if h["name"].lower() in wanted]
+    view["payload"] = {"mimeType": payload.get("mimeType"), "headers": headers}
+    return view
+
+
+def _format_message(message, format, metadata_headers=None):
+    if format == "metadata":
+        return _metadata_view(message, metadata_headers)
+    if format == "minimal":
+        return {key: value for key, value in message.items() if key != "payload"}
+    return message
+
+
+class ReplayGmailService:
+    """
+    Serves an archive through the GmailService interface. latency seconds are
+    slept for every request, or once per batch request, and error_rate is the
+    chance that any single call fails with a 503 like the real api does when it's
+    overloaded. The archive is only read so one instance can be shared by threads.
+    """
+
+    def __init__(self, archive: GmailArchive, latency=0.0, error_rate=0.0, seed=None):
+        self.archive = archive
+        self.latency = latency
+        self.error_rate = error_rate
+        self.marked_read = []
+        self.added_label_ids = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def worker_factory(self):
+        return self
+
+    def _simulate_request(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _injected_error(self):
+        if not self.error_rate:
+            return None
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            return HttpError(httplib2.Response({"status": 503}), b"Injected replay error")
+        return None
+
+    def _get(self, index, key, resource):
+        if error := self._injected_error():
+            raise error
+        if key not in index:
+            raise HttpError(
+                httplib2.Response({"status": 404}), f"{resource} {key} not found".encode()
+            )
+        return index[key]
+
+    def _batch(self, ids, fetch):
+        responses = {}
+        errors = {}
+        for chunk in u.chunked(dict.fromkeys(ids), c.GMAIL_API_MAX_BATCH_SIZE):
+            self._simulate_request()
+            for request_id in chunk:
+                try:
+                    responses[request_id] = fetch(request_id)
+                except HttpError as error:
+                    errors[request_id] = error
+        return responses, errors
+
+    def get_threads(self, query_params="label:inbox is:unread"):
+        return list(self.iter_threads(query_params))
+
+    def iter_threads(self, query_params="label:inbox is:unread"):
+        # every thread in the archive matches any query
+        for page in u.chunked(self.archive.threads, 100):
+            self._simulate_request()
+            yield from ({"id": thread_id} for thread_id in page)
+
+    def _thread(self, thread_id, format="full", metadata_headers=None):
+        thread = self._get(self.archive.threads, thread_id, "Thread")
+        if format == "full":
+            return thread
+        return dict(
+            thread,
+            messages=[
+                _format_message(msg, format, metadata_headers)
+                for msg in thread.get("messages") or []
+            ],
+        )
+
+    def get_thread(self, thread_id, format="full", metadata_headers=None):
+        self._simulate_request()
+        return self._thread(thread_id, format, metadata_headers)
+
+    def get_threads_batch(self, thread_ids, format="full", metadata_headers=None):
+        return self._batch(
+            thread_ids,
+            lambda thread_id: self._thread(thread_id, format, metadata_headers),
+        )
+
+    def get_messages(self, query_params="label:inbox is:unread"):
+        self._simulate_request()
+        return {
+            "messages": [
+                {"id": msg["id"], "threadId": msg["threadId"]}
+                for msg in self.archive.messages.values()
+            ]
+        }
+
+    def get_message(self, message_id, format="full"):
+        self._simulate_request()
+        return _format_message(self._get(self.archive.messages, message_id, "Message"), format)
+
+    def get_messages_batch(self, message_ids, format="full"):
+        return self._batch(
+            message_ids,
+            lambda message_id: _format_message(
+                self._get(self.archive.messages, message_id, "Message"), format
+            ),
+        )
+
+    def get_profile(self):
+        self._simulate_request()
+        return self.archive.profile
+
+    def get_history(self, start_history_id, label_id="INBOX"):
+        """
+        Every message with a history id after start_history_id counts as added.
+        """
+        self._simulate_request()
+        history = [
+            {"messagesAdded": [{"message": {"id": msg["id"], "threadId": msg["threadId"]}}]}
+            for msg in self.archive.messages.values()
+            if int(msg.get("historyId", 0)) > int(start_history_id)
+        ]
+        return {"history": history, "historyId": self.archive.profile["historyId"]}
+
+    def watch(self, topic_name, label_id="INBOX"):
+        self._simulate_request()
+        # a week from now in milliseconds like Gmail returns it
+        expiration = int((time.time() + 7 * 24 * 60 * 60) * 1000)
+        return {"historyId": self.archive.profile["historyId"], "expiration": str(expiration)}
+
+    def stop_watch(self):
+        self._simulate_request()
+        return {}
+
+    def get_or_create_label(self, name):
+        self._simulate_request()
+        return f"Label_{name}"
+
+    def mark_read_messages(self, read_messages, add_label_ids=None):
+        if not read_messages:
+            return
+        self._simulate_request()
+        with self._lock:
+            self.marked_read.extend(read_messages)
+            self.added_label_ids.update(add_label_ids or [])
+
+    def get_attachment(self, message_id, attachment_id):
+        self._simulate_request()
+        return self._get(
+            self.archive.attachments, f"{message_id}/{attachment_id}", "Attachment"
+        )
@@ -1,29 +1,241 @@
+import collections
+import datetime
 import json
-from functools import wraps
+import logging
+import random
+import socket
+import threading
+import time
+from functools import lru_cache, wraps
 from typing import List
 
 from constance import config
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
 
 from . import constants as c
 from . import models as m
 from . import utils as u
 
+logger = logging.getLogger()
+
+# credentials are shared by every GmailService in the process
+_credentials: Credentials = None
+_credentials_lock = threading.Lock()
+# the http client under a built service isn't thread safe so each thread builds its own
+_thread_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def _discovery_document():
+    # bundled with googleapiclient so building a service never has to fetch it
+    return json.loads(discovery_cache.get_static_doc("gmail", "v1"))
+
+
+def _needs_refresh(credentials: Credentials):
+    if not credentials.token:
+        return True
+    if not credentials.expiry:
+        return False
+    margin = datetime.timedelta(seconds=c.GMAIL_TOKEN_REFRESH_MARGIN)
+    return credentials.expiry - margin <= datetime.datetime.utcnow()
+
+
+def _load_shared_credentials():
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = Credentials.from_authorized_user_info(
+                GmailService.load_client_token(), c.GMAIL_API_SCOPES
+            )
+        return _credentials
+
+
+def _refresh_shared_credentials(credentials: Credentials):
+    global _credentials
+    with _credentials_lock:
+        # another thread may have refreshed it while this one was waiting
+        if _credentials is not credentials or not _needs_refresh(credentials):
+            return _credentials
+        if not credentials.refresh_token:
+            raise ValueError("Credentials cannot be null or expired")
+        try:
+            credentials.refresh(Request())
+        except RefreshError:
+            # the mailbox may have been authorized again by another process
+            _credentials = None
+            raise
+        GmailService.save_client_token(credentials, reset=False)
+        return credentials
+
+
+def reset_credentials():
+    """
+    Drops the cached credentials so the next request loads them from the database.
+    """
+    global _credentials
+    with _credentials_lock:
+        _credentials = None
+
+
+def quota_cost(request):
+    return c.GMAIL_API_QUOTA_COSTS.get(
+        getattr(request, "methodId", None), c.GMAIL_API_DEFAULT_QUOTA_COST
+    )
+
+
+def is_retryable(error):
+    if isinstance(error, (ConnectionError, socket.timeout)):
+        return True
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status in c.GMAIL_API_RETRYABLE_STATUSES:
+        return True
+    # Gmail answers with a 403 instead of a 429 when the per user rate limit is hit
+    return error.resp.status == 403 and b"ateLimitExceeded" in error.content
+
+
+class TokenBucket:
+    """
+    Hands out rate quota units per second. Taking more units than are left
+    puts the bucket in debt and the caller sleeps until it's paid off, so a
+    batch that costs more than one second of quota is spread out instead of refused.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, units) -> float:
+        """
+        Takes units from the bucket and returns the seconds spent waiting for them.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= units
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class GmailRequestScheduler:
+    """
+    Runs every Gmail api request in the process. Each request is charged its
+    quota cost against a token bucket, and transient failures (429s, 5xxs,
+    rate limit 403s and dropped connections) are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        units_per_second=c.GMAIL_API_QUOTA_UNITS_PER_SECOND,
+        max_retries=c.GMAIL_API_MAX_RETRIES,
+        backoff_base=c.GMAIL_API_BACKOFF_BASE,
+        backoff_max=c.GMAIL_API_BACKOFF_MAX,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ) -> None:
+        self.bucket = TokenBucket(units_per_second, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self._counters = collections.Counter()
+        self._counters_lock = threading.Lock()
+
+    def count(self, **amounts):
+        with self._counters_lock:
+            self._counters.update(amounts)
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self._counters)
+
+    def backoff(self, attempt):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        self.count(retries=1, backoff_seconds=delay)
+        self.sleep(delay)
+
+    def call(self, func, cost, retry=True):
+        """
+        Calls func once its quota cost is available and retries it while it
+        fails with a transient error, unless retry is False because calling
+        it twice isn't safe.
+        """
+        max_retries = self.max_retries if retry else 0
+        for attempt in range(max_retries + 1):
+            waited = self.bucket.acquire(cost)
+            self.count(requests=1, quota_units=cost, throttled_seconds=waited)
+            try:
+                return func()
+            except Exception as error:
+                if not is_retryable(error) or attempt == max_retries:
+                    self.count(failures=1)
+                    raise
+                logger.warning(f"Retrying Gmail request || function: GmailRequestScheduler.call || attempt: {attempt + 1} || error: {error}")
+                self.backoff(attempt)
+
+    def execute(self, request, retry=True):
+        return self.call(request.execute, quota_cost(request), retry)
+
+    def execute_batch(self, new_batch, requests):
+        """
+        Executes (request id, request) pairs in batch http requests and returns
+        ({request id: response}, {request id: exception}). Requests in a batch
+        that fail with a transient error are retried in a later batch.
+        """
+        responses = {}
+        errors = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        pending = list(requests)
+        for attempt in range(self.max_retries + 1):
+            for chunk in u.chunked(pending, c.GMAIL_API_MAX_BATCH_SIZE):
+                batch = new_batch(callback=callback)
+                for request_id, request in chunk:
+                    batch.add(request, request_id=request_id)
+                self.call(batch.execute, sum(quota_cost(r) for _, r in chunk))
+            pending = [
+                (request_id, request)
+                for request_id, request in pending
+                if request_id in errors and is_retryable(errors[request_id])
+            ]
+            if not pending or attempt == self.max_retries:
+                break
+            for request_id, _ in pending:
+                del errors[request_id]
+            self.backoff(attempt)
+        self.count(failures=len(errors))
+        return responses, errors
+
+
+# Gmail's quota is per user so every thread in the process shares one scheduler
+scheduler = GmailRequestScheduler()
+
 
 def token_refresh(method):
     @wraps(method)
     def refresh(self: "GmailService", *args, **kwargs):
-        # check if token is valid before making a request
-        # if not try to refresh it
-        if (
-            not self.token
-            or not self.token.valid
-            or self.token.expired
-            and self.token.refresh_token
-        ):
-            self._refresh_token()
+        # check if the token is about to expire before making a request
+        # and if it is refresh it
+        self.get_credentials()
         return method(self, *args, **kwargs)
 
     return refresh
@@ -32,7 +244,6 @@ def token_refresh(method):
 class GmailService:
     def __init__(self) -> None:
         self.token: Credentials = None
-        self.service = self._build_service()
 
     @staticmethod
     def load_client_secret_file():
@@ -43,79 +254,230 @@ class GmailService:
         return m.GmailCredentials.load_credentials()
 
     @staticmethod
-    def save_client_token(credentials: Credentials):
+    def save_client_token(credentials: Credentials, reset=True):
         db_credentials = m.GmailCredentials.load()
         db_credentials.credentials = credentials.to_json()
         db_credentials.save()
+        if reset:
+            # the mailbox was authorized again so stop using the old credentials
+            reset_credentials()
 
     def get_credentials(self):
-        # The file token.json stores the user's access and refresh tokens, and is
-        # created automatically when the authorization flow completes for the first
-        # time.
-        creds = Credentials.from_authorized_user_info(
-            GmailService.load_client_token(), c.GMAIL_API_SCOPES
-        )
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                raise ValueError("Credentials cannot be null or expired")
+        creds = _load_shared_credentials()
+        if _needs_refresh(creds):
+            creds = _refresh_shared_credentials(creds)
         self.token = creds
-        GmailService.save_client_token(self.token)  # write token to file for later use
+        return creds
 
-    def _refresh_token(self):
-        self.token.refresh(Request())
-        GmailService.save_client_token(self.token)
+    @property
+    def service(self):
+        """
+        The Gmail api client for the current thread. It's built once per thread from
+        the bundled discovery document and rebuilt only when the credentials change.
+        """
+        credentials = self.token or self.get_credentials()
+        cached = getattr(_thread_local, "service", None)
+        if cached is None or cached[0] is not credentials:
+            cached = (
+                credentials,
+                build_from_document(_discovery_document(), credentials=credentials),
+            )
+            _thread_local.service = cached
+        return cached[1]
 
-    def _build_service(self):
-        self.get_credentials()
-        return build("gmail", "v1", credentials=self.token)
+    def get_threads(self, query_params="label:inbox is:unread"):
+        return list(self.iter_threads(query_params))
+
+    def iter_threads(self, query_params="label:inbox is:unread"):
+        """
+        Lazily walks every page of threads that match query_params so only
+        one page of thread ids is held in memory at a time.
+        """
+        page_token = None
+        while True:
+            response = self._list_threads_page(query_params, page_token)
+            yield from response.get("threads", [])
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return
 
     @token_refresh
-    def get_threads(self, query_params="label:inbox is:unread"):
-        return (
+    def _list_threads_page(self, query_params, page_token=None):
+        return scheduler.execute(
             self.service.users()
             .threads()
-            .list(userId="me", q=query_params)
-            .execute()
-            .get("threads", [])
+            .list(userId="me", q=query_params, pageToken=page_token)
         )
 
     @token_refresh
-    def get_thread(self, thread_id):
-        return (
+    def get_thread(self, thread_id, format="full", metadata_headers=None):
+        return scheduler.execute(
             self.service.users()
             .threads()
-            .get(userId="me", id=thread_id, format="full")
-            .execute()
+            .get(
+                userId="me",
+                id=thread_id,
+                format=format,
+                metadataHeaders=metadata_headers,
+            )
+        )
+
+    @token_refresh
+    def get_threads_batch(self, thread_ids, format="full", metadata_headers=None):
+        """
+        Fetches many threads using as few batch http requests as possible.
+        Returns ({thread id: thread}, {thread id: exception}) so a single
+        failed thread doesn't fail the rest of the batch.
+        """
+        threads = self.service.users().threads()
+        return self._execute_batch(
+            (
+                thread_id,
+                threads.get(
+                    userId="me",
+                    id=thread_id,
+                    format=format,
+                    metadataHeaders=metadata_headers,
+                ),
+            )
+            for thread_id in dict.fromkeys(thread_ids)
         )
 
     @token_refresh
     def get_messages(self, query_params="label:inbox is:unread"):
-        return self.service.users().messages().list(userId="me", q=query_params).execute()
+        return scheduler.execute(
+            self.service.users().messages().list(userId="me", q=query_params)
+        )
 
     @token_refresh
     def get_message(self, message_id):
-        return (
+        return scheduler.execute(
             self.service.users()
             .messages()
             .get(userId="me", id=message_id, format="full")
-            .execute()
         )
 
     @token_refresh
-    def mark_read_messages(self, read_messages: List[int]):
+    def get_messages_batch(self, message_ids, format="full"):
+        """
+        Same as get_threads_batch but for messages.
+        """
+        messages = self.service.users().messages()
+        return self._execute_batch(
+            (message_id, messages.get(userId="me", id=message_id, format=format))
+            for message_id in dict.fromkeys(message_ids)
+        )
+
+    def _execute_batch(self, requests):
+        return scheduler.execute_batch(self.service.new_batch_http_request, requests)
+
+    @token_refresh
+    def get_profile(self):
+        return scheduler.execute(self.service.users().getProfile(userId="me"))
+
+    @token_refresh
+    def get_history(self, start_history_id, label_id="INBOX"):
+        """
+        Returns every messageAdded history record since start_history_id as
+        {"history": [...], "historyId": "latest id"}. Gmail only keeps history
+        for about a week so None is returned when start_history_id has expired
+        and the caller has to fall back to a full sync.
+        """
+        history = []
+        page_token = None
+        while True:
+            try:
+                response = scheduler.execute(
+                    self.service.users()
+                    .history()
+                    .list(
+                        userId="me",
+                        startHistoryId=start_history_id,
+                        labelId=label_id,
+                        historyTypes=["messageAdded"],
+                        pageToken=page_token,
+                    )
+                )
+            except HttpError as error:
+                if error.resp.status == 404:
+                    return None
+                raise
+            history.extend(response.get("history", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return {
+                    "history": history,
+                    "historyId": response.get("historyId", start_history_id),
+                }
+
+    @token_refresh
+    def watch(self, topic_name, label_id="INBOX"):
+        """
+        Asks Gmail to publish a notification to the Pub/Sub topic whenever the
+        label changes. Returns {"historyId": ..., "expiration": "ms since epoch"}.
+        The watch has to be renewed before it expires, at most every 7 days.
+        """
+        body = {
+            "topicName": topic_name,
+            "labelIds": [label_id],
+            "labelFilterAction": "include",
+        }
+        return scheduler.execute(self.service.users().watch(userId="me", body=body))
+
+    @token_refresh
+    def stop_watch(self):
+        return scheduler.execute(self.service.users().stop(userId="me"))
+
+    @token_refresh
+    def get_or_create_label(self, name):
+        """
+        Returns the id of the user label called name and creates it if it doesn't exist.
+        Creating a label isn't idempotent, a create that timed out may still have made
+        the label, so the labels are listed again before every retry instead.
+        """
+        body = {
+            "name": name,
+            "labelListVisibility": "labelShow",
+            "messageListVisibility": "show",
+        }
+        for attempt in range(scheduler.max_retries + 1):
+            labels = scheduler.execute(self.service.users().labels().list(userId="me"))
+            for label in labels.get("labels", []):
+                if label["name"] == name:
+                    return label["id"]
+            try:
+                label = scheduler.execute(
+                    self.service.users().labels().create(userId="me", body=body),
+                    retry=False,
+                )
+                return label["id"]
+            except Exception as error:
+                # a 409 means another run or an earlier attempt made the label
+                conflict = isinstance(error, HttpError) and error.resp.status == 409
+                if not (conflict or is_retryable(error)) or attempt == scheduler.max_retries:
+                    raise
+                logger.warning(f"Listing labels again after a failed create || function: get_or_create_label || label: {name} || error: {error}")
+                if not conflict:
+                    scheduler.backoff(attempt)
+
+    @token_refresh
+    def mark_read_messages(self, read_messages: List[int], add_label_ids=None):
         if not read_messages:
             return
-        body = {"ids": read_messages, "addLabelIds": [], "removeLabelIds": ["UNREAD"]}
-        self.service.users().messages().batchModify(userId="me", body=body).execute()
+        body = {
+            "ids": read_messages,
+            "addLabelIds": add_label_ids or [],
+            "removeLabelIds": ["UNREAD"],
+        }
+        scheduler.execute(
+            self.service.users().messages().batchModify(userId="me", body=body)
+        )
 
     @token_refresh
     def get_attachment(self, message_id, attachment_id):
-        return (
+        return scheduler.execute(
             self.service.users()
             .messages()
             .attachments()
             .get(userId="me", id=attachment_id, messageId=message_id)
-            .execute()
         )
@@ -0,0 +1,192 @@
+import collections
+import threading
+import time
+from contextlib import contextmanager
+from functools import cached_property
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from . import constants as c
+from . import models as m
+
+# bumped by the model signals in rfis.signals whenever a lookup table changes
+_lookup_version = 0
+_lookup_version_lock = threading.Lock()
+
+
+def invalidate_lookups():
+    global _lookup_version
+    with _lookup_version_lock:
+        _lookup_version += 1
+
+
+class IngestionContext:
+    """
+    Holds the small lookup tables that every ingested message needs (users, jobs and
+    thread types) so they are queried once per ingestion run instead of once per message.
+    The tables are loaded lazily and reloaded the next time they are used after a
+    save or delete signal fired for one of their models.
+    """
+
+    _LOOKUPS = (
+        "user_ids",
+        "job_ids",
+        "thread_type_ids",
+        "thread_group_sentinel_id",
+        "thread_topic_sentinel_id",
+    )
+
+    def __init__(self, two_phase_fetch=False, parse_processes=1) -> None:
+        self._version = _lookup_version
+        # only download the full messages that will actually be stored
+        self.two_phase_fetch = two_phase_fetch
+        # every batch of threads is parsed on this many processes when it's more than one
+        self.parse_processes = parse_processes
+        # threads up to and including this one were committed by an interrupted run
+        self.resume_after_thread_id = None
+        # the history records the interrupted run listed, threads with records after them
+        # have to be processed again even if they were committed
+        self.resume_history_records = 0
+        self.history_records_listed = 0
+        self.last_thread_id = None
+        self.counters = collections.Counter()
+        # {stage name: seconds}, stages that run on a pool of workers add up their time
+        self.durations = collections.defaultdict(float)
+        self._stats_lock = threading.Lock()
+
+    def refresh_if_stale(self):
+        if self._version == _lookup_version:
+            return
+        self._version = _lookup_version
+        for lookup in self._LOOKUPS:
+            self.__dict__.pop(lookup, None)
+
+    @cached_property
+    def user_ids(self):
+        return dict(get_user_model().objects.values_list("email", "pk"))
+
+    @cached_property
+    def job_ids(self):
+        return dict(m.Job.objects.values_list("name", "pk"))
+
+    @cached_property
+    def thread_type_ids(self):
+        return dict(m.ThreadType.objects.values_list("name", "pk"))
+
+    @cached_property
+    def thread_group_sentinel_id(self):
+        return m.ThreadGroup.get_thread_group_sentinel_id()
+
+    @cached_property
+    def thread_topic_sentinel_id(self):
+        return m.ThreadTopic.get_thread_topic_sentinel_id()
+
+    def count(self, **amounts):
+        with self._stats_lock:
+            self.counters.update(amounts)
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.durations[stage] += elapsed
+
+    def timed_iter(self, stage, iterable):
+        """
+        Yields from iterable while timing how long every item took to produce.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.timed(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def thread_committed(self, thread_id, message_count):
+        self.count(threads_seen=1, messages_seen=message_count)
+        self.last_thread_id = thread_id
+
+    def user_exists(self, email):
+        return email in self.user_ids
+
+    def job_id(self, name):
+        return self.job_ids.get(name, self.job_ids.get(c.FIELD_VALUE_UNKNOWN_JOB))
+
+    def thread_type_id(self, name):
+        return self.thread_type_ids.get(
+            name, self.thread_type_ids.get(c.FIELD_VALUE_UNKNOWN_THREAD_TYPE)
+        )
+
+
+class IngestionRunTracker:
+    """
+    Records an ingestion run in an IngestionRun row using the counters and stage
+    durations the run collects on its IngestionContext.
+
+    A history sync only moves the stored history id forward once it finishes, so when
+    the last run for the same worker and history id didn't finish, the new run is
+    pointed at the last thread that run committed and skips everything before it that
+    didn't have messages added after the interrupted run listed the history.
+    """
+
+    def __init__(self, context: IngestionContext, worker_name, mode, query_params=""):
+        self.context = context
+        start_history_id = m.GmailSyncState.load().history_id
+        previous = (
+            m.IngestionRun.objects.filter(worker_name=worker_name).order_by("-started").first()
+        )
+        m.IngestionRun.objects.filter(
+            worker_name=worker_name, status=m.IngestionRun.Status.RUNNING
+        ).update(status=m.IngestionRun.Status.INTERRUPTED, finished=timezone.now())
+        resumed_from = None
+        if (
+            previous is not None
+            and previous.status != m.IngestionRun.Status.SUCCEEDED
+            and previous.mode == mode == m.IngestionRun.Mode.HISTORY
+            and previous.start_history_id == start_history_id
+            and previous.last_thread_id
+        ):
+            resumed_from = previous
+            context.resume_after_thread_id = previous.last_thread_id
+            context.resume_history_records = previous.history_records_listed
+        self.run = m.IngestionRun.objects.create(
+            worker_name=worker_name,
+            mode=mode,
+            query_params=query_params,
+            start_history_id=start_history_id,
+            last_thread_id=context.resume_after_thread_id or "",
+            history_records_listed=context.resume_history_records,
+            resumed_from=resumed_from,
+        )
+
+    def save(self):
+        counters = self.context.counters
+        run = self.run
+        run.last_thread_id = self.context.last_thread_id or run.last_thread_id
+        run.history_records_listed = (
+            self.context.history_records_listed or run.history_records_listed
+        )
+        run.threads_seen = counters["threads_seen"]
+        run.threads_failed = counters["threads_failed"]
+        run.messages_seen = counters["messages_seen"]
+        run.messages_created = counters["messages_created"]
+        run.messages_skipped = counters["messages_seen"] - counters["messages_created"]
+        run.messages_failed = counters["messages_failed"]
+        run.messages_marked_read = counters["messages_marked_read"]
+        run.stage_durations = {
+            stage: round(seconds, 3) for stage, seconds in self.context.durations.items()
+        }
+        run.save()
+
+    def finish(self, status, error=""):
+        self.run.status = status
+        self.run.error = error
+        self.run.finished = timezone.now()
+        self.save()
@@ -0,0 +1,221 @@
+"""
+Runs the ingestion pipeline against a replay Gmail source and measures it. Results are
+plain dicts so the benchmark_ingestion command can dump them as json and runs from
+different commits can be compared.
+"""
+import math
+import threading
+import time
+
+from django.db import connection
+
+from . import email_parser as e_parser
+from . import gmail_replay
+from . import ingestion as ing
+from . import mailbox_generator as mbg
+from . import models as m
+from . import utils as u
+
+STAGES = ("list", "fetch", "parse", "match", "write")
+
+
+class BenchmarkContext(ing.IngestionContext):
+    """
+    Also remembers when every thread was committed so per message latencies
+    can be worked out once the run is over.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.started = time.perf_counter()
+        self.commits = []
+        self._commits_lock = threading.Lock()
+
+    def thread_committed(self, thread_id, message_count):
+        super().thread_committed(thread_id, message_count)
+        with self._commits_lock:
+            self.commits.append((time.perf_counter(), message_count))
+
+    def message_latencies(self):
+        """
+        The time between a thread's commit and the one before it is shared evenly
+        by the thread's messages, so fetch, parse and write all count towards it.
+        """
+        latencies = []
+        previous = self.started
+        for committed, message_count in self.commits:
+            if message_count:
+                latencies.extend([(committed - previous) / message_count] * message_count)
+            previous = committed
+        return latencies
+
+
+class MatchTimingGmailParser(e_parser.GmailParser):
+    """
+    Records the time spent matching subject lines to jobs and thread types under the
+    match stage. Use parser_class_for so workers building their own parser share
+    the benchmark's context.
+    """
+
+    context = None
+
+    def __init__(self) -> None:
+        super().__init__()
+        parse_subject_line = self._subject_parser.parse
+
+        def timed_parse(subject_line):
+            with self.context.timed("match"):
+                parse_subject_line(subject_line)
+
+        self._subject_parser.parse = timed_parse
+
+    @classmethod
+    def parser_class_for(cls, context):
+        return type(cls.__name__, (cls,), {"context": context})
+
+
+class QueryCounter:
+    """
+    Counts and times the queries run on the calling thread's connection, which is
+    the one every database write happens on, without keeping the sql around.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def generated_archive(count, max_replies=5, seed=0, senders=(), job_names=()):
+    generator = mbg.MailboxGenerator(senders, job_names, seed=seed)
+    archive = gmail_replay.GmailArchive(
+        profile={"emailAddress": generator.mailbox, "historyId": str(count)}
+    )
+    for thread in generator.iter_threads(count, max_replies):
+        archive.add_thread(mbg.as_gmail_thread(thread))
+    return archive
+
+
+def archive_senders(archive):
+    """
+    The sender of the first message in every thread, the one that decides if the
+    thread is stored at all.
+    """
+    senders = set()
+    for thread in archive.threads.values():
+        messages = thread.get("messages")
+        if not messages:
+            continue
+        first = messages[u.find_earliest_message_index(messages)]
+        for header in (first.get("payload") or {}).get("headers") or []:
+            if header["name"] == "From":
+                senders.update(gmail_replay.EMAIL_REGEX.findall(header["value"])[:1])
+    return sorted(senders)
+
+
+def run_benchmark(
+    archive: gmail_replay.GmailArchive,
+    max_workers=1,
+    two_phase_fetch=False,
+    latency=0.0,
+    error_rate=0.0,
+    seed=None,
+    keep=False,
+):
+    """
+    Processes every thread in the archive with process_multiple_gmail_threads and
+    returns the measurements. Threads the run created are deleted afterwards unless
+    keep is set, threads that were already in the database are left alone.
+    """
+    thread_ids = list(archive.threads)
+    existing = set()
+    for chunk in u.chunked(thread_ids, 1000):
+        existing.update(
+            m.Thread.objects.filter(gmail_thread_id__in=chunk).values_list(
+                "gmail_thread_id", flat=True
+            )
+        )
+    service = gmail_replay.ReplayGmailService(
+        archive, latency=latency, error_rate=error_rate, seed=seed
+    )
+    context = BenchmarkContext(two_phase_fetch=two_phase_fetch)
+    g_parser = MatchTimingGmailParser.parser_class_for(context)()
+    queries = QueryCounter()
+    cache_before = e_parser.subject_line_cache_info()
+    try:
+        with connection.execute_wrapper(queries):
+            context.started = time.perf_counter()
+            u.process_multiple_gmail_threads(
+                service, g_parser, max_workers=max_workers, context=context
+            )
+            wall_seconds = time.perf_counter() - context.started
+    finally:
+        if not keep:
+            created = [thread_id for thread_id in thread_ids if thread_id not in existing]
+            for chunk in u.chunked(created, 1000):
+                m.Thread.objects.filter(gmail_thread_id__in=chunk).delete()
+
+    cache_after = e_parser.subject_line_cache_info()
+    messages = context.counters["messages_seen"]
+    latencies = context.message_latencies()
+    durations = dict(context.durations)
+    # subject line matching happens inside of parsing
+    durations["parse"] = durations.get("parse", 0.0) - durations.get("match", 0.0)
+    stages = {stage: durations.get(stage, 0.0) for stage in STAGES}
+    per_message = messages or 1
+    return {
+        "source": {
+            "threads": len(archive.threads),
+            "messages": len(archive.messages),
+            "preexisting_threads": len(existing),
+        },
+        "settings": {
+            "max_workers": max_workers,
+            "two_phase_fetch": two_phase_fetch,
+            "latency": latency,
+            "error_rate": error_rate,
+        },
+        "threads_processed": context.counters["threads_seen"],
+        "threads_failed": context.counters["threads_failed"],
+        "messages_processed": messages,
+        "messages_created": context.counters["messages_created"],
+        "messages_failed": context.counters["messages_failed"],
+        "wall_seconds": wall_seconds,
+        "messages_per_second": messages / wall_seconds if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "max": max(latencies, default=0.0) * 1000,
+        },
+        "sql": {
+            "queries": queries.count,
+            "seconds": queries.seconds,
+            "queries_per_message": queries.count / per_message,
+            "ms_per_message": queries.seconds * 1000 / per_message,
+        },
+        "subject_line_cache": {
+            "hits": cache_after["hits"] - cache_before["hits"],
+            "misses": cache_after["misses"] - cache_before["misses"],
+        },
+        # with more than one worker the stages overlap so they can add up to more than
+        # wall_seconds
+        "stage_seconds": stages,
+        "stage_ms_per_message": {
+            stage: seconds * 1000 / per_message for stage, seconds in stages.items()
+        },
+    }
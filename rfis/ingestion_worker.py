@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+
+from constance import config
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from . import constants as c
+from . import email_parser as e_parser
+from . import gmail_service as g_service
+from . import ingestion
+from . import models as m
+from . import utils as u
+
+logger = logging.getLogger()
+
+
+def run_gmail_ingestion(heartbeat=None, should_stop=lambda: False) -> int:
+    """
+    Pulls new messages from Gmail into the database using the Gmail settings in constance
+    and marks them as read. Returns the number of messages marked as read.
+
+    When a heartbeat is given it's kept fresh while the run is in progress and the
+    run stops early, after the thread it's on, once should_stop returns True.
+    Every run is recorded in an IngestionRun row.
+    """
+    service = g_service.GmailService()
+    g_parser = e_parser.GmailParser()
+    max_workers = config.GMAIL_INGESTION_WORKERS
+    context = ingestion.IngestionContext(
+        two_phase_fetch=config.GMAIL_TWO_PHASE_FETCH,
+        parse_processes=config.GMAIL_PARSE_PROCESSES,
+    )
+    if config.GMAIL_PUSH_TOPIC:
+        u.renew_gmail_watch(service, config.GMAIL_PUSH_TOPIC)
+    query_params = "label:inbox is:unread"
+    add_label_ids = None
+    if config.GMAIL_PROCESSED_LABEL:
+        query_params = u.exclude_label_query(query_params, config.GMAIL_PROCESSED_LABEL)
+        add_label_ids = [service.get_or_create_label(config.GMAIL_PROCESSED_LABEL)]
+    if config.GMAIL_USE_HISTORY_SYNC:
+        mode = m.IngestionRun.Mode.HISTORY
+        read_messages = u.iter_gmail_history(
+            service, g_parser, query_params, max_workers=max_workers, context=context
+        )
+    else:
+        mode = m.IngestionRun.Mode.FULL
+        read_messages = u.iter_unread_gmail_threads(
+            service, g_parser, query_params, max_workers=max_workers, context=context
+        )
+    tracker = ingestion.IngestionRunTracker(
+        context,
+        heartbeat.name if heartbeat else c.INGESTION_WORKER_NAME,
+        mode,
+        query_params,
+    )
+    try:
+        # threads are processed as they are streamed in and marked read in chunks
+        count = u.mark_read_in_chunks(
+            service,
+            _until_stopped(read_messages, heartbeat, should_stop, tracker),
+            add_label_ids=add_label_ids,
+            context=context,
+        )
+        if not should_stop():
+            u.retry_dead_letters(g_parser, context)
+    except Exception as error:
+        tracker.finish(m.IngestionRun.Status.FAILED, error=repr(error))
+        raise
+    tracker.finish(
+        m.IngestionRun.Status.STOPPED if should_stop() else m.IngestionRun.Status.SUCCEEDED
+    )
+    logger.info(f"Gmail api usage since the process started || function: run_gmail_ingestion || stats: {g_service.scheduler.stats()}")
+    logger.info(f"Subject line matches since the process started || function: run_gmail_ingestion || cache: {e_parser.subject_line_cache_info()}")
+    return count
+
+
+def _until_stopped(read_messages, heartbeat, should_stop, tracker):
+    last_beat = time.monotonic()
+    for message_ids in read_messages:
+        yield message_ids
+        if time.monotonic() - last_beat > c.INGESTION_HEARTBEAT_INTERVAL:
+            # checkpoint the run so it can be resumed if the process dies
+            tracker.save()
+            if heartbeat:
+                heartbeat.beat()
+            last_beat = time.monotonic()
+        if should_stop():
+            logger.info("Stopping ingestion early || function: _until_stopped")
+            return
+
+
+class IngestionWorker:
+    """
+    Runs run_gmail_ingestion every interval seconds, or sooner when the web process
+    requests a sync through the heartbeat row, until stop is called.
+    """
+
+    def __init__(
+        self,
+        name=c.INGESTION_WORKER_NAME,
+        interval=300,
+        poll_interval=5,
+        run=run_gmail_ingestion,
+    ) -> None:
+        self.name = name
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self._run = run
+        self._stop_event = threading.Event()
+
+    def stop(self, *args):
+        logger.info(f"Ingestion worker stopping || function: IngestionWorker.stop || name: {self.name}")
+        self._stop_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def run_forever(self):
+        heartbeat = m.IngestionHeartbeat.load(self.name)
+        heartbeat.beat(status=m.IngestionHeartbeat.Status.IDLE)
+        next_run = time.monotonic()
+        last_beat = time.monotonic()
+        try:
+            while not self.stopped:
+                # the database may have dropped the connection while the worker was sleeping,
+                # but a connection in a transaction belongs to the caller
+                if not connection.in_atomic_block:
+                    close_old_connections()
+                heartbeat.refresh_from_db(fields=["sync_requested"])
+                if heartbeat.sync_requested or time.monotonic() >= next_run:
+                    self.run_once(heartbeat)
+                    next_run = time.monotonic() + self.interval
+                    last_beat = time.monotonic()
+                elif time.monotonic() - last_beat > c.INGESTION_HEARTBEAT_INTERVAL:
+                    heartbeat.beat()
+                    last_beat = time.monotonic()
+                self._stop_event.wait(self.poll_interval)
+        finally:
+            heartbeat.beat(status=m.IngestionHeartbeat.Status.STOPPED)
+
+    def run_once(self, heartbeat=None):
+        heartbeat = heartbeat or m.IngestionHeartbeat.load(self.name)
+        heartbeat.beat(
+            status=m.IngestionHeartbeat.Status.RUNNING,
+            sync_requested=False,
+            last_run_started=timezone.now(),
+        )
+        try:
+            count = self._run(heartbeat=heartbeat, should_stop=lambda: self.stopped)
+        except Exception as error:
+            logger.exception(f"Ingestion run failed || function: IngestionWorker.run_once || name: {self.name}")
+            heartbeat.beat(
+                status=m.IngestionHeartbeat.Status.IDLE,
+                last_run_finished=timezone.now(),
+                last_error=repr(error),
+            )
+            return None
+        heartbeat.beat(
+            status=m.IngestionHeartbeat.Status.IDLE,
+            last_run_finished=timezone.now(),
+            last_run_message_count=count,
+            last_error="",
+        )
+        logger.info(f"Ingestion run finished || function: IngestionWorker.run_once || name: {self.name} || messages: {count}")
+        return count
@@ -0,0 +1,441 @@
+"""
+Generates realistic looking RFI mailboxes at any scale. Every generated thread exists
+as a Gmail api shaped thread, which the parser and the replay service can consume, and
+can also be written straight to the database as Threads, Messages and Attachments.
+"""
+import base64
+import datetime
+import html
+import random
+from email.utils import format_datetime
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from . import constants as c
+from . import ingestion as ing
+from . import models as m
+from . import utils as u
+from .email_parser import vocabulary
+
+PLACES = [
+    "Riverside", "Oak Hill", "Lakeview", "Summit", "Harbor Point", "Maple Grove",
+    "Cedar Park", "Westgate", "Northshore", "Pine Ridge", "Stonebridge", "Fairview",
+]
+BUILDINGS = [
+    "Medical Office Building", "Elementary School", "Parking Garage", "Fire Station",
+    "Library", "Apartments", "Community Center", "Warehouse", "Hotel", "Science Hall",
+]
+PHASES = ["", "", "Phase 2", "Renovation", "Addition", "Tenant Fit Out"]
+THREAD_TYPES = ["RFI", "Submittal", "Change Order", "Pay Application"]
+TOPICS = [
+    "drywall", "elevator", "lighting", "roofing", "storefront", "fire alarm",
+    "plumbing fixtures", "ductwork", "concrete slab", "door hardware", "casework",
+]
+WORDS = (
+    "please confirm the dimension shown on sheet detail section elevation drawing spec"
+    " contractor architect engineer owner schedule approval revised attached clarify"
+    " install location ceiling wall floor level framing anchor embed grid line per field"
+    " condition conflict existing proposed substitution product data sample shop lead"
+    " time delivery cost impact response required by end of week thanks"
+).split()
+ATTACHMENTS = [
+    ("application/pdf", "pdf"),
+    ("image/jpeg", "jpg"),
+    ("application/vnd.ms-excel", "xls"),
+    ("application/msword", "doc"),
+]
+
+
+def gmail_id(rng):
+    return f"{rng.getrandbits(64):016x}"
+
+
+def b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf8")).decode("ascii")
+
+
+class MailboxGenerator:
+    """
+    Makes Gmail shaped threads from a seeded random generator so the same seed
+    always generates the same mailbox. Job names in subject lines are sometimes
+    lower cased, shortened or misspelled like they are in real email.
+    """
+
+    def __init__(
+        self, senders, job_names, thread_types=None, mailbox="rfis@example.com", seed=0
+    ):
+        assert senders, "At least one sender is needed"
+        self.rng = random.Random(seed)
+        self.senders = list(senders)
+        self.job_names = list(job_names)
+        self.thread_types = list(thread_types or THREAD_TYPES)
+        self.mailbox = mailbox
+        self.outside_senders = [
+            f"{name}@{company}.com"
+            for name in ("pm", "estimator", "super", "designer", "sales")
+            for company in ("acme-arch", "lonestar-mep", "summit-steel", "brightglass")
+        ]
+
+    @staticmethod
+    def job_names_for(count, seed=0):
+        rng = random.Random(seed)
+        names = {}
+        while len(names) < count:
+            name = " ".join(
+                part
+                for part in (rng.choice(PLACES), rng.choice(BUILDINGS), rng.choice(PHASES))
+                if part
+            )
+            if name in names:
+                name = f"{name} {len(names)}"
+            names[name] = None
+        return list(names)
+
+    def _mangle(self, job_name):
+        roll = self.rng.random()
+        if roll < 0.6 or len(job_name) < 6:
+            return job_name
+        if roll < 0.75:
+            return job_name.lower()
+        if roll < 0.9:
+            return " ".join(job_name.split()[:-1]) or job_name
+        i = self.rng.randrange(1, len(job_name) - 1)
+        return job_name[:i] + job_name[i + 1] + job_name[i] + job_name[i + 2 :]
+
+    def _sentence(self):
+        words = self.rng.choices(WORDS, k=self.rng.randint(6, 18))
+        return " ".join(words).capitalize() + "."
+
+    def _paragraphs(self):
+        # most emails are a few lines but a few are very long
+        count = min(40, int(self.rng.lognormvariate(0.7, 0.8)) + 1)
+        return [
+            " ".join(self._sentence() for _ in range(self.rng.randint(1, 5)))
+            for _ in range(count)
+        ]
+
+    def _name(self, email):
+        return email.split("@")[0].replace(".", " ").title()
+
+    def iter_threads(self, count, max_replies=5, start=None):
+        start = start or timezone.now() - datetime.timedelta(days=365)
+        for number in range(count):
+            yield self.thread(number, max_replies, start)
+
+    def thread(self, number, max_replies, start):
+        initiator = self.rng.choice(self.senders)
+        job_name = c.FIELD_VALUE_UNKNOWN_JOB
+        if self.job_names:
+            job_name = self.rng.choice(self.job_names)
+        thread_type = self.rng.choice(self.thread_types)
+        topic = self.rng.choice(TOPICS)
+        subject = f"{thread_type} #{number + 1} - {self._mangle(job_name)} - {topic}"
+        # about a third of the threads have been answered and closed
+        status = self.rng.choice(
+            [m.Thread.ThreadStatus.OPEN] * 2 + [m.Thread.ThreadStatus.CLOSED]
+        )
+        time_received = start + datetime.timedelta(minutes=self.rng.randrange(525600))
+        thread_id = gmail_id(self.rng)
+        messages = []
+        participants = [initiator] + self.rng.sample(self.outside_senders, 2)
+        for i in range(1 + self.rng.randint(0, max_replies)):
+            sender = initiator if i == 0 else self.rng.choice(participants)
+            messages.append(
+                self._message(
+                    thread_id if i == 0 else gmail_id(self.rng),
+                    thread_id,
+                    subject if i == 0 else f"RE: {subject}",
+                    sender,
+                    [p for p in participants if p != sender],
+                    time_received,
+                    messages[-1] if messages else None,
+                )
+            )
+            time_received += datetime.timedelta(hours=self.rng.randint(1, 72))
+        for msg in messages:
+            msg["historyId"] = str(number + 1)
+        return {
+            "id": thread_id,
+            "historyId": str(number + 1),
+            "messages": messages,
+            # what the ingestion pipeline is expected to store for this thread
+            "expected": {
+                "job_name": job_name,
+                "thread_type": thread_type,
+                "status": status,
+            },
+        }
+
+    def _message(self, message_id, thread_id, subject, sender, cc, time_received, previous):
+        paragraphs = self._paragraphs()
+        signature = f"{self._name(sender)}\n{sender}"
+        text = "\n\n".join(paragraphs + [signature])
+        html_body = "".join(f"<div>{html.escape(p)}</div><br>" for p in paragraphs)
+        html_body += f'<div class="signature">{html.escape(signature)}</div>'
+        if previous is not None:
+            quoted = previous["synthetic"]
+            wrote = f"On {quoted['date']}, {quoted['from']} wrote:"
+            quoted_lines = "\n".join(f"> {line}" for line in quoted["text"].splitlines())
+            text += f"\n\n{wrote}\n{quoted_lines}"
+            html_body += (
+                f'<div class="gmail_quote">{html.escape(wrote)}'
+                f"<blockquote>{quoted['html']}</blockquote></div>"
+            )
+        date = format_datetime(time_received)
+        headers = [
+            {"name": "From", "value": f"{self._name(sender)} <{sender}>"},
+            {"name": "To", "value": self.mailbox},
+            {"name": "Cc", "value": ", ".join(cc)},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": date},
+        ]
+        roll = self.rng.random()
+        if roll < 0.5:
+            body_parts = [
+                {
+                    "mimeType": "multipart/alternative",
+                    "headers": [],
+                    "body": {"size": 0},
+                    "parts": [
+                        self._text_part("text/plain", text),
+                        self._text_part("text/html", html_body),
+                    ],
+                }
+            ]
+        elif roll < 0.8:
+            body_parts = [self._text_part("text/plain", text)]
+        else:
+            body_parts = [self._text_part("text/html", html_body)]
+        attachments = [
+            self._attachment_part(message_id, i)
+            for i in range(self.rng.choice((0, 0, 0, 1, 1, 2, 3)))
+        ]
+        if attachments:
+            payload = {
+                "mimeType": "multipart/mixed",
+                "headers": headers,
+                "body": {"size": 0},
+                "parts": body_parts + attachments,
+            }
+        else:
+            payload = dict(body_parts[0], headers=headers + body_parts[0]["headers"])
+        return {
+            "id": message_id,
+            "threadId": thread_id,
+            "labelIds": ["INBOX", "UNREAD"],
+            "snippet": text[:200],
+            "internalDate": str(int(time_received.timestamp() * 1000)),
+            "payload": payload,
+            # used to build the database rows and the quoted text of replies
+            "synthetic": {
+                "from": sender,
+                "to": self.mailbox,
+                "cc": " ".join(cc),
+                "subject": subject,
+                "text": text,
+                "html": html_body,
+                "body": "\n\n".join(paragraphs),
+                "date": date,
+                "time_received": time_received,
+                "attachments": [
+                    (part["filename"], part["body"]["attachmentId"]) for part in attachments
+                ],
+            },
+        }
+
+    def _text_part(self, mime_type, text):
+        data = b64(text)
+        return {
+            "mimeType": mime_type,
+            "headers": [{"name": "Content-Type", "value": f'{mime_type}; charset="UTF-8"'}],
+            "body": {"size": len(text), "data": data},
+        }
+
+    def _attachment_part(self, message_id, i):
+        mime_type, extension = self.rng.choice(ATTACHMENTS)
+        filename = f"{self.rng.choice(TOPICS).replace(' ', '_')}_{i + 1}.{extension}"
+        return {
+            "mimeType": mime_type,
+            "filename": filename,
+            "headers": [
+                {
+                    "name": "Content-Disposition",
+                    "value": f'attachment; filename="{filename}"',
+                }
+            ],
+            "body": {
+                "size": self.rng.randint(10_000, 5_000_000),
+                "attachmentId": f"ANGjdJ{message_id}{i}",
+            },
+        }
+
+
+def as_gmail_thread(thread):
+    """
+    Strips the generator's bookkeeping so only what the Gmail api returns is left.
+    """
+    return {
+        "id": thread["id"],
+        "historyId": thread["historyId"],
+        "messages": [
+            {key: value for key, value in msg.items() if key != "synthetic"}
+            for msg in thread["messages"]
+        ],
+    }
+
+
+def create_synthetic_users(count, domain="synthetic.example.com"):
+    return create_users([f"user{i}@{domain}" for i in range(count)])
+
+
+def create_users(emails):
+    """
+    Creates a user that can't log in for every email that isn't a user yet.
+    """
+    user_model = get_user_model()
+    users = []
+    for email in emails:
+        user = user_model(email=email)
+        user.set_unusable_password()
+        users.append(user)
+    user_model.objects.bulk_create(users, ignore_conflicts=True)
+    return emails
+
+
+def create_synthetic_jobs(names):
+    m.Job.objects.bulk_create(
+        [m.Job(name=name, start_date=timezone.now()) for name in names],
+        ignore_conflicts=True,
+    )
+    _lookups_changed()
+
+
+def create_thread_types(names=THREAD_TYPES):
+    m.ThreadType.objects.bulk_create(
+        [m.ThreadType(name=name) for name in names], ignore_conflicts=True
+    )
+    _lookups_changed()
+
+
+def _lookups_changed():
+    # bulk_create doesn't send the signals that would normally do this
+    ing.invalidate_lookups()
+    vocabulary.bump_vocabulary_version()
+
+
+def bulk_create_threads(threads, context=None):
+    """
+    Writes generated threads, including their messages and attachments, with one
+    bulk insert per table. Threads and messages whose ids are already stored, e.g.
+    from an earlier run with the same seed, are skipped.
+    Returns (threads, messages) written.
+    """
+    context = context or ing.IngestionContext()
+    stored_thread_ids = set(
+        m.Thread.objects.filter(gmail_thread_id__in=[t["id"] for t in threads]).values_list(
+            "gmail_thread_id", flat=True
+        )
+    )
+    threads = [thread for thread in threads if thread["id"] not in stored_thread_ids]
+    stored_message_ids = set(
+        m.Message.objects.filter(
+            message_id__in=[msg["id"] for thread in threads for msg in thread["messages"]]
+        ).values_list("message_id", flat=True)
+    )
+    thread_rows = []
+    for thread in threads:
+        first = thread["messages"][0]["synthetic"]
+        status = thread["expected"]["status"]
+        thread_rows.append(
+            m.Thread(
+                gmail_thread_id=thread["id"],
+                job_id_id=context.job_id(thread["expected"]["job_name"]),
+                thread_type_id=context.thread_type_id(thread["expected"]["thread_type"]),
+                thread_group_id=context.thread_group_sentinel_id,
+                thread_topic_id=context.thread_topic_sentinel_id,
+                time_received=first["time_received"],
+                due_date=first["time_received"] + datetime.timedelta(days=7),
+                subject=first["subject"],
+                thread_status=status,
+                message_thread_initiator_id=context.user_ids[first["from"]],
+                original_initiator=first["from"],
+                accepted_answer=(
+                    thread["messages"][-1]["synthetic"]["body"][:500]
+                    if status == m.Thread.ThreadStatus.CLOSED
+                    else ""
+                ),
+            )
+        )
+    m.Thread.objects.bulk_create(thread_rows)
+    # not every database sets the pks of bulk created rows so they're read back
+    thread_pks = dict(
+        m.Thread.objects.filter(gmail_thread_id__in=[t["id"] for t in threads]).values_list(
+            "gmail_thread_id", "pk"
+        )
+    )
+    messages = []
+    message_rows = []
+    for thread in threads:
+        for msg in thread["messages"]:
+            if msg["id"] in stored_message_ids:
+                continue
+            messages.append(msg)
+            synthetic = msg["synthetic"]
+            message_rows.append(
+                m.Message(
+                    message_id=msg["id"],
+                    message_thread_id_id=thread_pks[thread["id"]],
+                    subject=synthetic["subject"],
+                    body=synthetic["body"],
+                    debug_unparsed_body=synthetic["text"],
+                    fromm=synthetic["from"],
+                    to=synthetic["to"],
+                    cc=synthetic["cc"],
+                    time_received=synthetic["time_received"],
+                )
+            )
+    m.Message.objects.bulk_create(message_rows)
+    message_pks = dict(
+        m.Message.objects.filter(message_id__in=[msg["id"] for msg in messages]).values_list(
+            "message_id", "pk"
+        )
+    )
+    attachment_rows = []
+    for msg in messages:
+        for filename, attachment_id in msg["synthetic"]["attachments"]:
+            attachment_rows.append(
+                m.Attachment(
+                    message_id_id=message_pks[msg["id"]],
+                    gmail_attachment_id=attachment_id,
+                    filename=filename,
+                    time_received=msg["synthetic"]["time_received"],
+                )
+            )
+    m.Attachment.objects.bulk_create(attachment_rows)
+    return len(thread_rows), len(message_rows)
+
+
+def generate_mailbox(
+    generator, count, max_replies=5, batch_size=500, write_db=True, archive_writer=None
+):
+    """
+    Generates count threads batch_size threads at a time so memory stays flat at any
+    scale. Each batch is written to the database and/or a replay archive.
+    Returns (threads, messages) written, to the database when write_db is on.
+    """
+    context = ing.IngestionContext()
+    threads_written = 0
+    messages_written = 0
+    for batch in u.chunked(generator.iter_threads(count, max_replies), batch_size):
+        if write_db:
+            threads, messages = bulk_create_threads(batch, context)
+        else:
+            threads = len(batch)
+            messages = sum(len(thread["messages"]) for thread in batch)
+        if archive_writer is not None:
+            for thread in batch:
+                archive_writer.add_thread(as_gmail_thread(thread))
+        threads_written += threads
+        messages_written += messages
+    return threads_written, messages_written
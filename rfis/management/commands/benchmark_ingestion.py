@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ... import gmail_replay
+from ... import ingestion_benchmark as bench
+from ... import mailbox_generator as mbg
+
+
+class Command(BaseCommand):
+    """
+    Measures ingestion end to end against a replay archive or a generated mailbox and
+    prints the results as json, e.g.
+        python manage.py benchmark_ingestion --threads 5000 --label "$(git rev-parse --short HEAD)"
+    Run it against a throwaway database, it creates the senders, jobs and thread types
+    the mailbox needs.
+    """
+
+    help = "Benchmarks Gmail ingestion and prints throughput, latency and query counts as json"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--archive", help="A replay archive to ingest instead of a generated mailbox."
+        )
+        parser.add_argument("--threads", type=int, default=1000)
+        parser.add_argument("--max-replies", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--jobs", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--two-phase-fetch", action="store_true")
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds every api request takes."
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0, help="Chance of an api request failing."
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the threads the run created."
+        )
+        parser.add_argument("--label", default="", help="Stored with the results, e.g. a commit.")
+        parser.add_argument("--output", help="Write the json here instead of to stdout.")
+
+    def handle(self, *args, **options):
+        if options["archive"]:
+            archive = gmail_replay.GmailArchive.load(options["archive"])
+            # threads are only stored when their first sender is a user
+            mbg.create_users(bench.archive_senders(archive))
+            source = {"kind": "archive", "path": options["archive"]}
+        else:
+            job_names = mbg.MailboxGenerator.job_names_for(options["jobs"], options["seed"])
+            senders = mbg.create_synthetic_users(25)
+            mbg.create_synthetic_jobs(job_names)
+            archive = bench.generated_archive(
+                options["threads"],
+                options["max_replies"],
+                options["seed"],
+                senders,
+                job_names,
+            )
+            source = {"kind": "generated", "seed": options["seed"]}
+        mbg.create_thread_types()
+
+        results = bench.run_benchmark(
+            archive,
+            max_workers=options["workers"],
+            two_phase_fetch=options["two_phase_fetch"],
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            seed=options["seed"],
+            keep=options["keep"],
+        )
+        results["label"] = options["label"]
+        results["source"].update(source)
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
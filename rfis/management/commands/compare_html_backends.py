@@ -0,0 +1,85 @@
+import base64
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ... import gmail_replay
+from ...email_parser import html_backends
+
+
+def iter_html_parts(message):
+    parts = [message.get("payload") or {}]
+    while parts:
+        part = parts.pop()
+        data = (part.get("body") or {}).get("data")
+        if part.get("mimeType") == "text/html" and data:
+            yield base64.urlsafe_b64decode(data).decode("utf8", errors="replace")
+        parts.extend(part.get("parts") or [])
+
+
+class Command(BaseCommand):
+    """
+    Checks that the html to text backends return the same text as the BeautifulSoup
+    reference and how much faster they are, over the stored test messages and
+    optionally replay archives, e.g.
+        python manage.py compare_html_backends --archive mailbox.jsonl.gz
+    """
+
+    help = "Compares the html to text backends for text differences and speed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            action="append",
+            choices=sorted(html_backends.BACKENDS),
+            help="A backend to compare, every installed one when not given.",
+        )
+        parser.add_argument(
+            "--archive",
+            action="append",
+            default=[],
+            help="A replay archive whose html parts are added to the test messages.",
+        )
+        parser.add_argument("--repeat", type=int, default=1, help="Times to run every part.")
+        parser.add_argument("--diffs", type=int, default=5, help="Example diffs to show.")
+        parser.add_argument("--json", action="store_true", help="Print the results as json.")
+
+    def handle(self, *args, **options):
+        documents = []
+        messages_file = os.path.join(settings.BASE_DIR, "test_data", "messages.json")
+        if os.path.exists(messages_file):
+            with open(messages_file, "r") as f:
+                for message in json.load(f)["messages"]:
+                    documents.extend(iter_html_parts(message))
+        for path in options["archive"]:
+            for message in gmail_replay.GmailArchive.load(path).messages.values():
+                documents.extend(iter_html_parts(message))
+        if not documents:
+            self.stderr.write("No html parts were found to compare.")
+            return
+
+        names = options["backend"]
+        if not names:
+            names = []
+            for name in html_backends.BACKENDS:
+                try:
+                    html_backends.get_backend(name)
+                except Exception as error:
+                    self.stderr.write(f"Skipping {name}: {error}")
+                    continue
+                names.append(name)
+        results = html_backends.compare_backends(
+            documents * options["repeat"], names, max_diffs=options["diffs"]
+        )
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: {result['different']}/{result['documents']} parts differ,"
+                f" {result['seconds']:.3f}s, {result['speedup']:.1f}x"
+            )
+            for diff in result["diffs"]:
+                self.stdout.write(diff)
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import gmail_replay
+from ... import mailbox_generator as mbg
+
+
+class Command(BaseCommand):
+    """
+    Fills the database and/or a replay archive with a synthetic mailbox so queries,
+    views and ingestion can be tried against 100k+ threads without real mail.
+    """
+
+    help = "Generates synthetic RFI threads, messages and attachments at any scale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=1000)
+        parser.add_argument(
+            "--max-replies", type=int, default=5, help="The most replies in a thread."
+        )
+        parser.add_argument("--users", type=int, default=25, help="Synthetic users to create.")
+        parser.add_argument("--jobs", type=int, default=200, help="Synthetic jobs to create.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--archive",
+            help="Also write the threads to a replay archive at this path, e.g. mailbox.jsonl.gz",
+        )
+        parser.add_argument(
+            "--no-db",
+            action="store_true",
+            help="Don't write to the database, only to --archive.",
+        )
+
+    def handle(self, *args, **options):
+        job_names = mbg.MailboxGenerator.job_names_for(options["jobs"], options["seed"])
+        senders = [f"user{i}@synthetic.example.com" for i in range(max(1, options["users"]))]
+        if not options["no_db"]:
+            senders = mbg.create_synthetic_users(max(1, options["users"]))
+            mbg.create_synthetic_jobs(job_names)
+            mbg.create_thread_types()
+        generator = mbg.MailboxGenerator(senders, job_names, seed=options["seed"])
+        started = time.monotonic()
+        if options["archive"]:
+            profile = {
+                "emailAddress": generator.mailbox,
+                "historyId": str(options["threads"]),
+            }
+            with gmail_replay.GmailArchiveWriter(options["archive"], profile) as writer:
+                threads, messages = self._generate(generator, options, writer)
+        elif options["no_db"]:
+            self.stderr.write("--no-db without --archive would throw everything away.")
+            return
+        else:
+            threads, messages = self._generate(generator, options, None)
+        self.stdout.write(
+            f"Generated {threads} threads with {messages} messages"
+            f" in {time.monotonic() - started:.1f}s."
+        )
+
+    def _generate(self, generator, options, writer):
+        return mbg.generate_mailbox(
+            generator,
+            options["threads"],
+            max_replies=options["max_replies"],
+            batch_size=options["batch_size"],
+            write_db=not options["no_db"],
+            archive_writer=writer,
+        )
@@ -0,0 +1,43 @@
+from constance import config
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import gmail_service as g_service
+from ... import models as m
+from ... import utils as u
+
+
+class Command(BaseCommand):
+    """
+    Registers the Gmail watch that sends mailbox changes to the push notification endpoint.
+    The ingestion worker renews it on its own once it's registered.
+    """
+
+    help = "Starts, renews or stops the Gmail watch on the GMAIL_PUSH_TOPIC Pub/Sub topic"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stop", action="store_true", help="Stop receiving push notifications."
+        )
+
+    def handle(self, *args, **options):
+        service = g_service.GmailService()
+        sync_state = m.GmailSyncState.load()
+        if options["stop"]:
+            service.stop_watch()
+            sync_state.watch_expiration = None
+            sync_state.save()
+            self.stdout.write("Gmail watch stopped.")
+            return
+        if not config.GMAIL_PUSH_TOPIC:
+            raise CommandError("GMAIL_PUSH_TOPIC has to be set first.")
+        if not config.GMAIL_USE_HISTORY_SYNC:
+            self.stderr.write(
+                "GMAIL_USE_HISTORY_SYNC is off so every notification will list every unread thread."
+            )
+        u.renew_gmail_watch(service, config.GMAIL_PUSH_TOPIC, force=True)
+        sync_state.refresh_from_db()
+        if not sync_state.email_address:
+            # notifications for any other mailbox are ignored
+            sync_state.email_address = service.get_profile()["emailAddress"]
+            sync_state.save()
+        self.stdout.write(f"Gmail watch expires at {sync_state.watch_expiration}.")
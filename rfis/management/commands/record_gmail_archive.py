@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from ... import gmail_replay
+from ... import gmail_service as g_service
+
+
+class Command(BaseCommand):
+    """
+    Captures threads from the connected Gmail account into an archive that
+    ReplayGmailService can serve offline, e.g. for benchmark_ingestion.
+    """
+
+    help = "Records Gmail threads into a gzip compressed replay archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the archive to write, e.g. mailbox.jsonl.gz")
+        parser.add_argument("--query", default="label:inbox")
+        parser.add_argument("--limit", type=int, help="The most threads to record.")
+        parser.add_argument(
+            "--attachments", action="store_true", help="Also record attachment data."
+        )
+        parser.add_argument(
+            "--no-scrub",
+            action="store_true",
+            help="Keep the real email addresses and names. Never share an archive made with this.",
+        )
+        parser.add_argument(
+            "--keep-email",
+            action="append",
+            default=[],
+            help="An email address that isn't scrubbed. Can be given more than once.",
+        )
+
+    def handle(self, *args, **options):
+        scrubber = (
+            False
+            if options["no_scrub"]
+            else gmail_replay.GmailScrubber(keep=options["keep_email"])
+        )
+        written, failed = gmail_replay.record_gmail_archive(
+            g_service.GmailService(),
+            options["output"],
+            query_params=options["query"],
+            limit=options["limit"],
+            include_attachments=options["attachments"],
+            scrubber=scrubber,
+        )
+        self.stdout.write(f"Recorded {written} threads to {options['output']}.")
+        if failed:
+            self.stderr.write(f"{len(failed)} threads couldn't be fetched: {', '.join(failed)}")
@@ -0,0 +1,50 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from ... import constants as c
+from ... import ingestion_worker
+
+
+class Command(BaseCommand):
+    """
+    Long running Gmail ingestion worker. Meant to be run as the worker process in the Procfile
+    so the web workers don't have to pull mail themselves.
+    """
+
+    help = "Pulls new messages from Gmail on an interval until it receives SIGTERM or SIGINT"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=300,
+            help="Seconds between syncs when no sync has been requested.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=int,
+            default=5,
+            help="Seconds between checks for a requested sync or a shutdown.",
+        )
+        parser.add_argument("--name", default=c.INGESTION_WORKER_NAME)
+        parser.add_argument(
+            "--once", action="store_true", help="Run a single sync and exit."
+        )
+
+    def handle(self, *args, **options):
+        worker = ingestion_worker.IngestionWorker(
+            name=options["name"],
+            interval=options["interval"],
+            poll_interval=options["poll_interval"],
+        )
+        if options["once"]:
+            count = worker.run_once()
+            self.stdout.write(f"{count} messages were processed.")
+            return
+        # finish the thread currently being processed and then exit
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write(f"Ingestion worker {options['name']} started.")
+        worker.run_forever()
+        self.stdout.write(f"Ingestion worker {options['name']} stopped.")
@@ -0,0 +1,57 @@
+import json
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from ... import models as m
+from ... import utils as u
+
+
+class Command(BaseCommand):
+    """
+    Local stand-in for Pub/Sub. Posts a synthetic Gmail watch notification to the
+    push notification endpoint so it can be tested without a Google Cloud project.
+    """
+
+    help = "Posts a synthetic Gmail push notification to the push notification endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default=settings.DOMAIN_URL + reverse("gmail_push_notification"),
+            help="Push notification endpoint. Defaults to the one on DOMAIN_URL.",
+        )
+        parser.add_argument(
+            "--history-id",
+            type=int,
+            help="Defaults to one past the history id of the last sync.",
+        )
+        parser.add_argument(
+            "--email", help="Defaults to the mailbox of the last sync."
+        )
+        parser.add_argument(
+            "--token", default=settings.GMAIL_PUSH_VERIFICATION_TOKEN
+        )
+
+    def handle(self, *args, **options):
+        sync_state = m.GmailSyncState.load()
+        history_id = options["history_id"] or int(sync_state.history_id or 0) + 1
+        email_address = options["email"] or sync_state.email_address or "test@test.com"
+        body = json.dumps(u.encode_gmail_push_notification(email_address, history_id))
+        request = urllib.request.Request(
+            f"{options['url']}?token={options['token']}",
+            data=body.encode("utf8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                status = response.status
+        except urllib.error.HTTPError as error:
+            raise CommandError(f"Push notification was rejected with {error.code}.")
+        except urllib.error.URLError as error:
+            raise CommandError(f"Could not reach {options['url']}: {error.reason}")
+        self.stdout.write(f"Push notification for history id {history_id} returned {status}.")
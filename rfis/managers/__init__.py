@@ -2,3 +2,4 @@ from .job_manager import *
 from .message_manager import *
 from .thread_manager import *
 from .user_manager import *
+from .dead_letter_manager import *
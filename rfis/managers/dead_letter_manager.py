@@ -0,0 +1,38 @@
+import traceback
+
+from django.db import models
+from django.utils import timezone
+
+
+class DeadLetterMessageManager(models.Manager):
+    def due(self, now=None):
+        return self.filter(
+            status=self.model.Status.PENDING, next_attempt_at__lte=now or timezone.now()
+        ).order_by("next_attempt_at")
+
+    def record(self, payload, stage, error):
+        """
+        Stores a Gmail message that failed. A message that already failed before
+        keeps its row and has its attempts bumped instead.
+        """
+        payload = payload or {}
+        message_id = payload.get("id", "")
+        dead_letter = None
+        if message_id:
+            dead_letter = (
+                self.filter(message_id=message_id)
+                .exclude(status=self.model.Status.RESOLVED)
+                .first()
+            )
+        if dead_letter is None:
+            dead_letter = self.model(
+                message_id=message_id, thread_id=payload.get("threadId", "")
+            )
+        dead_letter.payload = payload
+        dead_letter.stage = stage
+        dead_letter.failed(error)
+        return dead_letter
+
+
+def format_error(error):
+    return "".join(traceback.format_exception(type(error), error, error.__traceback__))
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0006_auto_20220911_1635'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GmailSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('history_id', models.CharField(blank=True, default='', max_length=100)),
+                ('last_synced', models.DateTimeField(blank=True, default=None, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Gmail Sync State',
+            },
+        ),
+    ]
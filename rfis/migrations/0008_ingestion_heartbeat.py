@@ -0,0 +1,27 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0007_gmail_sync_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionHeartbeat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('IDLE', 'Idle'), ('RUNNING', 'Running'), ('STOPPED', 'Stopped')], default='STOPPED', max_length=25)),
+                ('last_heartbeat', models.DateTimeField(blank=True, default=None, null=True)),
+                ('sync_requested', models.BooleanField(default=False)),
+                ('last_run_started', models.DateTimeField(blank=True, default=None, null=True)),
+                ('last_run_finished', models.DateTimeField(blank=True, default=None, null=True)),
+                ('last_run_message_count', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0008_ingestion_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gmailsyncstate',
+            name='email_address',
+            field=models.EmailField(blank=True, default='', max_length=254),
+        ),
+        migrations.AddField(
+            model_name='gmailsyncstate',
+            name='watch_expiration',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0009_gmail_push_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker_name', models.CharField(max_length=100)),
+                ('mode', models.CharField(choices=[('FULL', 'Full'), ('HISTORY', 'History')], max_length=25)),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('STOPPED', 'Stopped'), ('FAILED', 'Failed'), ('INTERRUPTED', 'Interrupted')], default='RUNNING', max_length=25)),
+                ('started', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(blank=True, default=None, null=True)),
+                ('query_params', models.CharField(blank=True, default='', max_length=255)),
+                ('start_history_id', models.CharField(blank=True, default='', max_length=100)),
+                ('last_thread_id', models.CharField(blank=True, default='', max_length=255)),
+                ('threads_seen', models.IntegerField(default=0)),
+                ('threads_failed', models.IntegerField(default=0)),
+                ('messages_seen', models.IntegerField(default=0)),
+                ('messages_created', models.IntegerField(default=0)),
+                ('messages_skipped', models.IntegerField(default=0)),
+                ('messages_marked_read', models.IntegerField(default=0)),
+                ('stage_durations', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('resumed_from', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='rfis.ingestionrun')),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+    ]
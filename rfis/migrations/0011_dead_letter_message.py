@@ -0,0 +1,35 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0010_ingestion_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetterMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(blank=True, db_index=True, default='', max_length=255)),
+                ('thread_id', models.CharField(blank=True, default='', max_length=255)),
+                ('stage', models.CharField(choices=[('PARSE', 'Parse'), ('WRITE', 'Write')], max_length=25)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RESOLVED', 'Resolved'), ('GIVEN_UP', 'Given Up')], default='PENDING', max_length=25)),
+                ('payload', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('attempts', models.IntegerField(default=0)),
+                ('first_failed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_failed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingestionrun',
+            name='messages_failed',
+            field=models.IntegerField(default=0),
+        ),
+    ]
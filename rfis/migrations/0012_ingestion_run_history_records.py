@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0011_dead_letter_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionrun',
+            name='history_records_listed',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0012_ingestion_run_history_records'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deadlettermessage',
+            name='stage',
+            field=models.CharField(choices=[('PARSE', 'Parse'), ('WRITE', 'Write'), ('BLOCKED', 'Blocked')], max_length=25),
+        ),
+    ]
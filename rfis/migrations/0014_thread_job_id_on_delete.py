@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:57
+
+from django.db import migrations, models
+import rfis.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfis', '0013_dead_letter_blocked_stage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='thread',
+            name='job_id',
+            field=models.ForeignKey(on_delete=models.SET(rfis.models.Job.get_job_sentinel_id), to='rfis.job', verbose_name='Job, Group, Topic, & Type'),
+        ),
+    ]
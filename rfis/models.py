@@ -43,6 +43,210 @@ class GmailCredentials(models.Model):
         return json.loads(credentials.credentials)
 
 
+class GmailSyncState(models.Model):
+    """
+    Stores the Gmail history id that the last mailbox sync finished at
+    so the next sync only has to ask for what changed since then.
+    """
+
+    history_id = models.CharField(max_length=100, blank=True, default="")
+    last_synced = models.DateTimeField(null=True, blank=True, default=None)
+    email_address = models.EmailField(blank=True, default="")
+    watch_expiration = models.DateTimeField(null=True, blank=True, default=None)
+
+    class Meta:
+        verbose_name_plural = "Gmail Sync State"
+
+    def save(self, *args, **kwargs):
+        self.pk = 1
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def load(cls):
+        if sync_state := cls.objects.filter(pk=1):
+            return sync_state.first()
+        return cls.objects.create(pk=1)
+
+    def update_history_id(self, history_id):
+        self.history_id = str(history_id)
+        self.last_synced = timezone.now()
+        self.save()
+
+    def has_changes_since(self, history_id):
+        """
+        Gmail history ids only ever increase so anything at or below the
+        stored id has already been synced.
+        """
+        return not self.history_id or int(history_id) > int(self.history_id)
+
+
+class IngestionHeartbeat(models.Model):
+    """
+    One row per ingestion worker process. The worker keeps last_heartbeat fresh
+    so the web process can tell if it's alive, and the web process sets
+    sync_requested to ask the worker to sync right away.
+    """
+
+    class Status(models.TextChoices):
+        IDLE = "IDLE"
+        RUNNING = "RUNNING"
+        STOPPED = "STOPPED"
+
+    name = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=25, choices=Status.choices, default=Status.STOPPED)
+    last_heartbeat = models.DateTimeField(null=True, blank=True, default=None)
+    sync_requested = models.BooleanField(default=False)
+    last_run_started = models.DateTimeField(null=True, blank=True, default=None)
+    last_run_finished = models.DateTimeField(null=True, blank=True, default=None)
+    last_run_message_count = models.IntegerField(default=0)
+    last_error = models.TextField(default="", blank=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def load(cls, name=c.INGESTION_WORKER_NAME):
+        heartbeat, _ = cls.objects.get_or_create(name=name)
+        return heartbeat
+
+    @property
+    def is_alive(self):
+        return (
+            self.status != self.Status.STOPPED
+            and self.last_heartbeat is not None
+            and timezone.now() - self.last_heartbeat
+            < datetime.timedelta(seconds=c.INGESTION_HEARTBEAT_TIMEOUT)
+        )
+
+    def beat(self, **fields):
+        # update instead of save so a sync requested by the web process isn't overwritten
+        fields["last_heartbeat"] = timezone.now()
+        IngestionHeartbeat.objects.filter(pk=self.pk).update(**fields)
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    def request_sync(self):
+        IngestionHeartbeat.objects.filter(pk=self.pk).update(sync_requested=True)
+        self.sync_requested = True
+
+
+class IngestionRun(models.Model):
+    """
+    What a single ingestion run did. The counters and last_thread_id are saved while
+    the run is in progress so a run that crashed or timed out can be resumed.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = "RUNNING"
+        SUCCEEDED = "SUCCEEDED"
+        STOPPED = "STOPPED"
+        FAILED = "FAILED"
+        # the process died while the run was in progress
+        INTERRUPTED = "INTERRUPTED"
+
+    class Mode(models.TextChoices):
+        FULL = "FULL"
+        HISTORY = "HISTORY"
+
+    worker_name = models.CharField(max_length=100)
+    mode = models.CharField(max_length=25, choices=Mode.choices)
+    status = models.CharField(max_length=25, choices=Status.choices, default=Status.RUNNING)
+    started = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True, default=None)
+    query_params = models.CharField(max_length=255, blank=True, default="")
+    start_history_id = models.CharField(max_length=100, blank=True, default="")
+    last_thread_id = models.CharField(max_length=255, blank=True, default="")
+    # how many history records a history run listed, anything after them is new to a resumed run
+    history_records_listed = models.IntegerField(default=0)
+    resumed_from = models.ForeignKey(
+        "self", on_delete=models.SET_NULL, null=True, blank=True, default=None
+    )
+    threads_seen = models.IntegerField(default=0)
+    threads_failed = models.IntegerField(default=0)
+    messages_seen = models.IntegerField(default=0)
+    messages_created = models.IntegerField(default=0)
+    messages_skipped = models.IntegerField(default=0)
+    # sent to the dead letter queue
+    messages_failed = models.IntegerField(default=0)
+    messages_marked_read = models.IntegerField(default=0)
+    # {stage name: seconds}
+    stage_durations = models.JSONField(default=dict, blank=True)
+    error = models.TextField(default="", blank=True)
+
+    class Meta:
+        ordering = ["-started"]
+
+    def __str__(self):
+        return f"{self.worker_name} {self.mode} run started {self.started}"
+
+    @property
+    def duration(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class DeadLetterMessage(models.Model):
+    """
+    A Gmail message that couldn't be parsed or stored. The raw message is kept so it
+    can be retried with backoff, and the rest of its thread and run carry on without it.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING"
+        RESOLVED = "RESOLVED"
+        GIVEN_UP = "GIVEN_UP"
+
+    class Stage(models.TextChoices):
+        PARSE = "PARSE"
+        WRITE = "WRITE"
+        # turned away because an earlier message of its thread failed
+        BLOCKED = "BLOCKED"
+
+    message_id = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    thread_id = models.CharField(max_length=255, blank=True, default="")
+    stage = models.CharField(max_length=25, choices=Stage.choices)
+    status = models.CharField(max_length=25, choices=Status.choices, default=Status.PENDING)
+    payload = models.JSONField(default=dict)
+    error = models.TextField(default="", blank=True)
+    attempts = models.IntegerField(default=0)
+    first_failed = models.DateTimeField(default=timezone.now)
+    last_failed = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+
+    objects = mg.DeadLetterMessageManager()
+
+    def __str__(self):
+        return f"{self.message_id} failed at {self.stage}"
+
+    def failed(self, error):
+        now = timezone.now()
+        self.attempts += 1
+        self.error = mg.format_error(error)
+        self.last_failed = now
+        if self.attempts >= c.DEAD_LETTER_MAX_ATTEMPTS:
+            self.status = self.Status.GIVEN_UP
+        else:
+            backoff = min(
+                c.DEAD_LETTER_BACKOFF_MAX,
+                c.DEAD_LETTER_BACKOFF_BASE * 2 ** (self.attempts - 1),
+            )
+            self.next_attempt_at = now + datetime.timedelta(seconds=backoff)
+        self.save()
+
+    def resolve(self):
+        self.status = self.Status.RESOLVED
+        self.save()
+
+    def retry_now(self):
+        self.status = self.Status.PENDING
+        self.next_attempt_at = timezone.now()
+        self.save()
+
+
 class MyUser(AbstractUser):
     username = None
     email = models.EmailField("email address", unique=True)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import ingestion
+from . import models as m
+from .email_parser import vocabulary
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=m.Job)
+@receiver(post_delete, sender=m.Job)
+@receiver(post_save, sender=m.ThreadType)
+@receiver(post_delete, sender=m.ThreadType)
+def invalidate_ingestion_lookups(sender, **kwargs):
+    ingestion.invalidate_lookups()
+
+
+@receiver(post_save, sender=m.Job)
+@receiver(post_delete, sender=m.Job)
+@receiver(post_save, sender=m.ThreadType)
+@receiver(post_delete, sender=m.ThreadType)
+@receiver(post_save, sender=m.ThreadTypeAltName)
+@receiver(post_delete, sender=m.ThreadTypeAltName)
+def invalidate_parser_vocabulary(sender, **kwargs):
+    vocabulary.bump_vocabulary_version()
+    # other processes could rebuild before the change is committed so bump it again after
+    transaction.on_commit(vocabulary.bump_vocabulary_version)
@@ -1,5 +1,8 @@
 from .email_parser_tests import *
+from .gmail_replay_tests import *
 from .gmail_service_tests import *
+from .ingestion_tests import *
+from .mailbox_generator_tests import *
 from .selenium_tests import *
 from .util_tests import *
 from .view_tests import *
@@ -1,2 +1,4 @@
+from .content_parser_tests import *
 from .gmail_parser_tests import *
+from .matcher_tests import *
 from .reply_parser_tests import *
@@ -0,0 +1,127 @@
+import base64
+from unittest import mock
+
+from bs4 import BeautifulSoup
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from ... import checks
+from ... import email_parser as eparser
+from ...email_parser import content_parsers, html_backends
+
+OUTLOOK_HTML = """<html xmlns:o="urn:schemas-microsoft-com:office:office"><head>
+<style><!-- p.MsoNormal {margin:0in;} --></style>
+<!--[if gte mso 9]><xml><o:shapedefaults spidmax="1026" /></xml><![endif]--></head>
+<body lang=EN-US><div class=WordSection1>
+<p class=MsoNormal>Please see attached RFI&nbsp;#12.<o:p></o:p></p>
+<ul><li><![if !supportLists]>1.<![endif]>Item one</li></ul>
+<p class=MsoNormal><b>From:</b> John Smith &lt;john@example.com&gt;<br><b>Sent:</b> Monday</p>
+</div></body></html>"""
+
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode("utf8")).decode("ascii")
+
+
+class MultiPartParserTestCase(SimpleTestCase):
+    def test_html_is_only_parsed_when_needed(self):
+        payload = {
+            "mimeType": "multipart/alternative",
+            "parts": [
+                {"mimeType": "text/plain", "body": {"data": encode("Plain body")}},
+                {"mimeType": "text/html", "body": {"data": encode("<b>Html body</b>")}},
+            ],
+        }
+        parser = eparser.MultiPartParser(prefer_html=False)
+        with mock.patch.object(
+            content_parsers, "html_body", wraps=content_parsers.html_body
+        ) as html_body:
+            parser.parse(payload)
+            self.assertEqual(parser.body, "Plain body")
+            self.assertEqual(parser.debug_unparsed_body, "Plain body")
+            html_body.assert_not_called()
+
+        parser = eparser.MultiPartParser(prefer_html=True)
+        parser.parse(payload)
+        self.assertEqual(parser.body, "Html body")
+
+    def test_falls_back_to_html(self):
+        parser = eparser.MultiPartParser(prefer_html=False)
+        parser.parse(
+            {
+                "mimeType": "multipart/mixed",
+                "parts": [
+                    {
+                        "mimeType": "multipart/alternative",
+                        "body": {},
+                        "parts": [
+                            {"mimeType": "text/plain", "body": {"size": 0}},
+                            {
+                                "mimeType": "text/html",
+                                "body": {
+                                    "data": encode("<p>Html &amp; only</p><p>From: x</p>")
+                                },
+                            },
+                        ],
+                    },
+                    # the same attachment twice
+                    *[
+                        {
+                            "mimeType": "image/png",
+                            "filename": "a.png",
+                            "body": {"attachmentId": "1"},
+                        }
+                    ]
+                    * 2,
+                ],
+            }
+        )
+        self.assertEqual(parser.body, "Html & only ")
+        self.assertEqual(parser.debug_unparsed_body, "Html & only From: x")
+        self.assertListEqual(
+            parser.files_info, [{"filename": "a.png", "gmail_attachment_id": "1"}]
+        )
+
+    def test_get_text_matches_beautifulsoup(self):
+        for text in (
+            "",
+            "  plain text\r\n with lines\t",
+            "\xa0no markup　",
+            "a < b",
+            "fish &amp; chips",
+            "<div>Hello <b>there</b></div>",
+        ):
+            self.assertEqual(
+                content_parsers.get_text(text),
+                BeautifulSoup(text, "html.parser").get_text(" ", strip=True),
+            )
+
+
+class HtmlBackendTestCase(SimpleTestCase):
+    documents = [
+        OUTLOOK_HTML,
+        "fish &amp; chips",
+        "x < y and y > z",
+        "<p>unclosed <b>bold<p>next",
+        "<table><tr><td>a</td><td>b</td></tr></table>",
+        "<!-- only a comment -->",
+        '<?xml version="1.0" encoding="utf-8"?><html><body>declared</body></html>',
+    ]
+
+    def test_backends_match_the_reference(self):
+        for name in html_backends.BACKENDS:
+            with self.subTest(backend=name):
+                try:
+                    html_backends.get_backend(name)
+                except ImproperlyConfigured:
+                    self.skipTest(f"{name} isn't installed")
+                result = html_backends.compare_backends(self.documents, [name])[name]
+                self.assertEqual(result["different"], 0, result["diffs"])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            html_backends.get_backend("regex")
+        self.assertListEqual(checks.check_html_to_text_backend(None), [])
+        with override_settings(HTML_TO_TEXT_BACKEND="regex"):
+            errors = checks.check_html_to_text_backend(None)
+        self.assertListEqual([error.id for error in errors], ["rfis.E001"])
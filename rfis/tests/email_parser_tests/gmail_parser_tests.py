@@ -1,13 +1,18 @@
 import json
 import os
+import pickle
 
 from django.conf import settings
-from django.test import TestCase
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
 
 from ... import constants as c
 from ... import email_parser as eparser
+from ... import mailbox_generator as mbg
 from ... import models as m
+from ...email_parser import vocabulary
 from .. import gmail_mock
+from .. import utils as tu
 
 
 class GmailParserTestCase(TestCase):
@@ -99,3 +104,93 @@ class GmailParserTestCase(TestCase):
         #     self.answer_data,
         #     open(os.path.join(settings.BASE_DIR, "test_data", "answers.json"), "w"),
         # )
+
+
+def generated_messages(job_names, threads=20):
+    generator = mbg.MailboxGenerator(["a@example.com", "b@example.com"], job_names, seed=5)
+    return [
+        msg
+        for thread in generator.iter_threads(threads, max_replies=3)
+        for msg in mbg.as_gmail_thread(thread)["messages"]
+    ]
+
+
+class ParsedMessageTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        job_names = mbg.MailboxGenerator.job_names_for(20, seed=5)
+        thread_types = list(mbg.THREAD_TYPES)
+        cls.vocabulary = vocabulary.Vocabulary(
+            version=1,
+            thread_types=thread_types,
+            thread_type_alt_names={},
+            job_names=job_names,
+            job_matcher=eparser.JobNameMatcher(job_names, vocabulary.job_name_processor),
+            thread_type_matcher=eparser.ThreadTypeMatcher(thread_types, {}),
+        )
+        cls.messages = generated_messages(job_names)
+
+    def test_parsed_message_is_immutable_and_picklable(self):
+        parsed = eparser.parse_message(self.messages[0], self.vocabulary, 80)
+        self.assertFalse(hasattr(parsed, "__dict__"))
+        with self.assertRaises(AttributeError):
+            parsed.body = ""
+        self.assertEqual(pickle.loads(pickle.dumps(parsed)), parsed)
+        self.assertSetEqual(
+            set(parsed.as_dict()),
+            {
+                "message_id", "thread_id", "subject", "body", "debug_unparsed_body",
+                "fromm", "to", "cc", "date", "thread_type", "job_name", "files_info",
+            },
+        )
+
+    def test_processes_parse_like_parse_message(self):
+        broken = {"id": "1", "threadId": "1", "internalDate": "0"}
+        parsed, failures = eparser.parse_messages_in_processes(
+            self.messages + [broken], self.vocabulary, 80, max_workers=2, chunksize=7
+        )
+        self.assertListEqual(
+            parsed, [eparser.parse_message(msg, self.vocabulary, 80) for msg in self.messages]
+        )
+        self.assertTrue(set(p.job_name for p in parsed) & set(self.vocabulary.job_names))
+        self.assertEqual(len(failures), 1)
+        self.assertIs(failures[0][0], broken)
+
+
+class ParseInProcessesTransactionTestCase(TestCase):
+    def test_messages_are_parsed_here_inside_a_transaction(self):
+        job_names = mbg.MailboxGenerator.job_names_for(5, seed=5)
+        messages = generated_messages(job_names, threads=3)
+        parsed, failures = eparser.parse_messages_in_processes(
+            messages, vocabulary.get_vocabulary(), 80, max_workers=2
+        )
+        # closing the connection would have thrown the test's transaction away
+        self.assertTrue(connection.in_atomic_block)
+        self.assertListEqual([p.message_id for p in parsed], [msg["id"] for msg in messages])
+        self.assertListEqual(failures, [])
+
+
+class GmailParserParsedMessageTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        tu.create_default_db_entries()
+        job_names = mbg.MailboxGenerator.job_names_for(20, seed=5)
+        mbg.create_synthetic_jobs(job_names)
+        mbg.create_thread_types()
+        cls.messages = generated_messages(job_names, threads=5)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+    def test_gmail_parser_matches_parse_message(self):
+        parser = eparser.GmailParser()
+        for msg in self.messages:
+            parser.parse(msg)
+            parsed = eparser.parse_message(
+                msg, vocabulary.get_vocabulary(), parser._subject_parser._min_score_allowed
+            )
+            self.assertEqual(parser.parsed_message, parsed)
+            self.assertDictEqual(parser.as_dict(), parsed.as_dict())
@@ -0,0 +1,199 @@
+import collections
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from thefuzz import fuzz
+from thefuzz import utils as fuzz_utils
+
+from ... import constants as c
+from ... import email_parser as eparser
+from ... import mailbox_generator as mbg
+from ... import models as m
+from ... import utils as u
+from ...email_parser import vocabulary
+
+
+def job_name_processor(name):
+    return name.lower().replace(" ", "")
+
+
+class JobNameMatcherTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.job_names = mbg.MailboxGenerator.job_names_for(300, seed=2)
+        generator = mbg.MailboxGenerator(["a@example.com"], cls.job_names, seed=2)
+        cls.subject_lines = [
+            thread["messages"][0]["synthetic"]["subject"]
+            for thread in generator.iter_threads(60, max_replies=0)
+        ] + ["Lunch on Friday", "RFI", "Weekly schedule update"]
+
+    def test_best_match_scores_like_a_full_scan(self):
+        matcher = eparser.JobNameMatcher(self.job_names, job_name_processor)
+        for subject_line in self.subject_lines:
+            full_match, _, full_score = u.get_best_match(
+                self.job_names, [subject_line], job_name_processor
+            )
+            self.assertEqual(
+                matcher.best_match(subject_line), (full_match, full_score), subject_line
+            )
+
+    def test_wratio_upper_bound(self):
+        for subject_line in self.subject_lines:
+            processed = fuzz_utils.full_process(
+                job_name_processor(subject_line), force_ascii=True
+            )
+            for job_name in self.job_names:
+                job_processed = fuzz_utils.full_process(
+                    job_name_processor(job_name), force_ascii=True
+                )
+                bound = eparser.wratio_upper_bound(
+                    collections.Counter(job_processed),
+                    len(job_processed),
+                    collections.Counter(processed),
+                    len(processed),
+                )
+                self.assertGreaterEqual(
+                    bound,
+                    fuzz.WRatio(job_processed, processed, full_process=False),
+                    (job_name, subject_line),
+                )
+
+    def test_highest_possible_match_is_the_best_prefix_ratio(self):
+        for subject_line in self.subject_lines:
+            for job_name in self.job_names[:20]:
+                processed = job_name_processor(subject_line)
+                expected = max(
+                    [0]
+                    + [
+                        fuzz.ratio(job_name_processor(job_name), processed[:length])
+                        for length in range(len(processed))
+                    ]
+                )
+                self.assertEqual(
+                    u.get_highest_possible_match(
+                        job_name, subject_line, job_name_processor
+                    ),
+                    (job_name, expected),
+                )
+
+    def test_jobs_crowded_out_of_the_candidates_are_still_found(self):
+        # more prefixes of the job name than MAX_CANDIDATES crowd it out of the
+        # candidates and the best of them scores 99
+        job_name = "Riverside Elementary School Renovation"
+        processed = job_name_processor(job_name)
+        job_names = [
+            processed[:length]
+            for length in range(len(processed) - 1, len(processed) - 12, -1)
+        ] + [job_name]
+        matcher = eparser.JobNameMatcher(job_names, job_name_processor)
+        for subject_line in (job_name, f"RFI {job_name}"):
+            self.assertNotIn(job_name, matcher.candidates(subject_line))
+            full_match, _, full_score = u.get_best_match(
+                job_names, [subject_line], job_name_processor
+            )
+            self.assertEqual(full_match, job_name)
+            self.assertEqual(matcher.best_match(subject_line), (job_name, full_score))
+
+    def test_no_job_names(self):
+        self.assertEqual(eparser.JobNameMatcher([]).best_match("RFI Test Job"), ("", 0))
+
+
+class ThreadTypeMatcherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.matcher = eparser.ThreadTypeMatcher(
+            [c.FIELD_VALUE_UNKNOWN_THREAD_TYPE, "RFI", "Submittal", "Change Order"],
+            {"SUB": "Submittal", "Sbmtl": "Submittal", "CO": "Change Order"},
+        )
+
+    def test_alt_names_are_exact_hits(self):
+        for subject_line in (
+            "Submittal - Oak Hill Library - casework",
+            "SUB #4 Oak Hill Library",
+            "sbmtl: Oak Hill Library casework",
+        ):
+            self.assertEqual(self.matcher.best_match(subject_line), ("Submittal", 100))
+        self.assertEqual(
+            self.matcher.best_match("change order #2 for the Oak Hill Library"),
+            ("Change Order", 100),
+        )
+        # the earliest hit wins
+        self.assertEqual(self.matcher.best_match("RFI 12 about CO 3")[0], "RFI")
+
+    def test_fuzzy_fallback(self):
+        thread_type, score = self.matcher.best_match("Submital for the Oak Hill Library")
+        self.assertEqual(thread_type, "Submittal")
+        self.assertLess(score, 100)
+        # words have to match whole words to be exact hits
+        self.assertIsNone(self.matcher.exact_match("Subway Station Renovation"))
+        self.assertIsNone(self.matcher.exact_match("Unknown job"))
+
+    def test_token_automaton_finds_overlapping_patterns(self):
+        automaton = eparser.TokenAutomaton(
+            {("a", "b"): "ab", ("b", "c"): "bc", ("b",): "b", ("a", "b", "c", "d"): "abcd"}
+        )
+        self.assertListEqual(
+            sorted(automaton.iter_matches(("x", "a", "b", "c", "d"))),
+            [(1, 3, "ab"), (1, 5, "abcd"), (2, 3, "b"), (2, 4, "bc")],
+        )
+
+
+class VocabularyTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        m.Job.objects.get_or_create(name=c.FIELD_VALUE_UNKNOWN_JOB)
+        m.ThreadType.objects.get_or_create(name="RFI")
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+    def setUp(self):
+        # the vocabulary and matches of another test's rolled back rows can't be used
+        vocabulary.reset_vocabulary()
+        eparser.clear_subject_line_cache()
+
+    def test_parser_sees_new_jobs_without_being_rebuilt(self):
+        parser = eparser.SubjectLineParser()
+        parser.parse("RFI Lakeview Fire Station drywall")
+        self.assertEqual(parser.job_name, c.FIELD_VALUE_UNKNOWN_JOB)
+        version = parser.vocabulary.version
+
+        job = m.Job.objects.create(name="Lakeview Fire Station", start_date=timezone.now())
+        parser.parse("RFI Lakeview Fire Station drywall")
+        self.assertEqual(parser.job_name, job.name)
+        self.assertNotEqual(parser.vocabulary.version, version)
+
+    def test_vocabulary_is_shared_until_the_version_changes(self):
+        first = vocabulary.get_vocabulary()
+        self.assertIs(vocabulary.get_vocabulary(check_interval=0), first)
+        m.ThreadTypeAltName.objects.create(
+            name="Request For Information", thread_type=m.ThreadType.objects.get(name="RFI")
+        )
+        second = vocabulary.get_vocabulary()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.thread_type_alt_names["Request For Information"], "RFI")
+
+    def test_alt_names_are_used_for_thread_types(self):
+        m.ThreadTypeAltName.objects.create(
+            name="Request For Information", thread_type=m.ThreadType.objects.get(name="RFI")
+        )
+        parser = eparser.SubjectLineParser()
+        parser.parse("RE: Request for Information - Lakeview Fire Station")
+        self.assertEqual(parser.thread_type, "RFI")
+
+    def test_replies_reuse_the_subject_line_match(self):
+        eparser.clear_subject_line_cache()
+        parser = eparser.SubjectLineParser()
+        for subject_line in ("RFI Lakeview Fire Station", "RE: RFI Lakeview Fire Station"):
+            parser.parse(subject_line)
+        self.assertDictEqual(
+            eparser.subject_line_cache_info(),
+            {"hits": 1, "misses": 1, "size": 1, "maxsize": c.SUBJECT_LINE_CACHE_SIZE},
+        )
+        # a new job can change the match so the cached one isn't used anymore
+        job = m.Job.objects.create(name="Lakeview Fire Station", start_date=timezone.now())
+        parser.parse("RE: RFI Lakeview Fire Station")
+        self.assertEqual(parser.job_name, job.name)
+        self.assertEqual(eparser.subject_line_cache_info()["misses"], 2)
@@ -1,8 +1,9 @@
 import json
 import os
+import time
 
 from django.conf import settings
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
 from ... import constants as c
 from ... import email_parser as eparser
@@ -24,3 +25,44 @@ class EmailReplyParserTestCase(TestCase):
 
     def test_email_reply_parser(self):
         eparser.EmailReplyParser.parse_reply(text)
+
+
+class EmailReplyParserInputTestCase(SimpleTestCase):
+    def assertParsesQuickly(self, text, seconds=2):
+        start = time.perf_counter()
+        eparser.EmailReplyParser.parse_reply(text)
+        self.assertLess(time.perf_counter() - start, seconds)
+
+    def test_joins_multi_line_quote_header(self):
+        text = "Thanks\n\nOn Mon, Jan 3, 2022 at 9:00 AM Bob <b@x.com>\nwrote:\n> hello"
+        self.assertEqual(
+            eparser.reply_parser.EmailMessage._join_multi_line_quote_header(text),
+            "Thanks\n\nOn Mon, Jan 3, 2022 at 9:00 AM Bob <b@x.com>wrote:\n> hello",
+        )
+        self.assertEqual(eparser.EmailReplyParser.parse_reply(text), "Thanks")
+
+    def test_quote_header_is_replaced_literally(self):
+        text = "Hi\n\nOn Mon C:\\1 \\g<0>\nwrote:\n> quoted"
+        self.assertEqual(eparser.EmailReplyParser.parse_reply(text), "Hi")
+
+    def test_adversarial_bodies(self):
+        self.assertParsesQuickly("On " * 30000 + "wrote:")
+        self.assertParsesQuickly("On x " * 20000 + "wrote")
+        self.assertParsesQuickly("From: a\nbody\n" * 8000)
+        self.assertParsesQuickly(("x\n" + "-" * 5000 + "\n") * 20)
+        self.assertParsesQuickly(
+            "".join(
+                f"On Mon, Jan {i} 2022 Bob <b@x.com>\nwrote:\n> line {i}\n"
+                for i in range(3000)
+            )
+        )
+
+    def test_long_body_is_kept(self):
+        text = "Reply\n\n" + "> quoted\n" * 200_000
+        self.assertParsesQuickly(text)
+        self.assertEqual(eparser.EmailReplyParser.parse_reply(text), "Reply")
+        # only the quote header search is limited, the reply itself is never cut
+        text = "line of a long reply\n" * 20_000
+        self.assertGreater(len(text), eparser.reply_parser.EmailMessage.MAX_QUOTE_HEADER_SEARCH)
+        self.assertParsesQuickly(text)
+        self.assertEqual(eparser.EmailReplyParser.parse_reply(text), text.rstrip("\n"))
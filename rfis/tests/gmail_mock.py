@@ -3,24 +3,27 @@ import os
 
 from django.conf import settings
 
+from .. import gmail_replay
 
-class GmailServiceMock:
+
+class GmailServiceMock(gmail_replay.ReplayGmailService):
     test_directory = os.path.join(settings.BASE_DIR, "test_data")
     threads_file = os.path.join(test_directory, "threads.json")
     messages_file = os.path.join(test_directory, "messages.json")
+    history_id = "100"
+    expired_history_id = "1"
 
     def __init__(self) -> None:
         self.threads = json.load(open(self.threads_file, "r"))
         self.messages = json.load(open(self.messages_file, "r"))
-
-    def __del__(self):
-        pass
-
-    def get_threads(self, query_params=""):
-        return [{"id": thread["id"]} for thread in self.threads["threads"]]
-
-    def get_thread(self, thread_id):
-        return list(filter(lambda t: t["id"] == thread_id, self.threads["threads"]))[0]
+        archive = gmail_replay.GmailArchive(
+            self.threads["threads"],
+            profile={"emailAddress": "test@test.com", "historyId": self.history_id},
+        )
+        # messages that aren't part of a thread can be fetched too
+        for msg in self.messages["messages"]:
+            archive.messages.setdefault(msg["id"], msg)
+        super().__init__(archive)
 
     def get_messages(self, query_params=""):
         return {
@@ -30,13 +33,13 @@ class GmailServiceMock:
             ]
         }
 
-    def get_message(self, message_id):
-        return list(
-            filter(lambda msg: msg["id"] == message_id, self.messages["messages"])
-        )[0]
-
-    def mark_read_messages(self, read_messages):
-        return
-
-    def get_attachment(self, message_id, attachment_id):
-        return
+    def get_history(self, start_history_id, label_id="INBOX"):
+        if start_history_id == self.expired_history_id:
+            return None
+        # every message in the mock mailbox counts as newly added
+        history = [
+            {"messagesAdded": [{"message": {"id": msg["id"], "threadId": msg["threadId"]}}]}
+            for thread in self.threads["threads"]
+            for msg in thread["messages"]
+        ]
+        return {"history": history, "historyId": self.history_id}
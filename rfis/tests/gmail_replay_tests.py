@@ -0,0 +1,136 @@
+import base64
+import os
+import tempfile
+
+import httplib2
+from django.test import SimpleTestCase
+from googleapiclient.errors import HttpError
+
+from .. import gmail_replay
+
+
+def make_thread(thread_id, sender, body):
+    data = base64.urlsafe_b64encode(body.encode("utf8")).decode("ascii")
+    return {
+        "id": thread_id,
+        "messages": [
+            {
+                "id": f"{thread_id}-1",
+                "threadId": thread_id,
+                "historyId": "10",
+                "internalDate": "1640995200000",
+                "snippet": body,
+                "payload": {
+                    "mimeType": "text/plain",
+                    "headers": [
+                        {"name": "From", "value": f"Sender <{sender}>"},
+                        {"name": "Subject", "value": "RFI Test Job"},
+                        {"name": "To", "value": "rfis@example.org"},
+                    ],
+                    "body": {"size": len(body), "data": data},
+                },
+            }
+        ],
+    }
+
+
+class GmailReplayTestCase(SimpleTestCase):
+    def test_record_and_replay(self):
+        source = gmail_replay.ReplayGmailService(
+            gmail_replay.GmailArchive(
+                [
+                    make_thread(f"t{i}", f"person{i}@builder.com", "Call bob@builder.com")
+                    for i in range(3)
+                ],
+                profile={"emailAddress": "rfis@example.org", "historyId": "20"},
+            )
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "mailbox.jsonl.gz")
+            written, failed = gmail_replay.record_gmail_archive(
+                source,
+                path,
+                limit=2,
+                scrubber=gmail_replay.GmailScrubber(keep=["rfis@example.org"]),
+            )
+            self.assertEqual(written, 2)
+            self.assertListEqual(failed, [])
+            archive = gmail_replay.GmailArchive.load(path)
+
+        self.assertListEqual(list(archive.threads), ["t0", "t1"])
+        self.assertEqual(archive.profile["emailAddress"], "rfis@example.org")
+        replay = gmail_replay.ReplayGmailService(archive)
+        message = replay.get_message("t0-1")
+        headers = {h["name"]: h["value"] for h in message["payload"]["headers"]}
+        self.assertNotIn("person0@builder.com", headers["From"])
+        self.assertNotIn("Sender", headers["From"])
+        self.assertEqual(headers["To"], "rfis@example.org")
+        body = base64.urlsafe_b64decode(message["payload"]["body"]["data"]).decode("utf8")
+        self.assertNotIn("bob@builder.com", body)
+        # the same address is always scrubbed to the same pseudonym
+        self.assertIn(body.split()[-1], replay.get_message("t1-1")["snippet"])
+
+        metadata = replay.get_thread("t0", format="metadata", metadata_headers=["From"])
+        self.assertListEqual(
+            [h["name"] for h in metadata["messages"][0]["payload"]["headers"]], ["From"]
+        )
+        self.assertNotIn("body", metadata["messages"][0]["payload"])
+        threads, errors = replay.get_threads_batch(["t0", "missing"])
+        self.assertListEqual(list(threads), ["t0"])
+        self.assertEqual(errors["missing"].resp.status, 404)
+
+    def test_injected_errors(self):
+        replay = gmail_replay.ReplayGmailService(
+            gmail_replay.GmailArchive([make_thread("t0", "a@b.com", "body")]),
+            error_rate=1.0,
+        )
+        with self.assertRaises(HttpError):
+            replay.get_thread("t0")
+        _, errors = replay.get_threads_batch(["t0"])
+        self.assertEqual(errors["t0"].resp.status, 503)
+
+    def test_scrubs_display_names(self):
+        thread = make_thread("t0", "jane.doe@builder.com", "Thanks\n\nOn Monday Jane Doe wrote:")
+        headers = thread["messages"][0]["payload"]["headers"]
+        headers[0]["value"] = "Jane Doe <jane.doe@builder.com>"
+        headers[2]["value"] = '"Smith, Bob" <bob@builder.com>, RFIs <rfis@example.org>'
+        scrubber = gmail_replay.GmailScrubber(keep=["rfis@example.org"])
+        scrubbed = scrubber.scrub_thread(thread)["messages"][0]
+        headers = {h["name"]: h["value"] for h in scrubbed["payload"]["headers"]}
+        name = scrubber.pseudonym_name("jane.doe@builder.com")
+        self.assertEqual(
+            headers["From"], f"{name} <{scrubber.pseudonym('jane.doe@builder.com')}>"
+        )
+        self.assertNotIn("Smith", headers["To"])
+        self.assertIn("RFIs <rfis@example.org>", headers["To"])
+        body = base64.urlsafe_b64decode(scrubbed["payload"]["body"]["data"]).decode("utf8")
+        self.assertIn(f"On Monday {name} wrote:", body)
+        self.assertNotIn("Jane", scrubbed["snippet"])
+
+    def test_record_retries_threads_that_failed(self):
+        class FlakyReplayGmailService(gmail_replay.ReplayGmailService):
+            failures = {"t1": 1, "t2": 2}
+
+            def get_threads_batch(self, thread_ids, **kwargs):
+                threads, errors = super().get_threads_batch(thread_ids, **kwargs)
+                for thread_id in thread_ids:
+                    if self.failures.get(thread_id):
+                        self.failures[thread_id] -= 1
+                        del threads[thread_id]
+                        errors[thread_id] = HttpError(
+                            httplib2.Response({"status": 503}), b"Backend Error"
+                        )
+                return threads, errors
+
+        source = FlakyReplayGmailService(
+            gmail_replay.GmailArchive(
+                [make_thread(f"t{i}", f"person{i}@builder.com", "body") for i in range(3)]
+            )
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "mailbox.jsonl.gz")
+            written, failed = gmail_replay.record_gmail_archive(source, path)
+            archive = gmail_replay.GmailArchive.load(path)
+        self.assertEqual(written, 2)
+        self.assertListEqual(failed, ["t2"])
+        self.assertListEqual(sorted(archive.threads), ["t0", "t1"])
@@ -1,5 +1,11 @@
+import datetime
+import socket
+import threading
+
+import httplib2
 from django.test import TestCase
 from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
 
 from .. import constants as c
 from .. import gmail_service
@@ -32,6 +38,175 @@ class GmailServiceTestCase(TestCase):
         # )
         # gmail_service.GmailService.save_client_token(creds)
 
+    def test_shared_client(self):
+        credentials = Credentials(
+            token="token",
+            refresh_token="refresh token",
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id="id",
+            client_secret="secret",
+            expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+        )
+        gmail_service._credentials = credentials
+        try:
+            # a token that isn't close to expiring is neither loaded nor saved again
+            with self.assertNumQueries(0):
+                service = gmail_service.GmailService()
+                self.assertIs(service.get_credentials(), credentials)
+                client = service.service
+            self.assertIs(gmail_service.GmailService().service, client)
+            other_thread_clients = []
+            thread = threading.Thread(
+                target=lambda: other_thread_clients.append(
+                    gmail_service.GmailService().service
+                )
+            )
+            thread.start()
+            thread.join()
+            self.assertIsNot(other_thread_clients[0], client)
+
+            credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=c.GMAIL_TOKEN_REFRESH_MARGIN - 1
+            )
+            self.assertTrue(gmail_service._needs_refresh(credentials))
+        finally:
+            gmail_service.reset_credentials()
+
+    def test_request_scheduler(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        def http_error(status, content=b""):
+            return HttpError(httplib2.Response({"status": status}), content)
+
+        class FakeRequest:
+            methodId = "gmail.users.threads.get"
+
+            def __init__(self, *failures):
+                self.failures = list(failures)
+                self.calls = 0
+
+            def execute(self):
+                self.calls += 1
+                if self.failures:
+                    raise self.failures.pop(0)
+                return {"id": self.calls}
+
+        scheduler = gmail_service.GmailRequestScheduler(
+            units_per_second=20, max_retries=2, clock=lambda: now[0], sleep=sleep
+        )
+        # 2 threads.get calls fit in one second of quota, the third has to wait
+        for _ in range(3):
+            scheduler.execute(FakeRequest())
+        self.assertAlmostEqual(sum(sleeps), 0.5)
+
+        request = FakeRequest(
+            http_error(429), http_error(403, b'{"reason": "userRateLimitExceeded"}')
+        )
+        self.assertEqual(scheduler.execute(request), {"id": 3})
+        with self.assertRaises(HttpError):
+            scheduler.execute(FakeRequest(http_error(404)))
+        with self.assertRaises(HttpError):
+            scheduler.execute(FakeRequest(*[http_error(503)] * 3))
+        stats = scheduler.stats()
+        self.assertEqual(stats["requests"], 3 + 3 + 1 + 3)
+        self.assertEqual(stats["quota_units"], 10 * stats["requests"])
+        self.assertEqual(stats["retries"], 4)
+        self.assertEqual(stats["failures"], 2)
+
+    def test_request_scheduler_batch(self):
+        class FakeBatch:
+            def __init__(self, callback):
+                self.callback = callback
+                self.requests = []
+
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+
+            def execute(self):
+                for request_id, request in self.requests:
+                    try:
+                        self.callback(request_id, request(), None)
+                    except HttpError as error:
+                        self.callback(request_id, None, error)
+
+        attempts = {"flaky": 0}
+
+        def flaky():
+            attempts["flaky"] += 1
+            if attempts["flaky"] == 1:
+                raise HttpError(httplib2.Response({"status": 500}), b"")
+            return "flaky"
+
+        def missing():
+            raise HttpError(httplib2.Response({"status": 404}), b"")
+
+        scheduler = gmail_service.GmailRequestScheduler(sleep=lambda seconds: None)
+        responses, errors = scheduler.execute_batch(
+            FakeBatch,
+            [("ok", lambda: "ok"), ("flaky", flaky), ("missing", missing)],
+        )
+        # only the request that failed with a transient error is retried
+        self.assertDictEqual(responses, {"ok": "ok", "flaky": "flaky"})
+        self.assertListEqual(list(errors), ["missing"])
+        self.assertEqual(attempts["flaky"], 2)
+
+    def test_get_or_create_label_never_retries_the_create(self):
+        class FakeRequest:
+            methodId = "gmail.users.labels.create"
+
+            def __init__(self, func):
+                self.execute = func
+
+        class FakeLabels:
+            def __init__(self, error):
+                self.error = error
+                self.labels = []
+                self.creates = 0
+
+            def list(self, userId):
+                return FakeRequest(lambda: {"labels": list(self.labels)})
+
+            def create(self, userId, body):
+                def create():
+                    self.creates += 1
+                    self.labels.append({"id": f"Label_{self.creates}", "name": body["name"]})
+                    # the label was made but the response never arrived
+                    raise self.error
+
+                return FakeRequest(create)
+
+        class FakeGmailService(gmail_service.GmailService):
+            def __init__(self, labels):
+                super().__init__()
+                self.labels = labels
+
+            def get_credentials(self):
+                return None
+
+            @property
+            def service(self):
+                labels = self.labels
+                users = type("Users", (), {"labels": lambda self: labels})()
+                return type("Client", (), {"users": lambda self: users})()
+
+        scheduler = gmail_service.scheduler
+        gmail_service.scheduler = gmail_service.GmailRequestScheduler(
+            sleep=lambda seconds: None
+        )
+        try:
+            for error in (socket.timeout(), HttpError(httplib2.Response({"status": 409}), b"")):
+                labels = FakeLabels(error)
+                service = FakeGmailService(labels)
+                self.assertEqual(service.get_or_create_label("Processed"), "Label_1")
+                self.assertEqual(labels.creates, 1)
+        finally:
+            gmail_service.scheduler = scheduler
+
     # # will test refresh decorator as well
     # # @override_settings(DEBUG="0", USE_SSL="0")
     # def test_get_message_thread(self):
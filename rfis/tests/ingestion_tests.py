@@ -0,0 +1,288 @@
+import copy
+
+from django import db
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .. import email_parser as eparser
+from .. import gmail_replay
+from .. import ingestion
+from .. import ingestion_benchmark
+from .. import ingestion_worker
+from .. import mailbox_generator
+from .. import models as m
+from .. import utils as u
+from . import utils as tu
+
+
+class IngestionWorkerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        tu.create_default_db_entries()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+    def test_run_once_updates_heartbeat(self):
+        worker = ingestion_worker.IngestionWorker(run=lambda **kwargs: 3)
+        self.assertEqual(worker.run_once(), 3)
+        heartbeat = m.IngestionHeartbeat.load()
+        self.assertEqual(heartbeat.last_run_message_count, 3)
+        self.assertEqual(heartbeat.status, m.IngestionHeartbeat.Status.IDLE)
+        self.assertTrue(heartbeat.is_alive)
+
+        def failing_run(**kwargs):
+            raise ValueError("gmail is down")
+
+        worker = ingestion_worker.IngestionWorker(run=failing_run)
+        self.assertIsNone(worker.run_once())
+        self.assertIn("gmail is down", m.IngestionHeartbeat.load().last_error)
+
+
+class IngestionWorkerLoopTestCase(TransactionTestCase):
+    # run_forever recycles connections between polls, which can't happen inside
+    # the transaction a TestCase wraps every test in
+    def test_run_forever_stops_gracefully(self):
+        runs = []
+
+        def run(should_stop, **kwargs):
+            runs.append(should_stop())
+            worker.stop()
+            return 0
+
+        worker = ingestion_worker.IngestionWorker(run=run, poll_interval=0)
+        worker.run_forever()
+        self.assertListEqual(runs, [False])
+        heartbeat = m.IngestionHeartbeat.load()
+        self.assertEqual(heartbeat.status, m.IngestionHeartbeat.Status.STOPPED)
+        self.assertFalse(heartbeat.is_alive)
+
+
+class IngestionRunTrackerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        m.GmailSyncState.load().update_history_id(100)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+    def test_interrupted_history_run_is_resumed(self):
+        context = ingestion.IngestionContext()
+        tracker = ingestion.IngestionRunTracker(
+            context, "gmail", m.IngestionRun.Mode.HISTORY
+        )
+        self.assertIsNone(context.resume_after_thread_id)
+        context.history_records_listed = 7
+        context.thread_committed("thread-1", 3)
+        context.count(messages_created=2)
+        with context.timed("write"):
+            pass
+        tracker.save()
+
+        run = m.IngestionRun.objects.get(pk=tracker.run.pk)
+        self.assertEqual(run.last_thread_id, "thread-1")
+        self.assertEqual(run.threads_seen, 1)
+        self.assertEqual(run.messages_skipped, 1)
+        self.assertIn("write", run.stage_durations)
+
+        # the first run never finished so the next one picks up after its last thread
+        resumed_context = ingestion.IngestionContext()
+        resumed = ingestion.IngestionRunTracker(
+            resumed_context, "gmail", m.IngestionRun.Mode.HISTORY
+        )
+        self.assertEqual(resumed_context.resume_after_thread_id, "thread-1")
+        self.assertEqual(resumed_context.resume_history_records, 7)
+        self.assertEqual(resumed.run.resumed_from, run)
+        self.assertEqual(
+            m.IngestionRun.objects.get(pk=run.pk).status,
+            m.IngestionRun.Status.INTERRUPTED,
+        )
+        resumed.finish(m.IngestionRun.Status.SUCCEEDED)
+
+        # nothing is resumed after a run that succeeded
+        next_context = ingestion.IngestionContext()
+        ingestion.IngestionRunTracker(next_context, "gmail", m.IngestionRun.Mode.HISTORY)
+        self.assertIsNone(next_context.resume_after_thread_id)
+
+    def test_resumed_history_sync_reprocesses_threads_with_new_messages(self):
+        archive = ingestion_benchmark.generated_archive(
+            4, max_replies=0, senders=["a@example.com"], job_names=["Test Job"]
+        )
+        service = gmail_replay.ReplayGmailService(archive)
+        thread_ids = list(archive.threads)
+        m.GmailSyncState.load().update_history_id(0)
+        listed = len(service.get_history("0")["history"])
+        # the interrupted run committed the first two threads, then the first got a reply
+        first = archive.threads[thread_ids[0]]
+        reply = dict(first["messages"][0], id="reply-after-crash", historyId="10")
+        first["messages"].append(reply)
+        archive.messages[reply["id"]] = reply
+
+        context = ingestion.IngestionContext()
+        context.resume_after_thread_id = thread_ids[1]
+        context.resume_history_records = listed
+        read_messages = list(
+            u.iter_gmail_history(service, eparser.GmailParser(), context=context)
+        )
+        read_thread_ids = {archive.messages[ids[0]]["threadId"] for ids in read_messages}
+        self.assertSetEqual(read_thread_ids, {thread_ids[0], *thread_ids[2:]})
+        self.assertIn(reply["id"], [msg_id for ids in read_messages for msg_id in ids])
+        self.assertEqual(context.history_records_listed, listed + 1)
+
+
+class BlockedDeadLetterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        tu.create_default_db_entries()
+        cls.senders = mailbox_generator.create_synthetic_users(1)
+
+    def test_replies_wait_for_the_message_that_starts_their_thread(self):
+        archive = ingestion_benchmark.generated_archive(
+            20, max_replies=3, senders=self.senders, job_names=["Test Job"]
+        )
+        parser = eparser.GmailParser()
+        # a thread whose replies are only stored because a user started it
+        messages = next(
+            copy.deepcopy(thread["messages"])
+            for thread in archive.threads.values()
+            if len(thread["messages"]) > 1
+            and all(
+                parser.parse_metadata(msg)["fromm"] not in self.senders
+                for msg in thread["messages"][1:]
+            )
+        )
+        first = messages[0]
+        payload = first.pop("payload")
+        read_messages = u.process_single_gmail_thread(messages, parser)
+        self.assertListEqual(read_messages, [msg["id"] for msg in messages])
+        self.assertFalse(m.Thread.objects.filter(gmail_thread_id=first["threadId"]).exists())
+        blocked = m.DeadLetterMessage.objects.filter(
+            stage=m.DeadLetterMessage.Stage.BLOCKED
+        )
+        self.assertEqual(blocked.count(), len(messages) - 1)
+
+        # the replies stay in the queue while the first message still fails
+        blocked.update(next_attempt_at=timezone.now())
+        self.assertEqual(u.retry_dead_letters(parser), 0)
+        self.assertFalse(
+            blocked.exclude(status=m.DeadLetterMessage.Status.PENDING).exists()
+        )
+
+        dead_letter = m.DeadLetterMessage.objects.get(message_id=first["id"])
+        dead_letter.payload = dict(first, payload=payload)
+        dead_letter.retry_now()
+        blocked.update(next_attempt_at=timezone.now())
+        self.assertEqual(u.retry_dead_letters(parser), len(messages))
+        self.assertEqual(
+            m.Message.objects.filter(message_id__in=[msg["id"] for msg in messages]).count(),
+            len(messages),
+        )
+
+
+class IngestionParseProcessesTestCase(TransactionTestCase):
+    def setUp(self):
+        tu.create_default_db_entries()
+        self.senders = mailbox_generator.create_synthetic_users(2)
+        self.archive = ingestion_benchmark.generated_archive(
+            12, max_replies=2, senders=self.senders, job_names=["Test Job"]
+        )
+        self.service = gmail_replay.ReplayGmailService(self.archive)
+
+    def stored_messages(self):
+        return list(
+            m.Message.objects.filter(message_id__in=self.archive.messages)
+            .order_by("message_id")
+            .values_list(
+                "message_id", "subject", "body", "fromm", "message_thread_id__job_id__name"
+            )
+        )
+
+    def test_batch_parsed_on_processes_is_stored_the_same(self):
+        thread_ids = list(self.archive.threads)
+        context = ingestion.IngestionContext(parse_processes=2)
+        read_messages = u.process_gmail_threads_batch(
+            self.service, eparser.GmailParser(), thread_ids, context
+        )
+        self.assertEqual(context.counters["messages_created"], len(self.archive.messages))
+        in_processes = self.stored_messages()
+        m.Thread.objects.filter(gmail_thread_id__in=thread_ids).delete()
+
+        self.assertListEqual(
+            u.process_gmail_threads_batch(self.service, eparser.GmailParser(), thread_ids),
+            read_messages,
+        )
+        self.assertListEqual(self.stored_messages(), in_processes)
+
+
+class ConcurrentIngestionConnectionsTestCase(TransactionTestCase):
+    def test_worker_connections_are_closed(self):
+        tu.create_default_db_entries()
+        senders = mailbox_generator.create_synthetic_users(2)
+        archive = ingestion_benchmark.generated_archive(
+            8, max_replies=1, senders=senders, job_names=["Test Job"]
+        )
+        connections = []
+
+        class RecordingGmailParser(eparser.GmailParser):
+            def parse(self, gmail_message):
+                super().parse(gmail_message)
+                connections.append(db.connections["default"])
+
+        read_messages = list(
+            u.iter_processed_gmail_threads_concurrently(
+                list(archive.threads),
+                lambda: gmail_replay.ReplayGmailService(archive),
+                RecordingGmailParser,
+                max_workers=3,
+            )
+        )
+        self.assertEqual(len(read_messages), 8)
+        # the parser read the vocabulary on the workers' own connections
+        self.assertNotIn(db.connections["default"], connections)
+        if db.connection.vendor == "sqlite" and db.connection.is_in_memory_db():
+            self.skipTest("in memory sqlite connections are never closed")
+        self.assertTrue(all(conn.connection is None for conn in connections))
+
+
+class IngestionBenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        tu.create_default_db_entries()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+    def test_run_benchmark_reports_and_cleans_up(self):
+        senders = mailbox_generator.create_synthetic_users(2)
+        archive = ingestion_benchmark.generated_archive(
+            10, max_replies=2, senders=senders, job_names=["Test Job"]
+        )
+        self.assertListEqual(ingestion_benchmark.archive_senders(archive), senders)
+        results = ingestion_benchmark.run_benchmark(archive)
+        self.assertEqual(results["threads_processed"], 10)
+        self.assertEqual(results["messages_processed"], len(archive.messages))
+        self.assertEqual(results["messages_created"], len(archive.messages))
+        self.assertGreater(results["sql"]["queries"], 0)
+        self.assertGreater(results["stage_seconds"]["match"], 0)
+        self.assertFalse(m.Thread.objects.filter(gmail_thread_id__in=archive.threads).exists())
+
+
+class IngestionBenchmarkStatsTestCase(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(ingestion_benchmark.percentile(values, 50), 50)
+        self.assertEqual(ingestion_benchmark.percentile(values, 95), 95)
+        self.assertEqual(ingestion_benchmark.percentile([], 95), 0.0)
+
+    def test_message_latencies(self):
+        context = ingestion_benchmark.BenchmarkContext()
+        context.started = 0.0
+        context.commits = [(1.0, 2), (4.0, 3), (4.5, 0)]
+        self.assertListEqual(context.message_latencies(), [0.5, 0.5, 1.0, 1.0, 1.0])
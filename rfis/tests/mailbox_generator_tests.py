@@ -0,0 +1,86 @@
+from django.test import SimpleTestCase, TestCase
+
+from .. import email_parser as e_parser
+from .. import mailbox_generator as mbg
+from .. import models as m
+from . import utils as tu
+
+
+def make_generator(seed=0, senders=("user0@synthetic.example.com",)):
+    return mbg.MailboxGenerator(
+        senders, mbg.MailboxGenerator.job_names_for(10, seed), seed=seed
+    )
+
+
+class MailboxGeneratorTestCase(SimpleTestCase):
+    def test_same_seed_generates_same_mailbox(self):
+        first = list(make_generator(seed=3).iter_threads(20))
+        start = first[0]["messages"][0]["synthetic"]["time_received"]
+        first = list(make_generator(seed=3).iter_threads(20, start=start))
+        second = list(make_generator(seed=3).iter_threads(20, start=start))
+        self.assertListEqual(
+            [mbg.as_gmail_thread(t) for t in first], [mbg.as_gmail_thread(t) for t in second]
+        )
+        self.assertNotEqual(
+            [t["id"] for t in first],
+            [t["id"] for t in make_generator(seed=4).iter_threads(20, start=start)],
+        )
+
+    def test_generated_payloads_parse(self):
+        for thread in make_generator().iter_threads(25, max_replies=3):
+            gmail_thread = mbg.as_gmail_thread(thread)
+            self.assertNotIn("expected", gmail_thread)
+            for msg, generated in zip(gmail_thread["messages"], thread["messages"]):
+                self.assertNotIn("synthetic", msg)
+                self.assertEqual(msg["threadId"], thread["id"])
+                body_parser = e_parser.MultiPartParser(prefer_html=False)
+                body_parser.parse(msg["payload"])
+                self.assertTrue(body_parser.body)
+                self.assertListEqual(
+                    [f["gmail_attachment_id"] for f in body_parser._chosen["files_info"]],
+                    [a[1] for a in generated["synthetic"]["attachments"]],
+                )
+            # replies quote the message before them
+            for previous, reply in zip(thread["messages"], thread["messages"][1:]):
+                self.assertIn(previous["synthetic"]["from"], reply["synthetic"]["text"])
+
+
+class MailboxGeneratorDatabaseTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maxDiff = None
+        tu.create_default_db_entries()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+    def test_generate_mailbox_bulk_creates_rows(self):
+        senders = mbg.create_synthetic_users(3)
+        generator = mbg.MailboxGenerator(senders, mbg.MailboxGenerator.job_names_for(4))
+        mbg.create_synthetic_jobs(generator.job_names)
+        threads, messages = mbg.generate_mailbox(generator, 30, max_replies=2, batch_size=7)
+        self.assertEqual(threads, 30)
+        self.assertEqual(m.Thread.objects.filter(original_initiator__in=senders).count(), 30)
+        self.assertEqual(
+            m.Message.objects.filter(message_thread_id__original_initiator__in=senders).count(),
+            messages,
+        )
+        self.assertTrue(
+            m.Thread.objects.filter(
+                original_initiator__in=senders, job_id__name__in=generator.job_names
+            ).exists()
+        )
+
+    def test_generate_mailbox_twice_with_same_seed(self):
+        senders = mbg.create_synthetic_users(2)
+        generator = mbg.MailboxGenerator(senders, mbg.MailboxGenerator.job_names_for(3))
+        mbg.create_synthetic_jobs(generator.job_names)
+        self.assertEqual(mbg.generate_mailbox(generator, 10, max_replies=2)[0], 10)
+        message_count = m.Message.objects.count()
+        # the same ids are generated again, the ones that are stored are left alone
+        generator = mbg.MailboxGenerator(senders, mbg.MailboxGenerator.job_names_for(3))
+        threads, _ = mbg.generate_mailbox(generator, 15, max_replies=2, batch_size=4)
+        self.assertEqual(threads, 5)
+        self.assertEqual(m.Thread.objects.filter(original_initiator__in=senders).count(), 15)
+        self.assertGreater(m.Message.objects.count(), message_count)
@@ -1,8 +1,12 @@
+import copy
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
 
 from .. import constants as c
 from .. import email_parser as eparser
+from .. import ingestion as ing
 from .. import models as m
 from .. import utils as u
 from . import gmail_mock
@@ -149,12 +153,15 @@ class UtilsTestCase(TestCase):
 
     def test_create_db_entry_from_parser(self):
         parser = eparser.GmailParser()
+        context = ing.IngestionContext()
         gmail_messages = self.gmail_service.get_messages()
         for gmail_message_id in gmail_messages["messages"]:
             single_gmail_message = self.gmail_service.get_message(gmail_message_id["id"])
             # Create all of the messages that started the threads
             if single_gmail_message["id"] == single_gmail_message["threadId"]:
-                created = u.create_db_entry_from_parser(parser, single_gmail_message)
+                created = u.create_db_entry_from_parser(
+                    parser, single_gmail_message, context
+                )
                 thread = m.Thread.objects.get(gmail_thread_id=parser.thread_id)
                 message = m.Message.objects.get(message_id=parser.message_id)
                 attachments_count = m.Attachment.objects.filter(
@@ -165,7 +172,9 @@ class UtilsTestCase(TestCase):
         # the rest of the messages in the thread will be added successfully
         for gmail_message_id in gmail_messages["messages"]:
             single_gmail_message = self.gmail_service.get_message(gmail_message_id["id"])
-            created = u.create_db_entry_from_parser(parser, single_gmail_message)
+            created = u.create_db_entry_from_parser(
+                parser, single_gmail_message, context
+            )
             thread = m.Thread.objects.get(gmail_thread_id=parser.thread_id)
             message = m.Message.objects.get(message_id=parser.message_id)
             attachments_count = m.Attachment.objects.filter(message_id=message).count()
@@ -196,3 +205,207 @@ class UtilsTestCase(TestCase):
         parser = eparser.GmailParser()
         read_messages = u.process_multiple_gmail_threads(self.gmail_service, parser)
         self.assertEqual(type(read_messages), list)
+
+    def test_sync_gmail_history(self):
+        parser = eparser.GmailParser()
+        # no history id stored yet so a full resync has to happen
+        read_messages = u.sync_gmail_history(self.gmail_service, parser)
+        self.assertEqual(type(read_messages), list)
+        sync_state = m.GmailSyncState.load()
+        self.assertEqual(sync_state.history_id, self.gmail_service.history_id)
+
+        # every message in a thread with added messages should be processed
+        read_messages = u.sync_gmail_history(self.gmail_service, parser)
+        history = self.gmail_service.get_history(sync_state.history_id)["history"]
+        self.assertListEqual(
+            sorted(read_messages),
+            sorted(a["message"]["id"] for h in history for a in h["messagesAdded"]),
+        )
+
+        # an expired history id should fall back to a full resync
+        sync_state.update_history_id(self.gmail_service.expired_history_id)
+        read_messages = u.sync_gmail_history(self.gmail_service, parser)
+        self.assertEqual(type(read_messages), list)
+        self.assertEqual(
+            m.GmailSyncState.load().history_id, self.gmail_service.history_id
+        )
+
+    def test_chunked(self):
+        self.assertListEqual(list(u.chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertListEqual(list(u.chunked([], 2)), [])
+
+    def test_process_gmail_threads_batch(self):
+        parser = eparser.GmailParser()
+        thread_ids = [t["id"] for t in self.gmail_service.get_threads()]
+        # a thread that fails to be fetched shouldn't stop the rest from being processed
+        read_messages = u.process_gmail_threads_batch(
+            self.gmail_service, parser, ["does-not-exist"] + thread_ids
+        )
+        self.assertEqual(len(read_messages), len(thread_ids))
+
+    def test_mark_read_in_chunks(self):
+        marked = []
+        service = gmail_mock.GmailServiceMock()
+        service.mark_read_messages = lambda ids, add_label_ids=None: marked.append(ids)
+        parser = eparser.GmailParser()
+        read_count = u.mark_read_in_chunks(
+            service, u.iter_unread_gmail_threads(service, parser), chunk_size=2
+        )
+        self.assertEqual(read_count, sum(len(ids) for ids in marked))
+        self.assertTrue(all(len(ids) <= 2 for ids in marked))
+
+    def test_mark_read_in_chunks_checkpoints(self):
+        marked = []
+        service = gmail_mock.GmailServiceMock()
+        service.mark_read_messages = lambda ids, add_label_ids=None: marked.append(
+            (list(ids), add_label_ids)
+        )
+
+        def crashing_run():
+            yield ["1", "2"]
+            yield ["3"]
+            yield ["4"]
+            raise RuntimeError("crashed")
+
+        with self.assertRaises(RuntimeError):
+            u.mark_read_in_chunks(
+                service, crashing_run(), add_label_ids=["Label_1"], flush_threads=2
+            )
+        # threads that finished before the crash are still marked
+        self.assertListEqual(
+            marked, [(["1", "2", "3"], ["Label_1"]), (["4"], ["Label_1"])]
+        )
+
+    def test_iter_processed_gmail_threads_concurrently(self):
+        thread_ids = ["does-not-exist"] + [t["id"] for t in self.gmail_service.get_threads()]
+        read_messages = list(
+            u.iter_processed_gmail_threads_concurrently(
+                thread_ids, gmail_mock.GmailServiceMock, eparser.GmailParser, 3
+            )
+        )
+        # the thread that couldn't be fetched is skipped and the rest keep their order
+        self.assertListEqual(
+            read_messages,
+            [
+                [msg["id"] for msg in self.gmail_service.get_thread(thread_id)["messages"]]
+                for thread_id in thread_ids[1:]
+            ],
+        )
+
+    def test_create_db_entries(self):
+        parser = eparser.GmailParser()
+        for gmail_thread_id in self.gmail_service.get_threads():
+            thread = self.gmail_service.get_thread(gmail_thread_id["id"])
+            parsed_messages = []
+            for msg in thread["messages"]:
+                parser.parse(msg)
+                parsed_messages.append(parser.as_dict())
+            created = u.create_db_entries(parsed_messages)
+            self.assertEqual(len(created), len(parsed_messages))
+            message_count = m.Message.objects.count()
+            attachment_count = m.Attachment.objects.count()
+            # writing the same thread again shouldn't create anything new
+            self.assertListEqual(u.create_db_entries(parsed_messages), created)
+            self.assertEqual(m.Message.objects.count(), message_count)
+            self.assertEqual(m.Attachment.objects.count(), attachment_count)
+            for parsed_message, was_created in zip(parsed_messages, created):
+                self.assertEqual(
+                    m.Message.objects.filter(message_id=parsed_message["message_id"]).exists(),
+                    was_created,
+                )
+
+    def test_ingestion_context(self):
+        context = ing.IngestionContext()
+        self.assertFalse(context.user_exists("new_user@test.com"))
+        self.assertEqual(
+            context.job_id("Job that does not exist"),
+            m.Job.objects.get(name=c.FIELD_VALUE_UNKNOWN_JOB).pk,
+        )
+        # lookups are cached for the rest of the run
+        with self.assertNumQueries(0):
+            context.refresh_if_stale()
+            context.user_exists("new_user@test.com")
+            context.job_id("Test Job")
+        # until one of the models is saved
+        get_user_model().objects.get_or_create(email="new_user@test.com")
+        context.refresh_if_stale()
+        self.assertTrue(context.user_exists("new_user@test.com"))
+
+    def test_process_gmail_threads_batch_two_phase(self):
+        parser = eparser.GmailParser()
+        context = ing.IngestionContext(two_phase_fetch=True)
+        thread_ids = [t["id"] for t in self.gmail_service.get_threads()]
+        two_phase = u.process_gmail_threads_batch(
+            self.gmail_service, parser, thread_ids, context
+        )
+        message_count = m.Message.objects.count()
+        # every message is already stored so nothing should be downloaded in full
+        threads = [self.gmail_service.get_thread(thread_id) for thread_id in thread_ids]
+        self.assertFalse(
+            any(u.select_messages_to_store(threads, parser, context).values())
+        )
+        full = u.process_gmail_threads_batch(self.gmail_service, parser, thread_ids)
+        self.assertListEqual(two_phase, full)
+        self.assertEqual(m.Message.objects.count(), message_count)
+
+    def test_renew_gmail_watch(self):
+        self.assertTrue(u.renew_gmail_watch(self.gmail_service, "projects/p/topics/t"))
+        self.assertIsNotNone(m.GmailSyncState.load().watch_expiration)
+        # the watch is good for a week so it isn't renewed again right away
+        self.assertFalse(u.renew_gmail_watch(self.gmail_service, "projects/p/topics/t"))
+        self.assertTrue(
+            u.renew_gmail_watch(self.gmail_service, "projects/p/topics/t", force=True)
+        )
+
+    def test_iter_gmail_history_resumes(self):
+        parser = eparser.GmailParser()
+        m.GmailSyncState.load().update_history_id(50)
+        thread_ids = [t["id"] for t in self.gmail_service.get_threads()]
+        context = ing.IngestionContext()
+        context.resume_after_thread_id = thread_ids[0]
+        # nothing was added to the mailbox since the interrupted run listed the history
+        context.resume_history_records = len(self.gmail_service.get_history(50)["history"])
+        read_messages = list(
+            u.iter_gmail_history(self.gmail_service, parser, context=context)
+        )
+        # the first thread was committed by the interrupted run
+        self.assertEqual(len(read_messages), len(thread_ids) - 1)
+        self.assertEqual(context.counters["threads_seen"], len(thread_ids) - 1)
+        self.assertEqual(context.last_thread_id, thread_ids[-1])
+
+    def test_dead_letter_messages(self):
+        parser = eparser.GmailParser()
+        thread = next(
+            copy.deepcopy(t)
+            for t in self.gmail_service.threads["threads"]
+            if len(t["messages"]) > 1
+        )
+        messages = thread["messages"]
+        poison = messages[-1]
+        payload = poison.pop("payload")
+        read_messages = u.process_single_gmail_thread(messages, parser)
+        # the bad message is still marked as read and the rest of the thread is stored
+        self.assertListEqual(read_messages, [msg["id"] for msg in messages])
+        self.assertFalse(m.Message.objects.filter(message_id=poison["id"]).exists())
+        dead_letter = m.DeadLetterMessage.objects.get(message_id=poison["id"])
+        self.assertEqual(dead_letter.stage, m.DeadLetterMessage.Stage.PARSE)
+        self.assertEqual(dead_letter.attempts, 1)
+        self.assertGreater(dead_letter.next_attempt_at, timezone.now())
+
+        # it isn't retried until its backoff is over
+        self.assertEqual(u.retry_dead_letters(parser), 0)
+        dead_letter.payload = dict(poison, payload=payload)
+        dead_letter.next_attempt_at = timezone.now()
+        dead_letter.save()
+        self.assertEqual(u.retry_dead_letters(parser), 1)
+        dead_letter.refresh_from_db()
+        self.assertEqual(dead_letter.status, m.DeadLetterMessage.Status.RESOLVED)
+
+        for _ in range(c.DEAD_LETTER_MAX_ATTEMPTS):
+            dead_letter = m.DeadLetterMessage.objects.record(
+                {"id": "poison", "threadId": "poison"},
+                m.DeadLetterMessage.Stage.PARSE,
+                AssertionError("Payload cannot be None"),
+            )
+        self.assertEqual(m.DeadLetterMessage.objects.filter(message_id="poison").count(), 1)
+        self.assertEqual(dead_letter.status, m.DeadLetterMessage.Status.GIVEN_UP)
@@ -1,8 +1,13 @@
+import json
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
+from ... import ingestion_worker
 from ... import models as m
+from ... import utils as u
 from .. import utils as testu
 
 
@@ -42,6 +47,11 @@ class ApiTestCase(TestCase):
         # TODO cannot test a successful auth of this view because of how
         # gmail access/refresh tokens are saved
         # basic_auth_check(url, user.email, 200)
+        # with a live ingestion worker the view only requests a sync
+        m.IngestionHeartbeat.load().beat(status=m.IngestionHeartbeat.Status.IDLE)
+        user = get_user_model().objects.first()
+        testu.basic_auth_check(url, user.email, 202)
+        self.assertTrue(m.IngestionHeartbeat.load().sync_requested)
 
     def test_notify_users_of_open_messages(self):
         # TODO test that only threads with users that have the can_notify set to True and
@@ -50,3 +60,40 @@ class ApiTestCase(TestCase):
         testu.basic_auth_check(url, "", 401)
         user = get_user_model().objects.first()
         testu.basic_auth_check(url, user.email, 200)
+
+    @override_settings(GMAIL_PUSH_VERIFICATION_TOKEN="push-token")
+    def test_gmail_push_notification(self):
+        client = Client()
+        url = reverse("gmail_push_notification")
+        sync_state = m.GmailSyncState.load()
+        sync_state.email_address = "test@test.com"
+        sync_state.update_history_id(100)
+
+        def post(email, history_id, token="push-token"):
+            body = json.dumps(u.encode_gmail_push_notification(email, history_id))
+            return client.post(
+                f"{url}?token={token}", body, content_type="application/json"
+            )
+
+        self.assertEqual(post("test@test.com", 101, token="wrong").status_code, 403)
+        # malformed notifications are dropped instead of being redelivered
+        self.assertEqual(
+            client.post(f"{url}?token=push-token", "{}", content_type="application/json").status_code,
+            204,
+        )
+        # nothing changed since the last sync or the notification is for another mailbox
+        self.assertEqual(post("test@test.com", 100).status_code, 204)
+        self.assertEqual(post("other@test.com", 101).status_code, 204)
+        self.assertFalse(m.IngestionHeartbeat.load().sync_requested)
+
+        # without a live ingestion worker the sync runs inside of the request
+        with mock.patch.object(
+            ingestion_worker, "run_gmail_ingestion", return_value=2
+        ) as run_gmail_ingestion:
+            self.assertEqual(post("TEST@test.com", 101).status_code, 200)
+        run_gmail_ingestion.assert_called_once_with()
+        self.assertFalse(m.IngestionHeartbeat.load().sync_requested)
+
+        m.IngestionHeartbeat.load().beat(status=m.IngestionHeartbeat.Status.IDLE)
+        self.assertEqual(post("TEST@test.com", 101).status_code, 202)
+        self.assertTrue(m.IngestionHeartbeat.load().sync_requested)
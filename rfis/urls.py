@@ -33,6 +33,11 @@ urlpatterns = [
         v.notify_users_of_open_messages,
         name="notify_users_of_open_messages",
     ),
+    path(
+        "gmail-api/push-notification/",  # form: ?token=verification-token
+        v.gmail_push_notification,
+        name="gmail_push_notification",
+    ),
     path(
         "gmail-api/gmail-oauth-callback/",
         v.GmailOAuthCallback.as_view(),
@@ -1,8 +1,12 @@
 import base64
+import collections
+import datetime
 import itertools
 import json
 import math
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
 import dateparser
@@ -10,12 +14,16 @@ from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.models import Permission
 from django.core.files.storage import default_storage
+from django.db import connection, transaction
 from django.db.models import Q
 from django.http import HttpResponse
+from django.utils import timezone
 from storages.backends.s3boto3 import S3Boto3Storage, S3Boto3StorageFile
 from thefuzz import fuzz, process
 
 from . import constants as c
+from . import email_parser as e_parser
+from . import ingestion as ing
 from . import models as m
 
 import logging
@@ -34,6 +42,16 @@ def load_file(path, transform_file=lambda f: f, mode="rb"):
     return transform_file(default_storage.open(tail, mode))
 
 
+def chunked(iterable, size):
+    """
+    Splits any iterable into lists of at most size items without
+    loading the whole iterable into memory.
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
 def can_close_thread(cleaned_form_data: dict):
     job = cleaned_form_data.get("job_id")  # an instance of the Job model
     accepted_answer = cleaned_form_data.get("accepted_answer")
@@ -75,7 +93,7 @@ def can_close_thread(cleaned_form_data: dict):
             )
     return True, ""
 
-def should_create_thread(gmail_thread_id, from_email):
+def should_create_thread(gmail_thread_id, from_email, context=None):
     """
     Cases:
         User exist but the Thread does not -> True
@@ -85,64 +103,171 @@ def should_create_thread(gmail_thread_id, from_email):
     """
     # TODO if user doesnt exist dont accept a message from them. May need to add a setting for this
 
-    user_exists = get_user_model().objects.filter(email=from_email).exists()
+    if context is not None:
+        context.refresh_if_stale()
+        user_exists = context.user_exists(from_email)
+    else:
+        user_exists = get_user_model().objects.filter(email=from_email).exists()
     thread_exists = m.Thread.objects.filter(gmail_thread_id=gmail_thread_id).exists()
     logger.info(f"function: should_create_thread || thread id: {gmail_thread_id} || email address: {from_email} || user_exists: {user_exists} || thread_exists: {thread_exists}")
     return user_exists or thread_exists
 
 
 def create_db_entry_from_parser(
-    g_parser: "rfis.email_parser.GmailParser", gmail_message
+    g_parser: "rfis.email_parser.GmailParser",
+    gmail_message,
+    context: Optional[ing.IngestionContext] = None,
 ) -> bool:
+    """
+    Parses a single Gmail message and writes it to the database. Callers storing
+    several messages should pass the same context to every call.
+    """
     g_parser.parse(gmail_message)
-    if not should_create_thread(g_parser.thread_id, g_parser.fromm):
-        logger.info(f"Not creating thread for user || function: create_db_entry_from_parser || thread id: {g_parser.thread_id} || from email address: {g_parser.fromm}")
-        return False
+    return create_db_entry(g_parser.as_dict(), context)
 
-    logger.info(f"Creating thread for user || function: create_db_entry_from_parser || thread info: {repr(g_parser)}")
-    time_message_received = dateparser.parse(
-        g_parser.date,
+
+def create_db_entry(parsed_message: dict, context=None) -> bool:
+    """
+    Writes a message that has already been parsed by GmailParser.as_dict
+    to the database. Parsing and writing are kept apart so messages can be
+    parsed on worker threads while only one thread writes to the database.
+    """
+    return create_db_entries([parsed_message], context)[0]
+
+
+def parse_time_received(date):
+    return dateparser.parse(
+        date,
         settings={
             "TO_TIMEZONE": settings.TIME_ZONE,
             "RETURN_AS_TIMEZONE_AWARE": True,
         },
     )
-    # neither of these two should be created at this point
-    job = m.Job.objects.get(name=g_parser.job_name)
-    message_type = m.ThreadType.objects.get(name=g_parser.thread_type)
-    # The user may not exist because they were not the ones who sent
-    # the very first message, but a thread will never be created without a user
-    user: Optional[m.MyUser] = (
-        get_user_model().objects.filter(email=g_parser.fromm).first()
-    )
 
-    message_thread, mtcreated = m.Thread.objects.get_or_create(
-        gmail_thread_id=g_parser.thread_id,
-        job_id=job,
-        thread_type=message_type,
-        time_received=time_message_received,
-        subject=g_parser.subject,
-        message_thread_initiator=user,
-    )
-    message, mcreated = m.Message.objects.get_or_create(
-        message_id=g_parser.message_id,
-        message_thread_id=message_thread,
-        subject=g_parser.subject,
-        body=g_parser.body,
-        debug_unparsed_body=g_parser.debug_unparsed_body,
-        fromm=g_parser.fromm,
-        to=g_parser.to,
-        cc=g_parser.cc,
-        time_received=time_message_received,
-    )
-    for f_info in g_parser.files_info:
-        attachment, created = m.Attachment.objects.get_or_create(
-            filename=f_info["filename"],
-            gmail_attachment_id=f_info["gmail_attachment_id"],
-            time_received=time_message_received,
-            message_id=message,
+
+def create_db_entries(
+    parsed_messages: List[dict], context: Optional[ing.IngestionContext] = None
+) -> List[bool]:
+    """
+    Writes every parsed message of a single Gmail thread, in order, inside one transaction
+    using a handful of bulk queries instead of several queries per message. Returns whether
+    each message was allowed to be stored, following the same rules as should_create_thread.
+
+    Threads and messages are inserted with ON CONFLICT DO NOTHING on their unique gmail ids
+    and the thread row is locked before any messages are written so two runs processing
+    the same thread at the same time can't create duplicate attachments.
+
+    Users, jobs and thread types are looked up through the ingestion context which
+    should be shared by every thread in a run so they are only loaded once.
+    """
+    if not parsed_messages:
+        return []
+    context = context or ing.IngestionContext()
+    context.refresh_if_stale()
+    gmail_thread_id = parsed_messages[0]["thread_id"]
+    assert all(
+        p["thread_id"] == gmail_thread_id for p in parsed_messages
+    ), "Every message has to belong to the same thread"
+
+    with context.timed("write"), transaction.atomic():
+        message_thread = (
+            m.Thread.objects.select_for_update()
+            .filter(gmail_thread_id=gmail_thread_id)
+            .first()
         )
-    return True
+        thread_exists = message_thread is not None
+        should_create = []
+        for p in parsed_messages:
+            # once the first message from a user starts the thread the rest follow it
+            thread_exists = thread_exists or context.user_exists(p["fromm"])
+            should_create.append(thread_exists)
+        logger.info(f"function: create_db_entries || thread id: {gmail_thread_id} || email addresses: {[p['fromm'] for p in parsed_messages]} || should_create: {should_create}")
+        to_create = [p for p, create in zip(parsed_messages, should_create) if create]
+        if not to_create:
+            return should_create
+
+        times_received = {
+            p["message_id"]: parse_time_received(p["date"]) or timezone.now()
+            for p in to_create
+        }
+        if message_thread is None:
+            message_thread = _create_thread(
+                gmail_thread_id, to_create[0], times_received, context
+            )
+
+        existing_message_ids = set(
+            m.Message.objects.filter(
+                message_id__in=[p["message_id"] for p in to_create]
+            ).values_list("message_id", flat=True)
+        )
+        new_messages = {
+            p["message_id"]: p for p in to_create if p["message_id"] not in existing_message_ids
+        }
+        m.Message.objects.bulk_create(
+            [
+                m.Message(
+                    message_id=p["message_id"],
+                    message_thread_id=message_thread,
+                    subject=p["subject"],
+                    body=p["body"],
+                    debug_unparsed_body=p["debug_unparsed_body"],
+                    fromm=p["fromm"],
+                    to=p["to"],
+                    cc=p["cc"],
+                    time_received=times_received[p["message_id"]],
+                )
+                for p in new_messages.values()
+            ],
+            ignore_conflicts=True,
+        )
+        message_pks = dict(
+            m.Message.objects.filter(message_id__in=list(new_messages)).values_list(
+                "message_id", "pk"
+            )
+        )
+        attachments = []
+        for message_id, p in new_messages.items():
+            # the same attachment can show up in more than one part of a message
+            for filename, gmail_attachment_id in dict.fromkeys(
+                (f_info["filename"], f_info["gmail_attachment_id"])
+                for f_info in p["files_info"]
+            ):
+                attachments.append(
+                    m.Attachment(
+                        filename=filename,
+                        gmail_attachment_id=gmail_attachment_id,
+                        time_received=times_received[message_id],
+                        message_id_id=message_pks[message_id],
+                    )
+                )
+        m.Attachment.objects.bulk_create(attachments)
+    context.count(messages_created=len(new_messages))
+    logger.info(f"Created messages for thread || function: create_db_entries || thread id: {gmail_thread_id} || message ids: {list(new_messages)}")
+    return should_create
+
+
+def _create_thread(gmail_thread_id, first_message, times_received, context):
+    initiator_email = first_message["fromm"]
+    # bulk_create skips Thread.save and the field defaults so they have to be set here
+    m.Thread.objects.bulk_create(
+        [
+            m.Thread(
+                gmail_thread_id=gmail_thread_id,
+                job_id_id=context.job_id(first_message["job_name"]),
+                thread_type_id=context.thread_type_id(first_message["thread_type"]),
+                thread_group_id=context.thread_group_sentinel_id,
+                thread_topic_id=context.thread_topic_sentinel_id,
+                time_received=times_received[first_message["message_id"]],
+                due_date=timezone.now() + datetime.timedelta(days=7),
+                subject=first_message["subject"] or "(No Subject)",
+                message_thread_initiator_id=context.user_ids[initiator_email],
+                original_initiator=initiator_email,
+            )
+        ],
+        ignore_conflicts=True,
+    )
+    # another run may have inserted the thread first so always read it back
+    return m.Thread.objects.select_for_update().get(gmail_thread_id=gmail_thread_id)
 
 
 def find_earliest_message_index(messages):
@@ -156,7 +281,7 @@ def find_earliest_message_index(messages):
     return earliest_message_index
 
 
-def process_single_gmail_thread(messages, g_parser):
+def process_single_gmail_thread(messages, g_parser, context=None):
     read_messages = []
     if not messages:
         return read_messages
@@ -167,31 +292,537 @@ def process_single_gmail_thread(messages, g_parser):
         earliest_message = messages[earliest_message_index]
         first_message = messages[0]
         earliest_message, first_message = first_message, earliest_message
-    for msg in messages:
-        created = create_db_entry_from_parser(g_parser, msg)
+    context = context or ing.IngestionContext()
+    parsed_messages, parse_failures = parse_gmail_messages(messages, g_parser, context)
+    store_gmail_thread(messages, parsed_messages, parse_failures, context)
+    context.thread_committed(messages[0]["threadId"], len(messages))
+    # don't want to keep reading spam mail so mark an email as read
+    # even if it wasn't put into the database
+    read_messages.extend(msg["id"] for msg in messages)
+    return read_messages
+
+
+def parse_gmail_messages(messages, g_parser, context):
+    """
+    Returns (parsed messages, [(message, error)]) so one message that can't be
+    parsed doesn't stop the rest of its thread from being stored.
+    """
+    parsed_messages = []
+    failures = []
+    with context.timed("parse"):
+        for msg in messages:
+            try:
+                g_parser.parse(msg)
+                parsed_messages.append(g_parser.as_dict())
+            except Exception as error:
+                failures.append((msg, error))
+    return parsed_messages, failures
+
+
+def parse_gmail_threads_in_processes(threads_messages, context):
+    """
+    Parses every message of {thread id: [messages]} on context.parse_processes
+    processes. Returns {thread id: (parsed messages, [(message, error)])} with the
+    same dicts parse_gmail_messages returns.
+    """
+    parsed_threads = {thread_id: ([], []) for thread_id in threads_messages}
+    with context.timed("parse"):
+        parsed_messages, failures = e_parser.parse_messages_in_processes(
+            itertools.chain.from_iterable(threads_messages.values()),
+            max_workers=context.parse_processes,
+        )
+    for parsed in parsed_messages:
+        parsed_threads[parsed.thread_id][0].append(parsed.as_dict())
+    for msg, error in failures:
+        parsed_threads[msg["threadId"]][1].append((msg, error))
+    return parsed_threads
+
+
+def store_gmail_thread(messages, parsed_messages, parse_failures, context):
+    """
+    Writes the parsed messages of a thread and sends every message that couldn't be
+    parsed or written to the dead letter queue to be retried later.
+    Returns True when the thread was written.
+    """
+    for msg, error in parse_failures:
+        logger.error(f"Failed to parse message || function: store_gmail_thread || message id: {(msg or {}).get('id')} || error: {error!r}")
+        m.DeadLetterMessage.objects.record(msg, m.DeadLetterMessage.Stage.PARSE, error)
+    context.count(messages_failed=len(parse_failures))
+    try:
+        stored = create_db_entries(parsed_messages, context)
+    except Exception as error:
+        parsed_ids = {p["message_id"] for p in parsed_messages}
+        logger.exception(f"Failed to write thread || function: store_gmail_thread || message ids: {parsed_ids}")
+        for msg in messages:
+            if msg["id"] in parsed_ids:
+                m.DeadLetterMessage.objects.record(msg, m.DeadLetterMessage.Stage.WRITE, error)
+        context.count(threads_failed=1, messages_failed=len(parsed_ids))
+        return False
+    if parse_failures:
+        block_messages_after_failures(messages, parsed_messages, stored, parse_failures, context)
+    return True
+
+
+def block_messages_after_failures(messages, parsed_messages, stored, parse_failures, context):
+    """
+    A message that failed may have been the one that would have started its thread, so
+    the later messages that were turned away go to the dead letter queue as well and
+    are only given up on once the thread still doesn't exist after their retries.
+    """
+    failed_ids = {msg["id"] for msg, _ in parse_failures}
+    first_failure = next(i for i, msg in enumerate(messages) if msg["id"] in failed_ids)
+    turned_away = {
+        p["message_id"] for p, created in zip(parsed_messages, stored) if not created
+    }
+    blocked = [msg for msg in messages[first_failure:] if msg["id"] in turned_away]
+    error = LookupError(f"Thread {messages[0]['threadId']} has messages that failed")
+    for msg in blocked:
+        m.DeadLetterMessage.objects.record(msg, m.DeadLetterMessage.Stage.BLOCKED, error)
+    context.count(messages_failed=len(blocked))
+
+
+def retry_dead_letters(g_parser, context=None, limit=100) -> int:
+    """
+    Parses and writes the dead letter messages that are due for another attempt
+    one at a time. Returns the number of messages that were stored this time.
+    Blocked messages stay in the queue until their thread has been stored.
+    """
+    context = context or ing.IngestionContext()
+    resolved = 0
+    for dead_letter in m.DeadLetterMessage.objects.due()[:limit]:
+        try:
+            g_parser.parse(dead_letter.payload)
+            (created,) = create_db_entries([g_parser.as_dict()], context)
+            if not created and dead_letter.stage == m.DeadLetterMessage.Stage.BLOCKED:
+                raise LookupError(f"Thread {dead_letter.thread_id} hasn't been stored yet")
+        except Exception as error:
+            logger.warning(f"Dead letter message failed again || function: retry_dead_letters || message id: {dead_letter.message_id} || attempts: {dead_letter.attempts + 1} || error: {error!r}")
+            dead_letter.failed(error)
+            continue
+        dead_letter.resolve()
+        resolved += 1
+    return resolved
+
+
+def select_messages_to_store(threads_metadata, g_parser, context):
+    """
+    Takes threads fetched with format="metadata" and returns {thread id: [message ids]}
+    of the messages that are worth downloading in full. Messages that are already in the
+    database and messages that should_create_thread would turn away are left out.
+    """
+    threads_messages = {
+        thread["id"]: [g_parser.parse_metadata(msg) for msg in thread.get("messages") or []]
+        for thread in threads_metadata
+    }
+    known_message_ids = set(
+        m.Message.objects.filter(
+            message_id__in=[
+                msg["message_id"] for msgs in threads_messages.values() for msg in msgs
+            ]
+        ).values_list("message_id", flat=True)
+    )
+    existing_thread_ids = set(
+        m.Thread.objects.filter(gmail_thread_id__in=list(threads_messages)).values_list(
+            "gmail_thread_id", flat=True
+        )
+    )
+    to_store = {}
+    for thread_id, msgs in threads_messages.items():
+        thread_exists = thread_id in existing_thread_ids
+        to_store[thread_id] = []
+        for msg in msgs:
+            # once the first message from a user starts the thread the rest follow it
+            thread_exists = thread_exists or context.user_exists(msg["fromm"])
+            if thread_exists and msg["message_id"] not in known_message_ids:
+                to_store[thread_id].append(msg["message_id"])
+    return to_store
+
+
+def process_gmail_threads_batch(service, g_parser, thread_ids, context=None):
+    """
+    Fetches the threads in batches and returns a list of read message ids
+    for every thread. Threads that couldn't be fetched are logged and skipped
+    so they stay unread and get picked up again by the next run.
+    """
+    if context is not None and context.two_phase_fetch:
+        return process_gmail_threads_batch_two_phase(service, g_parser, thread_ids, context)
+    context = context or ing.IngestionContext()
+    read_messages: list[list[int]] = []
+    with context.timed("fetch"):
+        threads, errors = service.get_threads_batch(thread_ids)
+    context.count(threads_failed=len(errors))
+    for thread_id, error in errors.items():
+        logger.error(f"Failed to fetch thread || function: process_gmail_threads_batch || thread id: {thread_id} || error: {error}")
+    if context.parse_processes > 1:
+        threads_messages = {
+            thread_id: threads[thread_id].get("messages") or []
+            for thread_id in thread_ids
+            if thread_id in threads
+        }
+        parsed_threads = parse_gmail_threads_in_processes(threads_messages, context)
+        for thread_id, messages in threads_messages.items():
+            store_gmail_thread(messages, *parsed_threads[thread_id], context)
+            context.thread_committed(thread_id, len(messages))
+            read_messages.append([msg["id"] for msg in messages])
+        return read_messages
+    for thread_id in thread_ids:
+        if thread := threads.get(thread_id):
+            read_messages.append(
+                process_single_gmail_thread(thread.get("messages"), g_parser, context)
+            )
+    return read_messages
+
+
+def process_gmail_threads_batch_two_phase(service, g_parser, thread_ids, context):
+    """
+    Same as process_gmail_threads_batch but only the From and Subject headers of every
+    message are fetched first. Only the messages select_messages_to_store picks are
+    then downloaded in full and parsed, which skips spam and already stored messages.
+    """
+    read_messages: list[list[int]] = []
+    with context.timed("fetch"):
+        threads, errors = service.get_threads_batch(
+            thread_ids, format="metadata", metadata_headers=c.GMAIL_METADATA_HEADERS
+        )
+    context.count(threads_failed=len(errors))
+    for thread_id, error in errors.items():
+        logger.error(f"Failed to fetch thread metadata || function: process_gmail_threads_batch_two_phase || thread id: {thread_id} || error: {error}")
+    to_store = select_messages_to_store(
+        [threads[thread_id] for thread_id in thread_ids if thread_id in threads],
+        g_parser,
+        context,
+    )
+    with context.timed("fetch"):
+        messages, errors = service.get_messages_batch(
+            itertools.chain.from_iterable(to_store.values())
+        )
+    for message_id, error in errors.items():
+        logger.error(f"Failed to fetch message || function: process_gmail_threads_batch_two_phase || message id: {message_id} || error: {error}")
+    for thread_id in thread_ids:
+        if thread_id not in threads:
+            continue
+        if any(message_id in errors for message_id in to_store[thread_id]):
+            # leave the whole thread unread so it's retried by the next run
+            context.count(threads_failed=1)
+            continue
+        full_messages = [messages[message_id] for message_id in to_store[thread_id]]
+        parsed_messages, parse_failures = parse_gmail_messages(
+            full_messages, g_parser, context
+        )
+        store_gmail_thread(full_messages, parsed_messages, parse_failures, context)
+        message_ids = [msg["id"] for msg in threads[thread_id].get("messages") or []]
+        context.thread_committed(thread_id, len(message_ids))
         # don't want to keep reading spam mail so mark an email as read
         # even if it wasn't put into the database
-        read_messages.append(g_parser.message_id)
+        read_messages.append(message_ids)
     return read_messages
 
 
+def iter_processed_gmail_threads(
+    service, g_parser, thread_ids, max_workers=1, context=None
+):
+    """
+    Yields the read message ids of every thread while only fetching
+    one batch of threads at a time. When max_workers is more than one the
+    threads are fetched and parsed on a pool of workers instead.
+    """
+    context = context or ing.IngestionContext()
+    if max_workers > 1:
+        # services that are safe to share between threads hand themselves out
+        service_factory = getattr(service, "worker_factory", type(service))
+        yield from iter_processed_gmail_threads_concurrently(
+            thread_ids, service_factory, type(g_parser), max_workers, context
+        )
+        return
+    for chunk in chunked(thread_ids, c.GMAIL_API_MAX_BATCH_SIZE):
+        yield from process_gmail_threads_batch(service, g_parser, chunk, context)
+
+
+def iter_processed_gmail_threads_concurrently(
+    thread_ids, service_factory, parser_factory, max_workers, context=None
+):
+    """
+    Fetches and parses threads on a pool of worker threads while the calling thread
+    does every database write in the same order the thread ids were given. Yields
+    the read message ids of every thread just like iter_processed_gmail_threads.
+
+    httplib2 isn't thread safe so every worker checks out its own service and
+    parser, which are built up front on the calling thread. Workers still open
+    their own database connection to read: the parser checks the vocabulary
+    version in the database cache and rebuilds the vocabulary from the job and
+    thread type tables when it changed, and with context.two_phase_fetch the
+    stored messages are looked up. A worker never writes and closes its
+    connection after every thread it fetches and parses, so none is left open
+    when the pool finishes.
+    """
+    context = context or ing.IngestionContext()
+    # load the lookups on this thread before the workers start reading them
+    context.refresh_if_stale()
+    context.user_ids
+    workers = queue.SimpleQueue()
+    for _ in range(max_workers):
+        workers.put((service_factory(), parser_factory()))
+
+    def fetch_and_parse(thread_id):
+        service, g_parser = workers.get()
+        try:
+            if context.two_phase_fetch:
+                with context.timed("fetch"):
+                    thread = service.get_thread(
+                        thread_id,
+                        format="metadata",
+                        metadata_headers=c.GMAIL_METADATA_HEADERS,
+                    )
+                to_store = select_messages_to_store([thread], g_parser, context)[thread_id]
+                with context.timed("fetch"):
+                    messages, errors = service.get_messages_batch(to_store)
+                if errors:
+                    raise next(iter(errors.values()))
+                messages = [messages[message_id] for message_id in to_store]
+            else:
+                with context.timed("fetch"):
+                    thread = service.get_thread(thread_id)
+                messages = thread.get("messages") or []
+            # dead letters are written by the calling thread with the rest of the thread
+            parsed_messages, parse_failures = parse_gmail_messages(
+                messages, g_parser, context
+            )
+            return (
+                messages,
+                parsed_messages,
+                parse_failures,
+                [msg["id"] for msg in thread.get("messages") or []],
+            )
+        finally:
+            workers.put((service, g_parser))
+            # pool threads outlive the request cycle that would otherwise close it
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # only keep a couple of threads per worker in flight so memory stays flat
+        in_flight = collections.deque()
+        thread_ids = iter(thread_ids)
+        while True:
+            for thread_id in itertools.islice(thread_ids, max_workers * 2 - len(in_flight)):
+                in_flight.append((thread_id, executor.submit(fetch_and_parse, thread_id)))
+            if not in_flight:
+                return
+            thread_id, future = in_flight.popleft()
+            try:
+                messages, parsed_messages, parse_failures, message_ids = future.result()
+            except Exception as error:
+                logger.error(f"Failed to fetch thread || function: iter_processed_gmail_threads_concurrently || thread id: {thread_id} || error: {error}")
+                context.count(threads_failed=1)
+                continue
+            store_gmail_thread(messages, parsed_messages, parse_failures, context)
+            context.thread_committed(thread_id, len(message_ids))
+            # don't want to keep reading spam mail so mark an email as read
+            # even if it wasn't put into the database
+            yield message_ids
+
+
+def iter_unread_gmail_threads(
+    service, g_parser, query_params="label:inbox is:unread", max_workers=1, context=None
+):
+    context = context or ing.IngestionContext()
+    thread_ids = (
+        thread_info["id"]
+        for thread_info in context.timed_iter("list", service.iter_threads(query_params))
+    )
+    yield from iter_processed_gmail_threads(
+        service, g_parser, thread_ids, max_workers, context
+    )
+
+
 def process_multiple_gmail_threads(
-    service, g_parser, query_params="label:inbox is:unread"
+    service, g_parser, query_params="label:inbox is:unread", max_workers=1, context=None
 ):
-    unread_threads = service.get_threads(query_params)
-    if not unread_threads:
-        logger.warn(f"0 unread threads || function: process_multiple_gmail_threads || query_params: {query_params}")
-    read_messages: list[list[int]] = []
-    for thread_info in unread_threads:
-        thread = service.get_thread(thread_info["id"])
-        read_messages.append(
-            process_single_gmail_thread(thread.get("messages"), g_parser)
+    msg_ids = list(
+        itertools.chain.from_iterable(
+            iter_unread_gmail_threads(
+                service, g_parser, query_params, max_workers, context
+            )
         )
-    msg_ids = list(itertools.chain(*read_messages))
+    )
+    if not msg_ids:
+        logger.warn(f"0 unread threads || function: process_multiple_gmail_threads || query_params: {query_params}")
     logger.info(f"Message ids that will be marked as read || function: process_multiple_gmail_threads || message ids: {msg_ids}")
     return msg_ids
 
 
+def mark_read_in_chunks(
+    service,
+    read_messages,
+    chunk_size=c.GMAIL_API_MAX_BATCH_MODIFY_SIZE,
+    add_label_ids=None,
+    flush_threads=c.GMAIL_MARK_READ_FLUSH_THREADS,
+    context=None,
+) -> int:
+    """
+    Consumes an iterable of per thread read message id lists, each one yielded after
+    its thread was committed, and marks them as read at most chunk_size ids at a time.
+    Pending ids are also marked every flush_threads threads and when the iterable stops,
+    even with an error, so a crashed run only redoes the threads after the last flush.
+    Returns the number of messages marked as read.
+    """
+    context = context or ing.IngestionContext()
+    total = 0
+    pending = []
+
+    def flush(message_ids):
+        nonlocal total
+        if not message_ids:
+            return
+        with context.timed("mark_read"):
+            service.mark_read_messages(message_ids, add_label_ids=add_label_ids)
+        context.count(messages_marked_read=len(message_ids))
+        total += len(message_ids)
+        logger.info(f"Marked messages as read || function: mark_read_in_chunks || message ids: {message_ids}")
+
+    try:
+        for thread_count, message_ids in enumerate(read_messages, start=1):
+            pending.extend(message_ids)
+            while len(pending) >= chunk_size:
+                flush(pending[:chunk_size])
+                del pending[:chunk_size]
+            if thread_count % flush_threads == 0:
+                flush(pending)
+                pending = []
+    finally:
+        # every id that is pending belongs to a thread that was already committed
+        flush(pending)
+    return total
+
+
+def exclude_label_query(query_params, label_name):
+    # Gmail search replaces spaces in label names with dashes
+    return f"{query_params} -label:{label_name.replace(' ', '-')}"
+
+
+def get_history_thread_ids(history):
+    """
+    Returns the unique thread ids, in the order they were first seen, of every
+    message that was added in the given Gmail history records.
+    """
+    thread_ids = {}
+    for record in history:
+        for added in record.get("messagesAdded", []):
+            thread_ids[added["message"]["threadId"]] = None
+    return list(thread_ids)
+
+
+def iter_full_gmail_resync(
+    service, g_parser, query_params="label:inbox is:unread", max_workers=1, context=None
+):
+    sync_state = m.GmailSyncState.load()
+    # grab the history id before listing the threads so anything that
+    # arrives during the resync is picked up by the next incremental sync
+    profile = service.get_profile()
+    yield from iter_unread_gmail_threads(
+        service, g_parser, query_params, max_workers, context
+    )
+    sync_state.email_address = profile["emailAddress"]
+    sync_state.update_history_id(profile["historyId"])
+
+
+def iter_gmail_history(
+    service, g_parser, query_params="label:inbox is:unread", max_workers=1, context=None
+):
+    """
+    Only fetches the threads that had messages added since the last sync. Falls back
+    to a full resync when there is no stored history id or when it has expired.
+    The stored history id is only moved forward once every thread has been processed.
+    """
+    sync_state = m.GmailSyncState.load()
+    if not sync_state.history_id:
+        logger.info(f"No history id stored doing a full resync || function: iter_gmail_history || query_params: {query_params}")
+        yield from iter_full_gmail_resync(
+            service, g_parser, query_params, max_workers, context
+        )
+        return
+
+    context = context or ing.IngestionContext()
+    with context.timed("list"):
+        history = service.get_history(sync_state.history_id)
+    if history is None:
+        logger.warning(f"History id has expired doing a full resync || function: iter_gmail_history || history id: {sync_state.history_id}")
+        yield from iter_full_gmail_resync(
+            service, g_parser, query_params, max_workers, context
+        )
+        return
+
+    records = history["history"]
+    thread_ids = get_history_thread_ids(records)
+    context.history_records_listed = len(records)
+    if context.resume_after_thread_id in thread_ids:
+        # an interrupted run already committed every thread up to this one, history
+        # only grows so the records after the ones it listed are messages it never saw
+        committed = thread_ids[: thread_ids.index(context.resume_after_thread_id) + 1]
+        changed = set(get_history_thread_ids(records[context.resume_history_records :]))
+        thread_ids = [t for t in committed if t in changed] + thread_ids[len(committed) :]
+        logger.info(f"Resuming history sync || function: iter_gmail_history || after thread id: {context.resume_after_thread_id}")
+    yield from iter_processed_gmail_threads(
+        service, g_parser, thread_ids, max_workers, context
+    )
+    sync_state.update_history_id(history["historyId"])
+
+
+def sync_gmail_history(service, g_parser, query_params="label:inbox is:unread"):
+    msg_ids = list(
+        itertools.chain.from_iterable(
+            iter_gmail_history(service, g_parser, query_params)
+        )
+    )
+    logger.info(f"Message ids that will be marked as read || function: sync_gmail_history || message ids: {msg_ids}")
+    return msg_ids
+
+
+def renew_gmail_watch(service, topic_name, force=False):
+    """
+    Starts or renews the Gmail watch on topic_name when it expires within a day.
+    Returns True when the watch was renewed.
+    """
+    sync_state = m.GmailSyncState.load()
+    renew_at = timezone.now() + datetime.timedelta(days=1)
+    if not force and sync_state.watch_expiration and sync_state.watch_expiration > renew_at:
+        return False
+    response = service.watch(topic_name)
+    sync_state.watch_expiration = datetime.datetime.fromtimestamp(
+        int(response["expiration"]) / 1000, tz=datetime.timezone.utc
+    )
+    sync_state.save()
+    logger.info(f"Renewed Gmail watch || function: renew_gmail_watch || topic: {topic_name} || expiration: {sync_state.watch_expiration}")
+    return True
+
+
+def encode_gmail_push_notification(email_address, history_id, message_id="1"):
+    """
+    Builds the body of a Pub/Sub push request the same way Google sends
+    it for a Gmail watch notification.
+    """
+    data = json.dumps({"emailAddress": email_address, "historyId": int(history_id)})
+    return {
+        "message": {
+            "data": base64.b64encode(data.encode("utf8")).decode("utf8"),
+            "messageId": str(message_id),
+            "publishTime": timezone.now().isoformat(),
+        },
+        "subscription": "",
+    }
+
+
+def decode_gmail_push_notification(body: bytes) -> Tuple[str, int]:
+    """
+    Returns the (email address, history id) of a Pub/Sub push request body
+    and raises a ValueError when the body isn't a Gmail watch notification.
+    """
+    try:
+        data = json.loads(base64.b64decode(json.loads(body)["message"]["data"]))
+        return data["emailAddress"], int(data["historyId"])
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError(f"Invalid Gmail push notification: {error}") from error
+
+
 def get_permission_object(permission_str):  # rfis.view_message
     app_label, codename = permission_str.split(".")
     perm = Permission.objects.filter(
@@ -232,12 +863,17 @@ def get_highest_possible_match(
     un_modified_match = match
     to_match = string_processor(to_match)
     match = string_processor(match)
-    scores = []
-    for _ in range(len(to_match)):
-        to_match = to_match[:-1]
-        scores.append(fuzz.ratio(match, to_match))
-    # print(f"\nun_modified_match: {un_modified_match} to_match: {to_match} scores: {scores}\n")
-    return un_modified_match, max(scores)
+    best_score = 0
+    for length in range(len(to_match) - 1, 0, -1):
+        # a ratio can't be higher than when every character of the shorter string matches
+        bound = round(200 * min(len(match), length) / (len(match) + length))
+        if bound <= best_score:
+            if length <= len(match):
+                # the bound only gets lower from here on
+                break
+            continue
+        best_score = max(best_score, fuzz.ratio(match, to_match[:length]))
+    return un_modified_match, best_score
 
 
 def save_test_data_from_raw_gmail_message(raw_gmail_message, parsed_message, filename):
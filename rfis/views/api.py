@@ -1,4 +1,6 @@
 import base64
+import logging
+import secrets
 
 from constance import config
 from django.conf import settings
@@ -11,13 +13,18 @@ from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.html import strip_tags
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from .. import constants as c
 from .. import email_parser as e_parser
 from .. import gmail_service as g_service
+from .. import ingestion_worker
 from .. import models as m
 from .. import utils as u
 
+logger = logging.getLogger()
+
 
 class SettingsView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
@@ -111,14 +118,30 @@ class AttachmentDownloadView(LoginRequiredMixin, View):
 
 @u.logged_in_or_basicauth()
 def gmail_get_unread_messages(request, *args, **kwargs):
-    service = g_service.GmailService()
-    g_parser = e_parser.GmailParser()
-    read_messages = u.process_multiple_gmail_threads(service, g_parser)
-    service.mark_read_messages(read_messages)
+    heartbeat = m.IngestionHeartbeat.load()
+    if heartbeat.is_alive:
+        # the ingestion worker does the work so only ask it to sync now
+        heartbeat.request_sync()
+        return JsonResponse(
+            {
+                c.JSON_RESPONSE_MSG_KEY: "A sync was requested from the ingestion worker.",
+                "data": {
+                    "status": heartbeat.status,
+                    "last_heartbeat": heartbeat.last_heartbeat,
+                    "last_run_started": heartbeat.last_run_started,
+                    "last_run_finished": heartbeat.last_run_finished,
+                    "last_run_message_count": heartbeat.last_run_message_count,
+                    "last_error": heartbeat.last_error,
+                },
+            },
+            status=202,
+        )
+    # no worker is running so fall back to syncing inside of the request
+    read_count = ingestion_worker.run_gmail_ingestion()
     return JsonResponse(
         {
             c.JSON_RESPONSE_MSG_KEY: (
-                f"{len(read_messages)} messages were added successfully."
+                f"{read_count} messages were added successfully."
             )
         },
         status=200,
@@ -155,6 +178,52 @@ def notify_users_of_open_messages(request, *args, **kwargs):
     )
 
 
+@csrf_exempt
+@require_POST
+def gmail_push_notification(request, *args, **kwargs):
+    """
+    Receives the Pub/Sub push requests Gmail sends after GmailService.watch and
+    asks the ingestion worker to sync when the mailbox changed since the last sync,
+    or syncs inside of the request when no worker is running. Pub/Sub retries
+    anything that isn't a 2xx so notifications that are ignored, including
+    malformed ones, still return 204.
+    """
+    token = settings.GMAIL_PUSH_VERIFICATION_TOKEN
+    if not token or not secrets.compare_digest(request.GET.get("token", ""), token):
+        return JsonResponse(
+            {c.JSON_RESPONSE_MSG_KEY: "Invalid verification token."}, status=403
+        )
+    try:
+        email_address, history_id = u.decode_gmail_push_notification(request.body)
+    except ValueError as error:
+        logger.warning(f"Ignoring push notification || function: gmail_push_notification || error: {error}")
+        return HttpResponse(status=204)
+
+    sync_state = m.GmailSyncState.load()
+    if sync_state.email_address and email_address.lower() != sync_state.email_address.lower():
+        logger.warning(f"Push notification for another mailbox || function: gmail_push_notification || email: {email_address}")
+        return HttpResponse(status=204)
+    if not sync_state.has_changes_since(history_id):
+        return HttpResponse(status=204)
+    heartbeat = m.IngestionHeartbeat.load()
+    if heartbeat.is_alive:
+        heartbeat.request_sync()
+        return JsonResponse(
+            {c.JSON_RESPONSE_MSG_KEY: f"A sync was requested for history id {history_id}."},
+            status=202,
+        )
+    # no worker is running so fall back to syncing inside of the request
+    read_count = ingestion_worker.run_gmail_ingestion()
+    return JsonResponse(
+        {
+            c.JSON_RESPONSE_MSG_KEY: (
+                f"{read_count} messages were added for history id {history_id}."
+            )
+        },
+        status=200,
+    )
+
+
 ###############################################################################################################################################################
 #                                   End cron views
 ###############################################################################################################################################################
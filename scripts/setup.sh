@@ -6,5 +6,6 @@ python manage.py makemigrations
 python manage.py migrate rfis
 python manage.py migrate database
 python manage.py migrate
+python manage.py createcachetable
 python manage.py initialsetup
 python manage.py collectstatic --noinput
\ No newline at end of file